@@ -13,13 +13,9 @@ __maintainer__ = 'Eric Lapouyade'
 __status__ = 'Beta'
 
 
-from plugin import *
-from host import *
-from response import *
-from collect import *
-from perf import *
-from tools import *
-from mixins import *
+import sys
+import types
+import importlib
 import traceback
 
 import logging
@@ -56,4 +52,57 @@ def debug_listing(data):
 def debug_or_empty(s):
     if logger.getEffectiveLevel() == logging.DEBUG:
         return s
-    return ''
\ No newline at end of file
+    return ''
+
+# Submodules are imported only when one of their names is accessed for the first time :
+# a plugin that only renders a PluginResponse does not have to import textops, dateutil or
+# the collect machinery. Keep this table in sync with submodules' __all__.
+_submodules_names = {
+    'plugin'   : ['ActivePlugin'],
+    'host'     : ['Host'],
+    'response' : ['ResponseLevel', 'PluginResponse', 'OK', 'WARNING', 'CRITICAL', 'UNKNOWN',
+                  'LevelComment'],
+    'collect'  : ['search_invalid_port', 'is_ping_ok', 'runsh', 'runshex', 'mrunsh', 'mrunshex',
+                  'Expect', 'Telnet', 'Ssh', 'Sftp', 'Snmp', 'Http', 'Winrm',
+                  'CollectError', 'ConnectionError', 'NotConnected', 'UnexpectedResultError',
+                  'SnmpWalkError', 'CollectTasksError', 'irunsh', 'fanout', 'RemoteLogReader',
+                  'ExpectSessionPool', 'SnmpPoller'],
+    'perf'     : ['PerfData', 'Timings'],
+    'tools'    : ['Timeout', 'TimeoutError', 'Lockfile', 'run_concurrently', 'CommandCache'],
+    'mixins'   : ['GaugeMixin', 'GaugeException', 'HostsManagerMixin'],
+    'launcher' : [],
+    'metrics'  : [],
+    'trace'    : [],
+    'replay'   : [],
+    'broker'   : [],
+}
+
+_name_to_submodule = dict([ (name,submodule) for submodule,names in _submodules_names.items()
+                                             for name in names ])
+
+__all__ = ( sorted(_name_to_submodule) +
+            [ 'plugin', 'host', 'response', 'collect', 'perf', 'tools', 'mixins' ] +
+            [ 'logger', 'activate_debug', 'debug_caller', 'debug_listing', 'debug_or_empty' ] )
+
+class _LazyModule(types.ModuleType):
+    """naghelp package object that imports submodules on first attribute access"""
+    def __getattr__(self, name):
+        if name in _submodules_names:
+            submodule = name
+        else:
+            submodule = _name_to_submodule.get(name)
+        if submodule is None:
+            raise AttributeError("'module' object has no attribute '%s'" % name)
+        module = importlib.import_module('%s.%s' % (__name__, submodule))
+        value = module if name == submodule else getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(__all__))
+
+_lazy_module = _LazyModule(__name__, __doc__)
+_lazy_module.__dict__.update(globals())
+# keep a reference on the original module otherwise python would clear its globals
+_lazy_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _lazy_module
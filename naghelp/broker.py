@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+#
+# Création : 16 Oct 2026
+#
+# @author: Eric Lapouyade
+"""This module provides a SSH connection broker shared by all plugins of the monitoring host
+
+Each :class:`naghelp.Ssh` object does a TCP connection, a key exchange and an authentication before
+running its commands, then closes the connection. When the same hosts are checked by many plugins
+every few minutes, these handshakes are taking most of the collect time.
+
+The broker works like the OpenSSH ``ControlMaster`` : it is a daemon that keeps authenticated SSH
+transports alive, one per host, port, user and credentials, until they are idle for
+``idle_timeout`` seconds. Plugins send their commands to the broker through a unix socket, the
+broker runs them in a new channel of the already opened transport.
+
+To start the broker (for example as a systemd service, with the same user as Nagios)::
+
+    python -m naghelp.broker --socket=/tmp/naghelp/ssh_broker.sock --idle-timeout=300
+
+Then set the ``NAGHELP_SSH_BROKER`` environment variable to the socket path (for example in the
+Nagios command definition) : :class:`naghelp.Ssh` will use the broker transparently. One can also
+use the ``broker`` parameter of :class:`naghelp.Ssh`. If the broker is not reachable,
+:class:`naghelp.Ssh` connects directly as usual.
+
+Note:
+
+    The broker is only used for commands executed with paramiko ``exec_command()`` (that is,
+    when no ``prompt_pattern`` is given) and when no ``sock`` or ``pkey`` object is given.
+    ``get()`` and ``put()`` are still done with a direct connection.
+"""
+
+import os
+import time
+import socket
+import select
+import signal
+import errno
+import json
+import hashlib
+import threading
+from optparse import OptionParser
+import naghelp
+from .tools import send_msg, recv_msg, TimeoutError, bind_unix_socket, connect_unix_socket
+from .collect import CollectError, _read_exec_channel
+
+__all__ = ['SshBroker', 'BrokerClient', 'BrokerError']
+
+DEFAULT_SOCKET_PATH = '/tmp/naghelp/ssh_broker.sock'
+"""Default unix socket path used by :class:`SshBroker`"""
+
+CONNECT_KWARGS = ['port', 'key_filename', 'allow_agent', 'look_for_keys', 'compress',
+                  'gss_auth', 'gss_kex', 'gss_deleg_creds', 'gss_host', 'banner_timeout']
+"""paramiko ``connect()`` arguments that can be given to the broker"""
+
+MAX_CHANNEL_ATTEMPTS = 200
+"""Maximum number of attempts to open a channel refused by the SSH server (about 40s)"""
+
+class BrokerError(CollectError):
+    """Exception raised when the broker failed to connect or to run a command"""
+    pass
+
+def _latin1(s):
+    # latin-1 is used to transport raw bytes into json strings
+    return s.decode('latin-1') if isinstance(s, str) else s
+
+def _bytes(s):
+    return s.encode('latin-1') if isinstance(s, unicode) else s
+
+class PooledClient(object):
+    """A SSH client kept alive by the broker"""
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.time()
+        self.nb_commands = 0
+        self.in_use = 0
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+class SshBroker(object):
+    """SSH connection broker server
+
+    Args:
+
+        socket_path (str): The unix socket path to listen to
+            (Default : ``/tmp/naghelp/ssh_broker.sock``)
+        idle_timeout (int): Time in seconds after which an unused connection is closed
+            (Default : 300)
+        socket_mode (int): The socket file permissions (Default : 0600, only the broker user can
+            use the broker)
+
+    Example:
+
+        To start a broker from a python script::
+
+            from naghelp.broker import SshBroker
+
+            SshBroker('/tmp/naghelp/ssh_broker.sock', idle_timeout=600).serve_forever()
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, idle_timeout=300, socket_mode=0o600):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.socket_mode = socket_mode
+        self.pool = {}
+        self.pool_lock = threading.Lock()
+        self.connect_locks = {}
+
+    def get_pool_key(self, req):
+        """Returns the key of the pooled connection for a request
+
+        Connections are shared only between requests having the same host, user and credentials.
+        """
+        credentials = json.dumps([req.get('password'), req.get('kwargs', {})], sort_keys=True)
+        return (req['host'], req.get('kwargs', {}).get('port', 22), req['user'],
+                hashlib.sha1(credentials.encode('utf-8')).hexdigest())
+
+    def get_client(self, req):
+        """Returns a pooled client for the request : a new connection is done only if needed"""
+        key = self.get_pool_key(req)
+        with self.pool_lock:
+            connect_lock = self.connect_locks.setdefault(key, threading.Lock())
+        # only one thread connects to a given host, others wait and use the same connection
+        with connect_lock:
+            with self.pool_lock:
+                pooled = self.pool.get(key)
+            if pooled is not None and not pooled.is_active():
+                naghelp.logger.debug('broker -> drop connection %s@%s', key[2], key[0])
+                self.close_client(key, pooled)
+                pooled = None
+            if pooled is None:
+                pooled = PooledClient(self.connect(req))
+                with self.pool_lock:
+                    self.pool[key] = pooled
+            pooled.last_used = time.time()
+            return pooled
+
+    def connect(self, req):
+        """Opens a new SSH connection for the request"""
+        import paramiko
+        client = paramiko.SSHClient()
+        if req.get('auto_accept_new_host', True):
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.load_system_host_keys()
+        kwargs = dict([ (str(k),v) for k,v in req.get('kwargs', {}).items() if k in CONNECT_KWARGS ])
+        naghelp.logger.debug('broker -> connect to %s@%s', req['user'], req['host'])
+        start = time.time()
+        client.connect(req['host'], username=req['user'], password=_bytes(req.get('password')),
+                       timeout=req.get('timeout', 30), **kwargs)
+        naghelp.logger.debug('broker -> connected to %s@%s in %.3fs', req['user'], req['host'],
+                             time.time() - start)
+        return client
+
+    def close_client(self, key, pooled):
+        with self.pool_lock:
+            if self.pool.get(key) is pooled:
+                del self.pool[key]
+        try:
+            pooled.client.close()
+        except Exception:
+            pass
+
+    def expire_idle(self):
+        """Closes connections that are unused for more than ``idle_timeout`` seconds"""
+        now = time.time()
+        with self.pool_lock:
+            expired = [ (key, pooled) for key, pooled in self.pool.items()
+                        if not pooled.in_use and (now - pooled.last_used > self.idle_timeout
+                                                  or not pooled.is_active()) ]
+        for key, pooled in expired:
+            naghelp.logger.debug('broker -> close idle connection %s@%s (%s commands)',
+                                 key[2], key[0], pooled.nb_commands)
+            self.close_client(key, pooled)
+
+    def exec_command(self, req):
+        """Runs a command in a new channel of a pooled connection"""
+        import paramiko
+        cmd = _bytes(req['cmd'])
+        timeout = req.get('timeout', 30)
+        deadline = time.time() + timeout if timeout else None
+        attempt = 0
+        reconnected = False
+        while True:
+            attempt += 1
+            pooled = self.get_client(req)
+            with self.pool_lock:
+                pooled.in_use += 1
+            try:
+                try:
+                    stdin, stdout, stderr = pooled.client.exec_command(cmd, timeout=timeout,
+                                                                       get_pty=req.get('get_pty', False))
+                except paramiko.ChannelException,e:
+                    # too many channels opened at the same time (sshd MaxSessions) : wait a little
+                    if deadline is not None and time.time() >= deadline:
+                        raise socket.timeout()
+                    if attempt >= MAX_CHANNEL_ATTEMPTS:
+                        raise
+                    naghelp.logger.debug('broker -> channel refused (%s), retrying...', e)
+                    time.sleep(min(0.01 * attempt, 0.2))
+                    continue
+                except (paramiko.SSHException, EOFError, socket.error),e:
+                    # the pooled connection may have been closed by the remote host
+                    if pooled.is_active() or reconnected:
+                        raise
+                    naghelp.logger.debug('broker -> connection lost (%s), reconnecting...', e)
+                    reconnected = True
+                    continue
+                out, err, rc = _read_exec_channel(stdout.channel)
+            finally:
+                with self.pool_lock:
+                    pooled.in_use -= 1
+                    pooled.last_used = time.time()
+            pooled.nb_commands += 1
+            return { 'stdout' : _latin1(out), 'stderr' : _latin1(err), 'rc' : rc }
+
+    def handle_request(self, req):
+        """Returns the response to a client request"""
+        try:
+            if req.get('op') == 'connect':
+                self.get_client(req)
+                return { 'ok' : True }
+            elif req.get('op') == 'exec':
+                return self.exec_command(req)
+            return { 'error' : 'Unknown operation %s' % req.get('op'), 'error_type' : 'error' }
+        except socket.timeout, e:
+            # the output received before the timeout is sent back too
+            out, err = getattr(e, 'partial', ('', ''))
+            return { 'error' : 'Timeout', 'error_type' : 'timeout',
+                     'stdout' : _latin1(out), 'stderr' : _latin1(err) }
+        except Exception, e:
+            naghelp.logger.debug('broker -> %s failed : %s', req.get('op'), e)
+            return { 'error' : _latin1('%s' % e), 'error_type' : 'error' }
+
+    def handle_connection(self, conn):
+        """Serves the requests of one client connection (runs in its own thread)"""
+        try:
+            while True:
+                req = recv_msg(conn)
+                if req is None:
+                    break
+                send_msg(conn, self.handle_request(req))
+        except (socket.error, ValueError), e:
+            naghelp.logger.debug('broker -> client connection error : %s', e)
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        """Listens to the unix socket and serves clients until SIGTERM or SIGINT"""
+        server = bind_unix_socket(self.socket_path, self.socket_mode)
+
+        def handle_sigterm(signum, frame):
+            raise SystemExit(0)
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+        naghelp.logger.debug('broker -> listening on %s', self.socket_path)
+        try:
+            while True:
+                try:
+                    readable,_,_ = select.select([server],[],[],1.0)
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                self.expire_idle()
+                if not readable:
+                    continue
+                conn,_ = server.accept()
+                thread = threading.Thread(target=self.handle_connection, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            with self.pool_lock:
+                pool = self.pool.items()
+            for key, pooled in pool:
+                self.close_client(key, pooled)
+
+class BrokerClient(object):
+    """Client side of the SSH broker, used by :class:`naghelp.Ssh`
+
+    Each thread has its own connection to the broker, this way, commands can be run concurrently.
+
+    Args:
+
+        socket_path (str): The broker unix socket path
+
+    Raises:
+
+        socket.error: if the broker is not reachable or runs with another user
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+        self.local = threading.local()
+        self.socks = []
+        self.socks_lock = threading.Lock()
+        self.params = None
+        self.get_socket()
+
+    def get_socket(self):
+        """Returns the broker connection of the current thread"""
+        sock = getattr(self.local, 'sock', None)
+        if sock is None:
+            # the password is sent to the broker : it must run with the same user
+            sock = connect_unix_socket(self.socket_path)
+            self.local.sock = sock
+            with self.socks_lock:
+                self.socks.append(sock)
+        return sock
+
+    def request(self, req, timeout):
+        try:
+            sock = self.get_socket()
+            # the broker has its own timeouts : this one is only a safety net
+            sock.settimeout(timeout + 10 if timeout else None)
+            send_msg(sock, req)
+            response = recv_msg(sock)
+        except socket.timeout:
+            raise TimeoutError('Timeout (%ss) while waiting for the SSH broker' % timeout)
+        except socket.error, e:
+            raise BrokerError('SSH broker connection error : %s' % e)
+        if response is None:
+            raise BrokerError('SSH broker closed the connection')
+        if 'error' in response:
+            if response.get('error_type') == 'timeout':
+                e = socket.timeout(response['error'])
+                e.partial = (_bytes(response.get('stdout', '')), _bytes(response.get('stderr', '')))
+                raise e
+            raise BrokerError(response['error'].encode('utf-8'))
+        return response
+
+    def connect(self, host, user, password=None, timeout=30, auto_accept_new_host=True, **kwargs):
+        """Asks the broker for an authenticated connection (a new one is done only if needed)"""
+        self.params = { 'host' : _latin1(host), 'user' : _latin1(user), 'password' : _latin1(password),
+                        'auto_accept_new_host' : auto_accept_new_host,
+                        'kwargs' : dict([ (k,v) for k,v in kwargs.items() if k in CONNECT_KWARGS ]) }
+        req = dict(self.params, op='connect', timeout=timeout)
+        self.request(req, timeout)
+
+    def exec_command(self, cmd, timeout=30, get_pty=False):
+        """Runs a command through the broker
+
+        Returns:
+
+            tuple: stdout, stderr, return code
+
+        Raises:
+
+            socket.timeout: if the command timed out, the output received so far is in its
+                ``partial`` attribute as a tuple ``(stdout, stderr)``
+        """
+        req = dict(self.params, op='exec', cmd=_latin1(cmd), timeout=timeout, get_pty=get_pty)
+        response = self.request(req, timeout)
+        return _bytes(response['stdout']), _bytes(response['stderr']), response['rc']
+
+    def close(self):
+        with self.socks_lock:
+            for sock in self.socks:
+                sock.close()
+            self.socks = []
+        self.local = threading.local()
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--socket', dest='socket_path', default=DEFAULT_SOCKET_PATH,
+                      help='Unix socket path (Default : %s)' % DEFAULT_SOCKET_PATH)
+    parser.add_option('-i', '--idle-timeout', type='int', dest='idle_timeout', default=300,
+                      help='Close connections unused for this number of seconds (Default : 300)')
+    parser.add_option('-d', '--debug', action='store_true', dest='debug', default=False,
+                      help='Debug mode')
+    options, args = parser.parse_args()
+    if options.debug:
+        naghelp.activate_debug()
+    SshBroker(options.socket_path, options.idle_timeout).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -18,12 +18,20 @@ import traceback
 import fcntl
 import errno
 import os
-from .tools import Timeout, TimeoutError
+import select
+import threading
+import atexit
+import uuid
+from contextlib import contextmanager
+from .tools import Timeout, TimeoutError, run_concurrently
+from . import tools
+from .trace import tracer
 
 __all__ = ['search_invalid_port', 'is_ping_ok', 'runsh', 'runshex', 'mrunsh', 'mrunshex',
            'Expect', 'Telnet', 'Ssh', 'Sftp', 'Snmp', 'Http', 'Winrm',
            'CollectError', 'ConnectionError', 'NotConnected', 'UnexpectedResultError',
-           'SnmpWalkError', ]
+           'SnmpWalkError', 'CollectTasksError', 'irunsh', 'fanout', 'RemoteLogReader',
+           'ExpectSessionPool', 'SnmpPoller', ]
 
 class CollectError(Exception):
     """Exception raised when a collect is unsuccessful
@@ -35,9 +43,13 @@ class CollectError(Exception):
 
 class SnmpWalkError(Exception):
     """Exception raised when Snmp.walk() failed
+
+    With :meth:`Snmp.mwalk`, ``truncated_result`` is the dictionary of all walked lists (the failed
+    ones are truncated) and ``errors`` is a keyname/error message dictionary of the failed walks.
     """
     def __init__(self,truncated_result,*args,**kwargs):
         self.truncated_result = truncated_result
+        self.errors = kwargs.pop('errors',{})
         super(SnmpWalkError, self).__init__(*args, **kwargs)
 
 class NotConnected(CollectError):
@@ -64,6 +76,22 @@ class UnexpectedResultError(CollectError):
     """
     pass
 
+class CollectTasksError(CollectError):
+    """Exception raised when some tasks run by :meth:`naghelp.ActivePlugin.collect_tasks` failed
+
+    Attributes:
+
+        errors (dict): task key -> exception for each failed task
+        results (dict): task key -> result for each successful task
+    """
+    def __init__(self,errors,results):
+        self.errors = errors
+        self.results = results
+        msg = 'Collect failed for %s task(s) :\n' % len(errors)
+        msg += '\n'.join([ '%s : %s: %s' % (k,e.__class__.__name__,e)
+                           for k,e in sorted(errors.items()) ])
+        super(CollectTasksError, self).__init__(msg)
+
 class InvalidCommandError(CollectError):
     """Exception raised when a command to be run is invalid
 
@@ -159,6 +187,17 @@ def _filter_result(result, key, cmd, expected_pattern=r'\S', unexpected_pattern=
 
     return textops.extend_type(result)
 
+def _traced_connect(protocol, host, port, timeout):
+    """Open a TCP connection with distinct DNS and TCP connect spans (only used when tracing)"""
+    with tracer.span('%s.dns' % protocol, host=host) as span:
+        family, socktype, proto, canonname, sockaddr = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+        span.set(addr=sockaddr[0])
+    with tracer.span('%s.tcp' % protocol, host=host, addr=sockaddr[0], port=port):
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(timeout)
+        sock.connect(sockaddr)
+    return sock
+
 def _debug_caller_info():
     if naghelp.logger.getEffectiveLevel() == naghelp.logging.DEBUG:
         prev_call = ''
@@ -175,12 +214,16 @@ def _debug_caller(self):
     return file_line
 
 
-def runsh(cmd, context = {}, timeout = 30, expected_pattern=r'\S', unexpected_pattern=None, filter=None, key='' ):
+def runsh(cmd, context = {}, timeout = 30, expected_pattern=r'\S', unexpected_pattern=None, filter=None, key='', cache_ttl=None ):
     r"""Run a local command with a timeout
 
-    | If the command is a string, it will be executed within a shell.
+    | If the command is a string, it will be executed within a shell (``/bin/sh``) only if it uses
+      some shell syntax (pipes, redirections, variables, quotes, wildcards...), otherwise it is
+      executed directly.
     | If the command is a list (the command and its arguments), the command is executed without a shell.
     | If a context dict is specified, the command is formatted with that context (:meth:`str.format`)
+    | The timeout does not use signals : it can be used in threads. On timeout, the command and
+      all its sub-processes are killed.
 
     Args:
 
@@ -200,6 +243,10 @@ def runsh(cmd, context = {}, timeout = 30, expected_pattern=r'\S', unexpected_pa
             ``mget`` and ``mwalk``.
             By Default, there is no filter.
         key (str): a key string to appear in UnexpectedResultError if any.
+        cache_ttl (int): When set, the result of the command is taken from the cache shared by
+            all naghelp processes of the monitoring host if it is not older than ``cache_ttl``
+            seconds, otherwise the command is run and its result stored in the cache if its
+            return code is 0 (see :class:`naghelp.tools.CommandCache`). Default : None, no cache.
 
     Returns:
 
@@ -235,15 +282,19 @@ def runsh(cmd, context = {}, timeout = 30, expected_pattern=r'\S', unexpected_pa
     stdout, stderr, rc = runshex(cmd, context = context, timeout = timeout,
                                expected_pattern = expected_pattern,
                                unexpected_pattern = unexpected_pattern, filter=filter, key=key,
-                               unexpected_stderr = False )
+                               unexpected_stderr = False, cache_ttl = cache_ttl )
     return stdout.splitlines()
 
-def runshex(cmd, context = {}, timeout = 30, expected_pattern=r'\S', unexpected_pattern=None,filter=None, key='',unexpected_stderr=True ):
+def runshex(cmd, context = {}, timeout = 30, expected_pattern=r'\S', unexpected_pattern=None,filter=None, key='',unexpected_stderr=True, cache_ttl=None ):
     r"""Run a local command with a timeout
 
-    | If the command is a string, it will be executed within a shell.
+    | If the command is a string, it will be executed within a shell (``/bin/sh``) only if it uses
+      some shell syntax (pipes, redirections, variables, quotes, wildcards...), otherwise it is
+      executed directly.
     | If the command is a list (the command and its arguments), the command is executed without a shell.
     | If a context dict is specified, the command is formatted with that context (:meth:`str.format`)
+    | The timeout does not use signals : it can be used in threads. On timeout, the command and
+      all its sub-processes are killed.
 
     Args:
 
@@ -264,6 +315,10 @@ def runshex(cmd, context = {}, timeout = 30, expected_pattern=r'\S', unexpected_
             By Default, there is no filter.
         key (str): a key string to appear in UnexpectedResultError if any.
         unexpected_stderr (bool): When True (Default), it raises an error if stderr is not empty
+        cache_ttl (int): When set, the result of the command is taken from the cache shared by
+            all naghelp processes of the monitoring host if it is not older than ``cache_ttl``
+            seconds, otherwise the command is run and its result stored in the cache if its
+            return code is 0 (see :class:`naghelp.tools.CommandCache`). Default : None, no cache.
 
     Returns:
 
@@ -276,32 +331,337 @@ def runshex(cmd, context = {}, timeout = 30, expected_pattern=r'\S', unexpected_
     if not cmd:
         raise InvalidCommandError('Command is empty')
 
-    with Timeout(seconds=timeout, error_message='Timeout (%ss) for command : %s' % (timeout,cmd)):
-        if isinstance(cmd, basestring):
-            if context:
-                cmd = cmd.format(**context)
-            p=subprocess.Popen(['timeout','%ss' % timeout,'sh','-c',cmd],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-        elif isinstance(cmd, list):
-            if context:
-                cmd = [ i.format(**context) for i in cmd ]
-            if cmd[0] != 'timeout':
-                cmd[0:0] = ['timeout','%ss' % timeout]
-            p=subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-        stdout_msg = ''
-        stderr_msg = ''
-        while p.returncode is None:
-            (stdout, stderr) = p.communicate()
-            stdout_msg += stdout
-            stderr_msg += stderr
-        if isinstance(cmd, unicode):
-            cmd=cmd.encode('utf-8','replace')
+    argv, cmd = _command_argv(cmd, context)
+    with tracer.span('local.command', cmd=cmd, key=key) as span:
+        if span.enabled:
+            import resource
+            rusage_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+        run = lambda: _run_commands([(key, argv, cmd)], 1, timeout, None, None)[key]
+        if cache_ttl:
+            stdout_msg, stderr_msg, rcode = tools.command_cache.cached(argv, cache_ttl, run, timeout)
         else:
-            cmd=str(cmd)
-        if unexpected_stderr and stderr_msg:
-            _raise_unexpected_result(stderr_msg, key, cmd, help_str='<stderr> returned :')
-        return _filter_result(stdout_msg, key, cmd, expected_pattern, unexpected_pattern, filter),stderr_msg,p.returncode
+            stdout_msg, stderr_msg, rcode = run()
+        if span.enabled:
+            rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            span.set(rc=rcode, bytes_out=len(stdout_msg), bytes_err=len(stderr_msg),
+                     utime=round(rusage.ru_utime - rusage_start.ru_utime, 6),
+                     stime=round(rusage.ru_stime - rusage_start.ru_stime, 6),
+                     maxrss_kb=rusage.ru_maxrss)
+    if unexpected_stderr and stderr_msg:
+        _raise_unexpected_result(stderr_msg, key, cmd, help_str='<stderr> returned :')
+    return _filter_result(stdout_msg, key, cmd, expected_pattern, unexpected_pattern, filter),stderr_msg,rcode
+
+TRUNCATED_MARKER = '[naghelp] output truncated after {max_bytes} bytes'
+
+def irunsh(cmd, context = {}, timeout = 30, max_bytes=None, truncated_marker=TRUNCATED_MARKER):
+    r"""Run a local command and iterate over its output lines as they arrive
+
+    It works like :func:`runsh` except that it is a generator : the output is not read into memory
+    as a whole, this way, ``parse_data()`` can filter huge outputs (``journalctl``, ``dmesg``,
+    ``find``...) in constant memory. Stderr is discarded.
+
+    When the loop is left before the end (``break``, exception or the generator is closed),
+    the command and all its sub-processes are killed. If the command cannot be executed (return
+    code 126 or 127, like the shell gives for a command not found), :class:`CollectError` is
+    raised.
+
+    Args:
+
+        cmd (str or a list): The command to run
+        context (dict): The context to format the command to run (Optional)
+        timeout (int): The timeout in seconds for the whole command : the command is killed
+            and TimeoutError is raised (Default : 30s). The time spent by the consumer between
+            two lines counts.
+        max_bytes (int): The maximum number of bytes to read : the command is then killed and
+            ``truncated_marker`` is yielded as the last line (Default : None, no limit).
+        truncated_marker (str): The last line yielded when the output has been truncated,
+            ``{max_bytes}`` is replaced by the limit.
+            (Default : '[naghelp] output truncated after {max_bytes} bytes').
+
+    Yields:
+
+        str: Command execution stdout lines without line ending
+
+    Examples:
+
+        >>> for line in irunsh('seq 1000000'):
+        ...     if line == '3':
+        ...         break
+        ...     print line
+        1
+        2
+        >>> for line in irunsh('seq 1000000', max_bytes=10):
+        ...     print line
+        1
+        2
+        3
+        4
+        5
+        [naghelp] output truncated after 10 bytes
+        >>> len([ l for l in irunsh('seq 1000000') if l.endswith('777') ])
+        1000
+    """
+    if not cmd:
+        raise InvalidCommandError('Command is empty')
+    argv, cmd = _command_argv(cmd, context)
+    naghelp.logger.debug('collect -> start streamed process : %s',argv)
+    deadline = time.time() + timeout if timeout else None
+    with open(os.devnull,'r+') as devnull:
+        try:
+            p = subprocess.Popen(argv, stdin=devnull, stdout=subprocess.PIPE, stderr=devnull,
+                                 preexec_fn=os.setsid, close_fds=True)
+        except OSError,e:
+            raise CollectError('Cannot execute command %s : %s' % (cmd, e.strerror))
+    fd = p.stdout.fileno()
+    nb_bytes = 0
+    buf = ''
+    try:
+        while True:
+            if deadline is not None:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    raise TimeoutError('Timeout (%ss) for command : %s' % (timeout, cmd))
+            else:
+                wait = None
+            try:
+                if not select.select([fd], [], [], wait)[0]:
+                    continue
+            except select.error,e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            if max_bytes is not None and nb_bytes + len(chunk) > max_bytes:
+                buf += chunk[:max_bytes - nb_bytes]
+                for line in buf.splitlines():
+                    yield line
+                naghelp.logger.debug('collect -> output truncated after %s bytes : %s',max_bytes,cmd)
+                yield truncated_marker.format(max_bytes=max_bytes)
+                return
+            nb_bytes += len(chunk)
+            buf += chunk
+            eol = buf.rfind('\n')
+            if eol >= 0:
+                lines = buf[:eol+1].splitlines()
+                buf = buf[eol+1:]
+                for line in lines:
+                    yield line
+        for line in buf.splitlines():
+            yield line
+        exit_wait = 0.0005
+        while p.poll() is None:
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError('Timeout (%ss) for command : %s' % (timeout, cmd))
+            time.sleep(exit_wait)
+            exit_wait = min(exit_wait * 2, 0.05)
+        naghelp.logger.debug('collect -> streamed process exited with code %s',p.returncode)
+        if p.returncode in (126, 127):
+            raise CollectError('Cannot execute command (return code %s) : %s' % (p.returncode, cmd))
+    finally:
+        if p.returncode is None:
+            naghelp.logger.debug('collect -> killing streamed process : %s',cmd)
+            _kill_process(p)
+        p.stdout.close()
+
+def _kill_process(p):
+    """Kill a process started by :func:`_run_commands` with its whole process group"""
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    p.wait()
+
+def _run_commands(cmds, max_concurrency, cmd_timeout, total_timeout, error_message):
+    """Run local commands concurrently without using signals
+
+    Args:
+
+        cmds (list): list of ``(key, argv, cmd string for messages)`` tuples
+        max_concurrency (int): maximum number of processes running at the same time
+        cmd_timeout (int): timeout in seconds for each command
+        total_timeout (int): timeout in seconds for all commands
+        error_message (str): TimeoutError message on total timeout
+
+    Returns:
+
+        dict: key -> (stdout, stderr, return code)
+
+    Raises:
 
-def mrunsh(cmds, context = {},cmd_timeout = 30, total_timeout = 60, expected_pattern=r'\S', unexpected_pattern=None, filter=None):
+        TimeoutError: if a command or the whole run timed out : all remaining processes are killed
+    """
+    start = time.time()
+    deadline = start + total_timeout if total_timeout else None
+    pending = list(cmds)
+    running = {}        # key -> [process, cmd deadline, stdout chunks, stderr chunks, open fds]
+    fd_map = {}         # fd -> (key, index of the chunk list in running[key])
+    results = {}
+    exit_wait = 0.0005
+    devnull = open(os.devnull)
+    try:
+        while pending or running:
+            while pending and len(running) < max_concurrency:
+                key, argv, label = pending.pop(0)
+                naghelp.logger.debug('collect -> start process for %s : %s',key,argv)
+                try:
+                    # close_fds : a child started at the same time by another thread must not
+                    # inherit the pipes, otherwise their EOF would be delayed until it exits
+                    p = subprocess.Popen(argv, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         preexec_fn=os.setsid, close_fds=True)
+                except OSError,e:
+                    # same result as a shell would give
+                    results[key] = ('', '%s: %s\n' % (argv[0], e.strerror),
+                                    127 if e.errno == errno.ENOENT else 126)
+                    continue
+                running[key] = [p, time.time() + cmd_timeout if cmd_timeout else None, [], [], 2]
+                fd_map[p.stdout.fileno()] = (key, 2)
+                fd_map[p.stderr.fileno()] = (key, 3)
+            now = time.time()
+            for key, (p, cmd_deadline, out, err, nb_fds) in running.items():
+                if cmd_deadline is not None and now >= cmd_deadline:
+                    label = [ c[2] for c in cmds if c[0] == key ][0]
+                    raise TimeoutError('Timeout (%ss) for command : %s' % (cmd_timeout, label))
+            if deadline is not None and now >= deadline:
+                raise TimeoutError(error_message)
+            deadlines = [ r[1] for r in running.values() if r[1] is not None ]
+            if deadline is not None:
+                deadlines.append(deadline)
+            wait = max(0, min(deadlines) - now) if deadlines else None
+            if fd_map:
+                try:
+                    readable = select.select(fd_map.keys(), [], [], wait)[0]
+                except select.error,e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+            else:
+                # only processes that closed their outputs : wait for them to exit
+                readable = []
+                time.sleep(min(wait, exit_wait) if wait is not None else exit_wait)
+                exit_wait = min(exit_wait * 2, 0.05)
+            for fd in readable:
+                key, idx = fd_map[fd]
+                chunk = os.read(fd, 65536)
+                if chunk:
+                    running[key][idx].append(chunk)
+                else:
+                    del fd_map[fd]
+                    running[key][4] -= 1
+            for key, (p, cmd_deadline, out, err, nb_fds) in running.items():
+                if nb_fds == 0 and p.poll() is not None:
+                    p.stdout.close()
+                    p.stderr.close()
+                    results[key] = (''.join(out), ''.join(err), p.returncode)
+                    del running[key]
+                    naghelp.logger.debug('collect -> process for %s exited with code %s',key,p.returncode)
+    finally:
+        devnull.close()
+        for key, (p, cmd_deadline, out, err, nb_fds) in running.items():
+            naghelp.logger.debug('collect -> killing process for %s',key)
+            _kill_process(p)
+            p.stdout.close()
+            p.stderr.close()
+    return results
+
+SHELL_SYNTAX_PATTERN = re.compile(r'''[|&;<>()$`\\"'*?\[\]#~={}!%\n]''')
+SHELL_BUILTINS = set(['cd', 'export', 'ulimit', 'umask', 'exec', 'source', '.', 'set', 'unset',
+                      'command', 'type', 'eval', 'alias', 'unalias', 'read', 'wait', 'trap',
+                      'shift', 'exit', 'return', 'break', 'continue', 'let', 'local', 'readonly',
+                      'declare', 'typeset', 'pushd', 'popd', 'dirs', 'hash', 'getopts', 'times',
+                      'jobs', 'fg', 'bg', 'shopt', 'builtin', 'enable', 'history', 'fc'])
+
+def _in_path(name):
+    """Returns True if ``name`` is a path or an executable found in the PATH"""
+    if '/' in name:
+        return True
+    for path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        if os.access(os.path.join(path or '.', name), os.X_OK):
+            return True
+    return False
+
+def _command_argv(cmd, context):
+    """Returns the argv to execute a command and the command string for messages
+
+    A string command is executed directly when it is a simple command (words separated by spaces),
+    and within ``/bin/sh`` only when it uses some shell syntax (pipes, redirections, variables,
+    quotes, wildcards...), a shell builtin or a command that is not in the PATH (the shell then
+    gives its usual result, for example ``not found`` with return code 127). A list command is
+    always executed directly.
+
+    >>> _command_argv('ls -la /tmp', {})
+    (['ls', '-la', '/tmp'], 'ls -la /tmp')
+    >>> _command_argv('ls -la {dir} | grep x', {'dir':'/tmp'})
+    (['/bin/sh', '-c', 'ls -la /tmp | grep x'], 'ls -la /tmp | grep x')
+    >>> _command_argv('LANG=C date', {})
+    (['/bin/sh', '-c', 'LANG=C date'], 'LANG=C date')
+    >>> _command_argv('exit 1', {})
+    (['/bin/sh', '-c', 'exit 1'], 'exit 1')
+    >>> _command_argv(['ls','{dir}'], {'dir':'/tmp'})
+    (['ls', '/tmp'], "['ls', '/tmp']")
+    """
+    if isinstance(cmd, basestring):
+        if context:
+            cmd = cmd.format(**context)
+        if isinstance(cmd, unicode):
+            cmd = cmd.encode('utf-8','replace')
+        argv = cmd.split()
+        if (SHELL_SYNTAX_PATTERN.search(cmd) or not argv or argv[0] in SHELL_BUILTINS
+                or not _in_path(argv[0])):
+            argv = ['/bin/sh','-c',cmd]
+        return argv, cmd
+    if context:
+        cmd = [ i.format(**context) for i in cmd ]
+    argv = [ i.encode('utf-8','replace') if isinstance(i, unicode) else i for i in cmd ]
+    return argv, str(argv)
+
+@contextmanager
+def _deadline_timeout(cmd_timeout, deadline, error_message):
+    """Yields the timeout to use for the next command so that the deadline is respected
+
+    Raises a TimeoutError with ``error_message`` if the deadline is reached.
+    """
+    timeout = cmd_timeout
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError(error_message)
+        if not timeout or remaining < timeout:
+            timeout = remaining
+    try:
+        yield timeout
+    except TimeoutError:
+        if deadline is not None and time.time() >= deadline:
+            raise TimeoutError(error_message)
+        raise
+
+def _mrunshex_concurrent(cmds, context, cmd_timeout, total_timeout, max_concurrency, cache_ttl=None):
+    """Run commands concurrently : returns a list of (key, cmd string, stdout, stderr, rcode)"""
+    if isinstance(cmds,dict):
+        cmds = cmds.items()
+    all_cmds = []
+    to_run = []
+    results = {}
+    for k,cmd in cmds:
+        if not cmd:
+            raise InvalidCommandError('Command is empty')
+        argv, label = _command_argv(cmd, context)
+        all_cmds.append((k, argv, label))
+        if cache_ttl:
+            results[k] = tools.command_cache.get(argv, cache_ttl)
+        if results.get(k) is None:
+            to_run.append((k, argv, label))
+    if to_run:
+        with tracer.span('local.mrun', cmds=len(to_run), max_concurrency=max_concurrency):
+            results.update(_run_commands(to_run, max_concurrency, cmd_timeout, total_timeout,
+                                    'Timeout (%ss) for mrunsh commands : %s' % (total_timeout,cmds)))
+        if cache_ttl:
+            for k,argv,label in to_run:
+                tools.command_cache.set(argv, results[k])
+    return [ (k, label) + results[k] for k,argv,label in all_cmds ]
+
+def mrunsh(cmds, context = {},cmd_timeout = 30, total_timeout = 60, expected_pattern=r'\S', unexpected_pattern=None, filter=None, max_concurrency=1, cache_ttl=None):
     r"""Run multiple local commands with timeouts
 
     It works like :func:`runsh` except that one must provide a dictionary of commands.
@@ -330,6 +690,13 @@ def mrunsh(cmds, context = {},cmd_timeout = 30, total_timeout = 60, expected_pat
             that generated the ``result`` and ``key`` the key in the dictionary for ``mrun``,
             ``mget`` and ``mwalk``.
             By Default, there is no filter.
+        max_concurrency (int): The maximum number of commands running at the same time
+            (Default : 1, commands are run one after another). When greater than 1, the
+            ``total_timeout`` is a deadline for all commands : when reached, or when a command
+            reaches ``cmd_timeout``, all running commands are killed and a TimeoutError is raised.
+        cache_ttl (int): When set, commands results are taken from the cache shared by all naghelp
+            processes of the monitoring host if they are not older than ``cache_ttl`` seconds,
+            only results with a return code 0 are stored (see :func:`runsh`). Default : None, no cache.
 
     Returns:
 
@@ -345,15 +712,22 @@ def mrunsh(cmds, context = {},cmd_timeout = 30, total_timeout = 60, expected_pat
         {'now': ['Wed Dec 16 11:50:08 CET 2015'], 'quisuisje': ['elapouya']}
 
     """
-    with Timeout(seconds=total_timeout, error_message='Timeout (%ss) for mrunsh commands : %s' % (total_timeout,cmds)):
+    if max_concurrency > 1:
         dct = textops.DictExt()
-        if isinstance(cmds,dict):
-            cmds = cmds.items()
-        for k,cmd in cmds:
-            dct[k] = runsh(cmd, context, cmd_timeout, expected_pattern, unexpected_pattern, filter, k)
+        for k,cmd,stdout,stderr,rcode in _mrunshex_concurrent(cmds, context, cmd_timeout, total_timeout, max_concurrency, cache_ttl):
+            dct[k] = _filter_result(stdout, k, cmd, expected_pattern, unexpected_pattern, filter).splitlines()
         return dct
-
-def mrunshex(cmds, context = {},cmd_timeout = 30, total_timeout = 60, expected_pattern=r'\S', unexpected_pattern=None, filter=None,unexpected_stderr=True):
+    error_message = 'Timeout (%ss) for mrunsh commands : %s' % (total_timeout,cmds)
+    deadline = time.time() + total_timeout if total_timeout else None
+    dct = textops.DictExt()
+    if isinstance(cmds,dict):
+        cmds = cmds.items()
+    for k,cmd in cmds:
+        with _deadline_timeout(cmd_timeout, deadline, error_message) as timeout:
+            dct[k] = runsh(cmd, context, timeout, expected_pattern, unexpected_pattern, filter, k, cache_ttl)
+    return dct
+
+def mrunshex(cmds, context = {},cmd_timeout = 30, total_timeout = 60, expected_pattern=r'\S', unexpected_pattern=None, filter=None,unexpected_stderr=True, max_concurrency=1, cache_ttl=None):
     r"""Run multiple local commands with timeouts
 
     It works like :func:`runshex` except that one must provide a dictionary of commands.
@@ -384,6 +758,13 @@ def mrunshex(cmds, context = {},cmd_timeout = 30, total_timeout = 60, expected_p
             ``mget`` and ``mwalk``.
             By Default, there is no filter.
         unexpected_stderr (bool): When True (Default), it raises an error if stderr is not empty
+        max_concurrency (int): The maximum number of commands running at the same time
+            (Default : 1, commands are run one after another). When greater than 1, the
+            ``total_timeout`` is a deadline for all commands : when reached, or when a command
+            reaches ``cmd_timeout``, all running commands are killed and a TimeoutError is raised.
+        cache_ttl (int): When set, commands results are taken from the cache shared by all naghelp
+            processes of the monitoring host if they are not older than ``cache_ttl`` seconds,
+            only results with a return code 0 are stored (see :func:`runsh`). Default : None, no cache.
 
     Returns:
 
@@ -399,13 +780,125 @@ def mrunshex(cmds, context = {},cmd_timeout = 30, total_timeout = 60, expected_p
         {'now': ['Wed Dec 16 11:50:08 CET 2015'], 'quisuisje': ['elapouya']}
 
     """
-    with Timeout(seconds=total_timeout, error_message='Timeout (%ss) for mrunsh commands : %s' % (total_timeout,cmds)):
+    if max_concurrency > 1:
         dct = textops.DictExt()
-        if isinstance(cmds,dict):
-            cmds = cmds.items()
-        for k,cmd in cmds:
-            dct[k],dct[k+'_stderr'],dct[k+'_rcode'] = runshex(cmd, context, cmd_timeout, expected_pattern, unexpected_pattern, filter, k,unexpected_stderr)
+        for k,cmd,stdout,stderr,rcode in _mrunshex_concurrent(cmds, context, cmd_timeout, total_timeout, max_concurrency, cache_ttl):
+            if unexpected_stderr and stderr:
+                _raise_unexpected_result(stderr, k, cmd, help_str='<stderr> returned :')
+            dct[k] = _filter_result(stdout, k, cmd, expected_pattern, unexpected_pattern, filter)
+            dct[k+'_stderr'] = stderr
+            dct[k+'_rcode'] = rcode
         return dct
+    error_message = 'Timeout (%ss) for mrunsh commands : %s' % (total_timeout,cmds)
+    deadline = time.time() + total_timeout if total_timeout else None
+    dct = textops.DictExt()
+    if isinstance(cmds,dict):
+        cmds = cmds.items()
+    for k,cmd in cmds:
+        with _deadline_timeout(cmd_timeout, deadline, error_message) as timeout:
+            dct[k],dct[k+'_stderr'],dct[k+'_rcode'] = runshex(cmd, context, timeout, expected_pattern, unexpected_pattern, filter, k,unexpected_stderr, cache_ttl)
+    return dct
+
+def fanout(collector, hosts, method, method_args=(), method_kwargs={}, collector_kwargs={},
+           max_workers=32, timeout=60):
+    r"""Run the same collect on many hosts concurrently
+
+    For each host, a collector object is created, then its method is called. This is done with a
+    bounded pool of threads : it is useful for aggregation or cluster-level plugins.
+
+    Args:
+
+        collector (class): The collector class (:class:`Ssh`, :class:`Snmp`, :class:`Telnet`,
+            :class:`Http`...)
+        hosts (list or dict): A list of host names or a dictionary where keys are host names and
+            values are the collector constructor arguments specific to each host :
+            a dictionary of keyword arguments or a tuple of positional arguments that replaces
+            the host name.
+        method (str or callable): The method name to call on the collector object or a callable
+            with the collector object as single argument.
+        method_args (tuple): The method positional arguments
+        method_kwargs (dict): The method keyword arguments
+        collector_kwargs (dict): The collector constructor keyword arguments common to all hosts
+        max_workers (int): The maximum number of threads alive at the same time : a thread whose
+            host timed out cannot be killed and keeps its place until the collect ends (Default : 32)
+        timeout (int): The maximum time in seconds for each host, including the connection :
+            when reached, a :class:`TimeoutError` is stored as the host result. Hosts waiting for a
+            free thread while all threads are timed out get a :class:`TimeoutError` after the same
+            time (Default : 60)
+
+    Returns:
+
+        :class:`textops.DictExt`: The results or the exceptions for each host
+
+    Examples:
+
+        To get the uptime of many hosts::
+
+            results = fanout(Ssh, ['host1', 'host2', 'host3'], 'run', ('uptime',),
+                             collector_kwargs={'user':'nagios', 'password':'nagiospwd'})
+            for host, result in results.items():
+                if isinstance(result, Exception):
+                    print host, 'ERROR', result
+                else:
+                    print host, result
+
+        Each host may have its own constructor arguments:
+
+        >>> class Echo(object):
+        ...     def __init__(self, host, suffix=''):
+        ...         self.host = host
+        ...         self.suffix = suffix
+        ...     def get(self, what):
+        ...         if self.host == 'down':
+        ...             raise ConnectionError('%s is unreachable' % self.host)
+        ...         return '%s %s%s' % (self.host, what, self.suffix)
+        >>> results = fanout(Echo, {'h1':{}, 'h2':{'suffix':'!'}, 'down':{}}, 'get', ('uptime',))
+        >>> for host, result in sorted(results.items()):
+        ...     print host, '->', repr(result)
+        down -> ConnectionError('down is unreachable',)
+        h1 -> 'h1 uptime'
+        h2 -> 'h2 uptime!'
+
+        Hung collects still count in ``max_workers``:
+
+        >>> class Hung(object):
+        ...     running = []
+        ...     def __init__(self, host):
+        ...         self.host = host
+        ...     def get(self):
+        ...         self.running.append(self.host)
+        ...         print len(self.running), 'running'
+        ...         time.sleep(0.5)
+        ...         self.running.remove(self.host)
+        >>> results = fanout(Hung, ['h1', 'h2', 'h3'], 'get', max_workers=1, timeout=0.2)
+        1 running
+        >>> print sorted([ str(e).endswith('no free thread') for e in results.values() ])
+        [False, True, True]
+    """
+    if not isinstance(hosts, dict):
+        hosts = dict([ (host, {}) for host in hosts ])
+
+    def collect(host, host_args):
+        if isinstance(host_args, dict):
+            obj = collector(host, **dict(collector_kwargs, **host_args))
+        else:
+            obj = collector(*host_args, **collector_kwargs)
+        call = method if callable(method) else getattr(obj, method)
+        if hasattr(obj, '__enter__'):
+            # the connection is closed whatever happens
+            with obj:
+                return call(obj) if callable(method) else call(*method_args, **method_kwargs)
+        return call(obj) if callable(method) else call(*method_args, **method_kwargs)
+
+    tasks = [ (host, (lambda host=host, host_args=host_args: collect(host, host_args), timeout))
+              for host, host_args in hosts.items() ]
+    naghelp.logger.debug('collect -> fanout %s.%s on %s hosts', collector.__name__,
+                         getattr(method, '__name__', method), len(tasks))
+    with tracer.span('fanout', collector=collector.__name__, hosts=len(tasks), max_workers=max_workers):
+        results, errors = run_concurrently(tasks, max_workers=max_workers)
+    dct = textops.DictExt(results)
+    dct.update(errors)
+    return dct
 
 def debug_pattern_list(pat_list):
     return [ (pat if isinstance(pat,basestring) else pat.pattern) for pat in pat_list ]
@@ -439,6 +932,13 @@ class Expect(object):
             that generated the ``result`` and ``key`` the key in the dictionary for ``mrun``,
             ``mget`` and ``mwalk``.
             By Default, there is no filter.
+        search_window (int): Patterns are searched only in the last ``search_window`` bytes
+            received, this way, waiting the prompt after a big output is not slowed down.
+            Use None to search the whole output (Default : 4096)
+        pool (:class:`ExpectSessionPool` or bool): If True or a pool object, the logged-in spawned
+            command is kept alive on close to be reused by the next :class:`Expect` object with the
+            same ``spawn``, ``login_steps``, ``prompt`` and ``context``. ``prompt`` is mandatory.
+            True means the default pool ``naghelp.collect.expect_pool`` (Default : None)
 
     On object creation, :class:`Expect` will :
 
@@ -528,7 +1028,7 @@ class Expect(object):
 
     def __init__(self,spawn,login_steps=None,prompt=None,logout_cmd=None,logout_steps=None,context={},
                  timeout = 30, expected_pattern=r'\S', unexpected_pattern=r'<timeout>',
-                 filter=None,*args,**kwargs):
+                 filter=None, search_window=4096, pool=None, *args,**kwargs):
 
         self.expected_pattern = expected_pattern
         self.unexpected_pattern = unexpected_pattern
@@ -548,12 +1048,27 @@ class Expect(object):
         import pexpect
         self.in_with = False
         self.is_connected = False
+        self.is_clean = True
+        self.compiled_patterns = {}
+        self.pool = expect_pool if pool is True else pool
+        self.pool_key = None
+        if self.pool and prompt:
+            self.pool_key = (spawn, repr(login_steps), prompt, repr(sorted(context.items())))
         naghelp.logger.debug('collect -> #### Expect( %s ) ###############',spawn)
-        with Timeout(seconds = timeout, error_message='Timeout (%ss) for pexpect : %s' % (timeout,spawn)):
-            self.child = pexpect.spawn(spawn)
+        if self.pool_key:
+            self.child = self.pool.acquire(self.pool_key, self._check_session)
+            if self.child is not None:
+                naghelp.logger.debug('collect -> Reuse pooled session : is_connected = True')
+                self.is_connected = True
+                return
+        with tracer.span('expect.connect', spawn=spawn), \
+             Timeout(seconds = timeout, error_message='Timeout (%ss) for pexpect : %s' % (timeout,spawn)):
+            with tracer.span('expect.spawn', spawn=spawn):
+                self.child = pexpect.spawn(spawn, maxread=65536, searchwindowsize=search_window)
             if login_steps or prompt:
                 naghelp.logger.debug('collect -> ==== Login steps up to the prompt =====')
-                error_msg = self._expect_steps( (login_steps or ()) + ( ((prompt,None),) if prompt else () ) )
+                with tracer.span('expect.login', spawn=spawn):
+                    error_msg = self._expect_steps( (login_steps or ()) + ( ((prompt,None),) if prompt else () ) )
                 if error_msg:
                     raise ConnectionError(error_msg)
             self.is_connected = True
@@ -564,6 +1079,24 @@ class Expect(object):
         pat = re.sub(r'^\^',r'[\r\n]',pat)
         return pat
 
+    def _expect(self,patterns,child=None,timeout=-1):
+        """Same as pexpect ``expect()`` but the compiled patterns are cached"""
+        child = child or self.child
+        key = tuple(patterns)
+        compiled = self.compiled_patterns.get(key)
+        if compiled is None:
+            compiled = self.compiled_patterns[key] = child.compile_pattern_list(patterns)
+        return child.expect_list(compiled, timeout=timeout)
+
+    def _check_session(self,child,timeout):
+        """Checks a pooled spawned command is still alive and at the prompt"""
+        try:
+            child.sendline('')
+            self._expect([self._expect_pattern_rewrite(self.prompt)], child, timeout)
+            return True
+        except (pexpect.ExceptionPexpect, OSError):
+            return False
+
     def _expect_steps(self,steps):
         step = 0
         nb_steps = len(steps)
@@ -587,7 +1120,7 @@ class Expect(object):
                 patterns = [ self._expect_pattern_rewrite(e[0]) for e in expects ]
                 naghelp.logger.debug('collect -> <-- expect(%s) ...',patterns)
                 try:
-                    found = self.child.expect(patterns)
+                    found = self._expect(patterns)
                 except pexpect.EOF:
                     naghelp.logger.debug('CollectError : No more data (EOF) from %s' % self.spawn)
                     raise CollectError('No more data (EOF) from %s' % self.spawn)
@@ -634,11 +1167,22 @@ class Expect(object):
 
     def close(self):
         if not self.in_with:
+            if self.is_connected and self.pool_key and self.is_clean:
+                self.is_connected = False
+                self.pool.release(self.pool_key, self)
+                naghelp.logger.debug('collect -> #### Expect : Session back to the pool ###############')
+                return
             self.is_connected = False
+            self.terminate()
+
+    def terminate(self):
+        """Logs out and terminates the spawned command, even if it could be pooled"""
+        try:
             if self.logout_cmd:
                 self.child.sendline(self.logout_cmd)
             if self.logout_steps:
                 self._expect_steps(self.logout_steps)
+        finally:
             try:
                 self.child.kill(0)
             except OSError:
@@ -646,22 +1190,26 @@ class Expect(object):
             naghelp.logger.debug('collect -> #### Expect : Connection closed ###############')
 
     def _run_cmd(self,cmd):
+        # a session that did not reach the prompt after the command must not be pooled
+        self.is_clean = False
+        with tracer.span('expect.command', spawn=self.spawn, cmd=cmd) as span:
+            if cmd:
+                naghelp.logger.debug('collect -> run("%s") %s',cmd,naghelp.debug_caller())
+                self.child.sendline('%s' % cmd)
+
+            prompt = self._expect_pattern_rewrite(self.prompt)
+            naghelp.logger.debug('collect ->     expect prompt : %s',prompt)
+            try:
+                self._expect([prompt])
+            except pexpect.EOF:
+                naghelp.logger.debug('CollectError : No more data (EOF) from %s' % self.spawn)
+                raise CollectError('No more data (EOF) from %s' % self.spawn)
+            out = self.child.before
+            span.set(bytes_out=len(out))
+        self.is_clean = True
         if cmd:
-            naghelp.logger.debug('collect -> run("%s") %s',cmd,naghelp.debug_caller())
-            self.child.sendline('%s' % cmd)
-
-        prompt = self._expect_pattern_rewrite(self.prompt)
-        naghelp.logger.debug('collect ->     expect prompt : %s',prompt)
-        try:
-            self.child.expect(prompt)
-        except pexpect.EOF:
-            naghelp.logger.debug('CollectError : No more data (EOF) from %s' % self.spawn)
-            raise CollectError('No more data (EOF) from %s' % self.spawn)
-        out = self.child.before
-        # use re.compile to be compatible with python 2.6 (flags in re.sub only for python 2.7+)
-        rmcmd = re.compile(r'^.*?%s\n*' % cmd, re.DOTALL)
-        out = rmcmd.sub('', out)
-        out = re.sub(r'[\r\n]*$', '', out)
+            out = _strip_echo(out, cmd)
+        out = out.rstrip('\r\n')
         out = out.replace('\r','')
         return out
 
@@ -807,6 +1355,109 @@ class Expect(object):
             self.close()
         return dct
 
+class ExpectSessionPool(object):
+    r"""Pool of logged-in :class:`Expect` sessions
+
+    The spawned commands are kept alive between uses : this avoids to replay the login steps
+    for devices that can only be reached through an interactive CLI. Before being reused, a
+    session is checked by sending a newline and waiting for the prompt. Idle sessions are logged
+    out after ``max_idle`` seconds, the remaining ones at the end of the process.
+
+    A pool lives in the python process : sessions are only reused within a same plugin run, for
+    example by the :class:`Expect` objects of the different collect steps. The launcher server mode
+    runs each plugin in its own forked worker, so sessions are not shared between plugin runs there
+    either : the worker logs out its sessions before exiting.
+
+    Args:
+
+        max_idle (int): The number of seconds after which an idle session is logged out
+            (Default : 300)
+        max_sessions (int): The maximum number of idle sessions per spawn command and context
+            (Default : 4)
+        check_timeout (int): The maximum time in seconds to wait for the prompt when checking a
+            session (Default : 5)
+
+    Example:
+
+        The second run does not replay the login steps::
+
+            steps = ( (r'(?i)Login[^:]*: ','{user}\n'), (r'(?i)Password[^:]*: ','{password}\n') )
+            ctx = {'user': 'admin', 'password': 'adminpwd'}
+            out1 = Expect('telnet 10.0.0.1', steps, r'^CLI> ', context=ctx, pool=True).run('show status')
+            out2 = Expect('telnet 10.0.0.1', steps, r'^CLI> ', context=ctx, pool=True).run('show alarms')
+    """
+    def __init__(self, max_idle=300, max_sessions=4, check_timeout=5):
+        self.max_idle = max_idle
+        self.max_sessions = max_sessions
+        self.check_timeout = check_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        atexit.register(self.close_all)
+
+    def acquire(self, key, check):
+        """Returns a healthy pooled spawned command for ``key`` or None
+
+        ``check(child, timeout)`` must return False if the spawned command cannot be reused
+        """
+        self.evict_idle()
+        while True:
+            with self.lock:
+                sessions = self.sessions.get(key)
+                if not sessions:
+                    return None
+                last_used, session = sessions.pop()
+            if check(session.child, self.check_timeout):
+                naghelp.logger.debug('collect -> ExpectSessionPool : reuse session for %s', key[0])
+                return session.child
+            naghelp.logger.debug('collect -> ExpectSessionPool : broken session for %s', key[0])
+            self._terminate(session)
+
+    def release(self, key, session):
+        """Gives back an :class:`Expect` session to the pool"""
+        with self.lock:
+            sessions = self.sessions.setdefault(key, [])
+            if len(sessions) < self.max_sessions:
+                sessions.append((time.time(), session))
+                session = None
+        if session is not None:
+            self._terminate(session)
+        self.evict_idle()
+
+    def evict_idle(self):
+        """Logs out the sessions idle for more than ``max_idle`` seconds"""
+        limit = time.time() - self.max_idle
+        evicted = []
+        with self.lock:
+            for key, sessions in self.sessions.items():
+                evicted.extend([ session for last_used, session in sessions if last_used < limit ])
+                sessions[:] = [ (last_used, session) for last_used, session in sessions
+                                if last_used >= limit ]
+                if not sessions:
+                    del self.sessions[key]
+        for session in evicted:
+            self._terminate(session)
+
+    def close_all(self):
+        """Logs out all the pooled sessions"""
+        with self.lock:
+            evicted = [ session for sessions in self.sessions.values() for last_used, session in sessions ]
+            self.sessions = {}
+        for session in evicted:
+            self._terminate(session)
+
+    def _terminate(self, session):
+        try:
+            with Timeout(seconds = self.check_timeout):
+                session.terminate()
+        except Exception,e:
+            naghelp.logger.debug('collect -> ExpectSessionPool : cannot log out : %s', e)
+            try:
+                session.child.kill(9)
+            except OSError:
+                pass
+
+expect_pool = ExpectSessionPool()
+
 class Telnet(object):
     r"""Telnet class helper
 
@@ -830,8 +1481,12 @@ class Telnet(object):
         autherr_pattern (str): The pattern to recognize authentication error
             (Default : ``bad password|login incorrect|login failed|authentication error``).
             One can specify a string or a re.RegexObject.
-        sleep (int): Add delay in seconds before each write/expect
-        sleep_login (int): Add delay in seconds before login
+        sleep (int): Add delay in seconds before each write/expect, use it only for devices that
+            loose data sent too early (Default : 0, no delay)
+        sleep_login (int): Add delay in seconds before login (Default : 0, no delay)
+        search_window (int): The prompt is searched only in the new data and the last
+            ``search_window`` bytes received before, this way, reading a big output is not
+            slowed down. Use None to search the whole output (Default : 4096)
         expected_pattern (str or regex): raise UnexpectedResultError if the pattern is not found
             in methods that collect data (like run,mrun,get,mget,walk,mwalk...)
             if None, there is no test. By default, tests the result is not empty.
@@ -848,13 +1503,14 @@ class Telnet(object):
     def __init__(self,host, user, password=None, timeout=30, port=0,
                  login_pattern=None, passwd_pattern=None, prompt_pattern=None, autherr_pattern=None,
                  sleep=0, sleep_login=0, expected_pattern=r'\S', unexpected_pattern=r'<timeout>',
-                 filter=None, *args,**kwargs):
+                 filter=None, search_window=4096, *args,**kwargs):
         #import is done only on demand, because it takes some little time
         import telnetlib
         self.in_with = False
         self.is_connected = False
         self.prompt = None
         self.sleep = sleep
+        self.search_window = search_window
         login_pattern = Telnet._normalize_pattern(login_pattern, r'login\s*:')
         passwd_pattern = Telnet._normalize_pattern(passwd_pattern, r'Password\s*:')
         prompt_pattern = Telnet._normalize_pattern(prompt_pattern, r'[\r\n][^\s]*\s?[\$#>:]+\s')
@@ -872,28 +1528,40 @@ class Telnet(object):
         if not user:
             raise ConnectionError('No user specified for Telnet')
         naghelp.logger.debug('collect -> #### Telnet( %s@%s ) ###############',user, host)
-        with Timeout(seconds = timeout, error_message='Timeout (%ss) for telnet to %s' % (timeout,host)):
+        self.host = host
+        with tracer.span('telnet.connect', host=host, user=user) as span, \
+             Timeout(seconds = timeout, error_message='Timeout (%ss) for telnet to %s' % (timeout,host)):
             try:
-                self.tn = telnetlib.Telnet(host,port,timeout,**kwargs)
+                if span.enabled:
+                    # resolve the name in a distinct span
+                    with tracer.span('telnet.dns', host=host) as dns_span:
+                        addr = socket.getaddrinfo(host, port or 23, 0, socket.SOCK_STREAM)[0][4][0]
+                        dns_span.set(addr=addr)
+                    with tracer.span('telnet.tcp', host=host, addr=addr, port=port or 23):
+                        self.tn = telnetlib.Telnet(addr,port,timeout,**kwargs)
+                else:
+                    self.tn = telnetlib.Telnet(host,port,timeout,**kwargs)
                 #self.tn.set_debuglevel(1)
             except Exception,e:
                 raise ConnectionError(e)
-            naghelp.logger.debug('collect -> <-- expect(%s) ...',debug_pattern_list(login_pattern))
-            time.sleep(sleep_login or sleep)
-            self.tn.expect(login_pattern)
-            naghelp.logger.debug('collect ->   ==> %s',user)
-            time.sleep(sleep)
-            self.tn.write(user + "\n")
-            naghelp.logger.debug('collect -> <-- expect(%s) ...',debug_pattern_list(passwd_pattern))
-            if password is not None:
-                time.sleep(sleep)
-                self.tn.expect(passwd_pattern)
-                naghelp.logger.debug('collect ->   ==> (hidden password)')
-                time.sleep(sleep)
-                self.tn.write(password + "\n")
+            with tracer.span('telnet.auth', host=host, user=user):
+                naghelp.logger.debug('collect -> <-- expect(%s) ...',debug_pattern_list(login_pattern))
+                self._sleep(sleep_login or sleep)
+                self._expect(login_pattern)
+                naghelp.logger.debug('collect ->   ==> %s',user)
+                self._sleep(sleep)
+                self.tn.write(user + "\n")
+                naghelp.logger.debug('collect -> <-- expect(%s) ...',debug_pattern_list(passwd_pattern))
+                if password is not None:
+                    self._sleep(sleep)
+                    self._expect(passwd_pattern)
+                    naghelp.logger.debug('collect ->   ==> (hidden password)')
+                    self._sleep(sleep)
+                    self.tn.write(password + "\n")
             naghelp.logger.debug('collect -> <-- expect(%s) ...',debug_pattern_list(prompt_pattern + autherr_pattern))
-            time.sleep(sleep)
-            pat_id,m,buffer = self.tn.expect(prompt_pattern + autherr_pattern)
+            with tracer.span('telnet.prompt', host=host):
+                self._sleep(sleep)
+                pat_id,m,buffer = self._expect(prompt_pattern + autherr_pattern)
             naghelp.logger.debug('collect -> pat_id,m,buffer = %s, %s, %s',pat_id,m,buffer)
             if pat_id < 0:
                 raise ConnectionError('No regular prompt found.')
@@ -910,7 +1578,63 @@ class Telnet(object):
             pattern = [re.sub(r'^\^',r'[\r\n]',pattern)]
         elif not isinstance(pattern,list):
             pattern = [pattern]
-        return pattern
+        # patterns are compiled once for all
+        return [ re.compile(p) if isinstance(p,basestring) else p for p in pattern ]
+
+    @staticmethod
+    def _sleep(seconds):
+        if seconds:
+            time.sleep(seconds)
+
+    def _fill_rawq(self):
+        """Same as telnetlib ``fill_rawq()`` but reads bigger blocks"""
+        tn = self.tn
+        if tn.irawq >= len(tn.rawq):
+            tn.rawq = ''
+            tn.irawq = 0
+        buf = tn.sock.recv(65536)
+        tn.eof = (not buf)
+        tn.rawq = tn.rawq + buf
+
+    def _process_rawq(self):
+        """Same as telnetlib ``process_rawq()`` but the data before any telnet command are not
+        processed byte per byte"""
+        import telnetlib
+        tn = self.tn
+        if not tn.iacseq and not tn.sb:
+            raw = tn.rawq[tn.irawq:]
+            pos = raw.find(telnetlib.IAC)
+            plain = raw if pos < 0 else raw[:pos]
+            tn.cookedq += plain.replace(telnetlib.theNULL,'').replace('\021','')
+            tn.rawq = raw[len(plain):]
+            tn.irawq = 0
+        if tn.rawq:
+            tn.process_rawq()
+
+    def _expect(self,patterns):
+        """Same as telnetlib ``expect()`` without timeout but patterns are searched only in the new
+        data and the ``search_window`` bytes received before"""
+        tn = self.tn
+        data = ''
+        searched = 0
+        while True:
+            self._process_rawq()
+            data += tn.cookedq
+            tn.cookedq = ''
+            start = max(0, searched - self.search_window) if self.search_window is not None else 0
+            for i,pattern in enumerate(patterns):
+                m = pattern.search(data, start)
+                if m:
+                    tn.cookedq = data[m.end():]
+                    return i, m, data[:m.end()]
+            searched = len(data)
+            if tn.eof:
+                break
+            select.select([tn], [], [])
+            self._fill_rawq()
+        if not data:
+            raise EOFError
+        return -1, None, data
 
     def __enter__(self):
         self.in_with = True
@@ -930,18 +1654,17 @@ class Telnet(object):
         if isinstance(cmd, unicode):
             cmd = cmd.encode('utf-8','ignore')
         naghelp.logger.debug('collect -> run("%s") %s',cmd,naghelp.debug_caller())
-        time.sleep(self.sleep)
-        self.tn.write('%s\n' % cmd)
-        naghelp.logger.debug('collect -> <-- expect(%s) ...',debug_pattern_list(self.prompt_pattern))
-        time.sleep(self.sleep)
-        pat_id,m,buffer = self.tn.expect(self.prompt_pattern)
-        out = buffer.replace('\r','')
-        # use re.compile to be compatible with python 2.6 (flags in re.sub only for python 2.7+)
-        rmcmd = re.compile(r'^.*?%s\n*' % cmd, re.DOTALL)
-        out = rmcmd.sub('', out)
+        with tracer.span('telnet.command', host=self.host, cmd=cmd) as span:
+            self._sleep(self.sleep)
+            self.tn.write('%s\n' % cmd)
+            naghelp.logger.debug('collect -> <-- expect(%s) ...',debug_pattern_list(self.prompt_pattern))
+            self._sleep(self.sleep)
+            pat_id,m,buffer = self._expect(self.prompt_pattern)
+            span.set(bytes_out=len(buffer))
         # remove cmd and prompt (first and last line)
-        out = out.splitlines()[:-1]
-        cmd_out = '\n'.join(out)
+        cmd_out = _strip_echo(buffer.replace('\r',''), cmd)
+        eol = cmd_out.rfind('\n')
+        cmd_out = cmd_out[:eol] if eol >= 0 else ''
         naghelp.debug_listing(cmd_out)
         return cmd_out
 
@@ -1073,7 +1796,340 @@ class Telnet(object):
             self.close()
         return dct
 
-class Ssh(object):
+def _strip_echo(out, cmd):
+    """Removes the data up to the echoed command and the newlines after it
+
+    >>> _strip_echo('$ ls *.txt\\na.txt\\nb.txt\\n$ ', 'ls *.txt')
+    'a.txt\\nb.txt\\n$ '
+    """
+    pos = out.find(cmd)
+    if pos < 0:
+        return out
+    return out[pos + len(cmd):].lstrip('\n')
+
+def _read_exec_channel(chan):
+    """Reads stdout and stderr of an exec channel until the command exits
+
+    Returns:
+
+        str, str, int: stdout, stderr and the exit status
+
+    Raises:
+
+        socket.timeout: if the channel timeout is reached, the data read so far is in its
+            ``partial`` attribute as a tuple ``(stdout, stderr)``
+    """
+    out = []
+    err = []
+    try:
+        while True:
+            if chan.recv_stderr_ready():
+                err.append(chan.recv_stderr(65536))
+                continue
+            chunk = chan.recv(65536)
+            if not chunk:
+                break
+            out.append(chunk)
+        while True:
+            chunk = chan.recv_stderr(65536)
+            if not chunk:
+                break
+            err.append(chunk)
+        status = chan.recv_exit_status()
+    except socket.timeout, e:
+        e.partial = (''.join(out), ''.join(err))
+        raise
+    return ''.join(out), ''.join(err), status
+
+def _demux_output(data, begin, end):
+    """Returns the data between the begin and end markers regexes and the end match or None
+
+    >>> out, m = _demux_output('M_0_BEGIN\\nline1\\nline2\\n\\nM_0_END:0\\n', r'M_0_BEGIN\\r?\\n', r'\\r?\\nM_0_END:(\\d+)\\r?\\n')
+    >>> out, m.group(1)
+    ('line1\\nline2\\n', '0')
+    >>> out, m = _demux_output('M_0_BEGIN\\r\\nline1\\r\\n\\r\\nM_0_END:2\\r\\n', r'M_0_BEGIN\\r?\\n', r'\\r?\\nM_0_END:(\\d+)\\r?\\n')
+    >>> out, m.group(1)
+    ('line1\\r\\n', '2')
+    >>> print _demux_output('M_0_BEGIN\\nline1\\n', r'M_0_BEGIN\\r?\\n', r'\\r?\\nM_0_END:(\\d+)\\r?\\n')
+    None
+    """
+    m_begin = re.search(begin, data)
+    if not m_begin:
+        return None
+    m_end = re.compile(end).search(data, m_begin.end())
+    if not m_end:
+        return None
+    return data[m_begin.end():m_end.start()], m_end
+
+class SftpTransferMixin(object):
+    r"""Bulk SFTP transfers for :class:`Ssh` and :class:`Sftp`
+
+    Files are transferred through several SFTP sessions at once, each one with read-ahead
+    (downloads) or pipelined writes (uploads). Unchanged files can be skipped by giving a ``cache``
+    dictionary where the files size and modification time are stored : usually the plugin
+    ``self.host`` object, so they are kept in the host persistent data between plugin executions.
+
+    The class using this mixin must define ``_open_sftp()`` that returns a new paramiko
+    SFTPClient and ``_get_sftp()`` that returns its own SFTPClient.
+    """
+    def _open_sftp(self):
+        raise NotImplementedError
+
+    def _get_sftp(self):
+        raise NotImplementedError
+
+    def _run_sftp_tasks(self, tasks, concurrency, timeout=None):
+        """Runs ``(key, func)`` tasks where func is called with a SFTPClient : one session per thread
+
+        Returns the results dict, raises :class:`CollectTasksError` if some tasks failed
+        """
+        free = [ self._get_sftp() ]
+        opened = []
+        lock = threading.Lock()
+        local = threading.local()
+
+        def session():
+            sftp = getattr(local, 'sftp', None)
+            if sftp is None:
+                with lock:
+                    sftp = free.pop() if free else None
+                if sftp is None:
+                    sftp = self._open_sftp()
+                    with lock:
+                        opened.append(sftp)
+                local.sftp = sftp
+            return sftp
+
+        tasks = [ (key, (lambda func=func: func(session()))) for key, func in tasks ]
+        try:
+            results, errors = run_concurrently(tasks, max_workers=max(1, concurrency), timeout=timeout)
+        finally:
+            for sftp in opened:
+                sftp.close()
+        if errors:
+            raise CollectTasksError(errors, results)
+        return results
+
+    def walk(self, top='.', concurrency=4):
+        r"""Walks a remote directory tree
+
+        This works like ``os.walk()`` except that directories and files are given as
+        paramiko SFTPAttributes objects (with ``filename``, ``st_size``, ``st_mtime`` ...
+        attributes) : there is no ``stat`` request per file. The directories of a same
+        level are listed concurrently.
+
+        Args:
+
+            top (str): The remote directory to walk (Default : current directory)
+            concurrency (int): The maximum number of directories listed at the same time
+                (Default : 4)
+
+        Yields:
+
+            tuple : ``(dirpath, dirs, files)`` where ``dirs`` and ``files`` are lists of
+            SFTPAttributes objects. Like ``os.walk()``, removing items from ``dirs`` prevents
+            walking into these directories.
+
+        Example:
+
+            To download all ``.log`` files of a directory tree::
+
+                with Sftp(host, user, password) as sftp:
+                    files = {}
+                    for dirpath, dirs, files_attrs in sftp.walk('/var/log/vendor'):
+                        for attr in files_attrs:
+                            if attr.filename.endswith('.log'):
+                                remote = posixpath.join(dirpath, attr.filename)
+                                files[remote] = os.path.join('/tmp/vendor', remote.replace('/','_'))
+                    sftp.mget(files, cache=self.host)
+        """
+        import stat
+        import posixpath
+        level = [ top ]
+        while level:
+            tasks = [ (path, (lambda path=path: lambda sftp: sftp.listdir_attr(path))())
+                      for path in level ]
+            listings = self._run_sftp_tasks(tasks, concurrency)
+            level = []
+            for path in sorted(listings):
+                dirs = []
+                files = []
+                for attr in sorted(listings[path], key=lambda a: a.filename):
+                    if attr.st_mode is not None and stat.S_ISDIR(attr.st_mode):
+                        dirs.append(attr)
+                    else:
+                        files.append(attr)
+                yield path, dirs, files
+                level.extend([ posixpath.join(path, d.filename) for d in dirs ])
+
+    def _remote_attrs(self, paths, concurrency):
+        """Gets SFTPAttributes of remote files : one ``listdir_attr`` for files of a same directory"""
+        import posixpath
+        by_dir = {}
+        for path in paths:
+            by_dir.setdefault(posixpath.dirname(path) or '.', []).append(path)
+        tasks = []
+        for dirpath, dir_paths in by_dir.items():
+            if len(dir_paths) == 1:
+                tasks.append((dirpath, (lambda path=dir_paths[0]: lambda sftp: [ sftp.stat(path) ])()))
+            else:
+                tasks.append((dirpath, (lambda dirpath=dirpath: lambda sftp: sftp.listdir_attr(dirpath))()))
+        try:
+            listings = self._run_sftp_tasks(tasks, concurrency)
+        except CollectTasksError, e:
+            listings = e.results
+        attrs = {}
+        for dirpath, dir_paths in by_dir.items():
+            if len(dir_paths) == 1:
+                if dirpath in listings:
+                    attrs[dir_paths[0]] = listings[dirpath][0]
+            else:
+                names = dict([ (a.filename, a) for a in listings.get(dirpath, []) ])
+                for path in dir_paths:
+                    if posixpath.basename(path) in names:
+                        attrs[path] = names[posixpath.basename(path)]
+        return attrs
+
+    def mget(self, files, localdir='.', concurrency=4, cache=None, cache_key='sftp_mget', timeout=None):
+        r"""Downloads many remote files at once
+
+        Several files are downloaded at the same time, each one through its own SFTP session with
+        read-ahead. Local files get the remote modification time. Remote files metadata are
+        read with one ``listdir_attr`` request per remote directory.
+
+        Args:
+
+            files (list or dict): A list of remote paths (the files are written in ``localdir``
+                with the same base name) or a dictionary remote path -> local path
+            localdir (str): The local directory where to write files given as a list
+                (Default : current directory)
+            concurrency (int): The maximum number of files transferred at the same time
+                (Default : 4)
+            cache (dict): A dictionary where remote files size and modification time are stored :
+                a file is not downloaded again if it did not change since the last call and if
+                the local file still exists. Use the plugin ``self.host`` object to keep them
+                between plugin executions. (Default : None, all files are downloaded)
+            cache_key (str): The key in ``cache`` (Default : 'sftp_mget')
+            timeout (int): The maximum time in seconds for each file (Default : None)
+
+        Returns:
+
+            :class:`textops.DictExt` : remote path -> local path for the files that have been
+            downloaded, the unchanged files are not included.
+
+        Raises:
+
+            CollectTasksError: if some files cannot be downloaded, the ``errors`` attribute gives
+            the exception for each remote path.
+        """
+        if not isinstance(files, dict):
+            files = dict([ (path, os.path.join(localdir, os.path.basename(path))) for path in files ])
+        naghelp.logger.debug('collect -> mget %s files %s', len(files), naghelp.debug_caller())
+        files_cache = dict((cache.get(cache_key) or {}) if cache is not None else {})
+        with tracer.span('sftp.mget', host=self.host, files=len(files)) as span:
+            attrs = self._remote_attrs(files.keys(), concurrency)
+            tasks = []
+            for remote, local in files.items():
+                attr = attrs.get(remote)
+                if attr is not None and files_cache.get(remote) == [attr.st_size, attr.st_mtime] \
+                   and os.path.isfile(local) and os.path.getsize(local) == attr.st_size:
+                    continue
+                tasks.append((remote, (lambda remote=remote, local=local, attr=attr:
+                                       lambda sftp: _sftp_get(sftp, remote, local, attr))()))
+            span.set(transferred=len(tasks))
+            naghelp.logger.debug('collect -> mget : %s unchanged files', len(files) - len(tasks))
+            results, error = self._run_transfers(tasks, concurrency, timeout)
+        if cache is not None:
+            for remote in results:
+                if remote in attrs:
+                    files_cache[remote] = [attrs[remote].st_size, attrs[remote].st_mtime]
+            cache[cache_key] = files_cache
+        if error:
+            raise error
+        return textops.DictExt(results)
+
+    def mput(self, files, remotedir='.', concurrency=4, cache=None, cache_key='sftp_mput', timeout=None):
+        r"""Uploads many local files at once
+
+        Several files are uploaded at the same time, each one through its own SFTP session with
+        pipelined writes. Remote files get the local modification time.
+
+        Args:
+
+            files (list or dict): A list of local paths (the files are written in ``remotedir``
+                with the same base name) or a dictionary local path -> remote path
+            remotedir (str): The remote directory where to write files given as a list
+                (Default : current directory)
+            concurrency (int): The maximum number of files transferred at the same time
+                (Default : 4)
+            cache (dict): A dictionary where local files size and modification time are stored :
+                a file is not uploaded again if it did not change since the last call, there is
+                no request to the remote host for these files. Use the plugin ``self.host``
+                object to keep them between plugin executions.
+                (Default : None, all files are uploaded)
+            cache_key (str): The key in ``cache`` (Default : 'sftp_mput')
+            timeout (int): The maximum time in seconds for each file (Default : None)
+
+        Returns:
+
+            :class:`textops.DictExt` : local path -> remote path for the files that have been
+            uploaded, the unchanged files are not included.
+
+        Raises:
+
+            CollectTasksError: if some files cannot be uploaded, the ``errors`` attribute gives
+            the exception for each local path.
+        """
+        import posixpath
+        if not isinstance(files, dict):
+            files = dict([ (path, posixpath.join(remotedir, os.path.basename(path))) for path in files ])
+        naghelp.logger.debug('collect -> mput %s files %s', len(files), naghelp.debug_caller())
+        files_cache = dict((cache.get(cache_key) or {}) if cache is not None else {})
+        with tracer.span('sftp.mput', host=self.host, files=len(files)) as span:
+            stats = {}
+            tasks = []
+            for local, remote in files.items():
+                try:
+                    st = stats[local] = os.stat(local)
+                    if files_cache.get(remote) == [st.st_size, int(st.st_mtime)]:
+                        continue
+                except OSError:
+                    pass
+                tasks.append((local, (lambda local=local, remote=remote:
+                                      lambda sftp: _sftp_put(sftp, local, remote))()))
+            span.set(transferred=len(tasks))
+            naghelp.logger.debug('collect -> mput : %s unchanged files', len(files) - len(tasks))
+            results, error = self._run_transfers(tasks, concurrency, timeout)
+        if cache is not None:
+            for local, remote in results.items():
+                files_cache[remote] = [stats[local].st_size, int(stats[local].st_mtime)]
+            cache[cache_key] = files_cache
+        if error:
+            raise error
+        return textops.DictExt(results)
+
+    def _run_transfers(self, tasks, concurrency, timeout):
+        """Returns the results and the error of :meth:`_run_sftp_tasks` to update the cache anyway"""
+        try:
+            return self._run_sftp_tasks(tasks, concurrency, timeout), None
+        except CollectTasksError, e:
+            return e.results, e
+
+def _sftp_get(sftp, remote, local, attr):
+    """Downloads one file with read-ahead and sets the remote modification time to the local file"""
+    sftp.get(remote, local, prefetch=True)
+    if attr is not None:
+        os.utime(local, (attr.st_atime, attr.st_mtime))
+    return local
+
+def _sftp_put(sftp, local, remote):
+    """Uploads one file with pipelined writes and sets the local modification time to the remote file"""
+    st = os.stat(local)
+    sftp.put(local, remote)
+    sftp.utime(remote, (st.st_atime, st.st_mtime))
+    return remote
+
+class Ssh(SftpTransferMixin):
     r"""Ssh class helper
 
     This class create a ssh connection in order to run one or many commands.
@@ -1118,12 +2174,18 @@ class Ssh(object):
         gss_host (str): The targets name in the kerberos database. default: hostname
         banner_timeout (float): an optional timeout (in seconds) to wait
             for the SSH banner to be presented.
+        broker (str): The unix socket path of a SSH broker (see :mod:`naghelp.broker`) that keeps
+            connections alive between plugins runs. By default, the ``NAGHELP_SSH_BROKER``
+            environment variable is used if set. Use False to never use a broker.
+            The broker is not used when a ``prompt_pattern``, a ``sock`` or a ``pkey`` is given,
+            nor when it is not reachable.
     """
+    prompt_search_window = 4096
+    """In prompt mode, the prompt is searched in received data plus this number of bytes before"""
+
     def __init__(self,host, user, password=None, timeout=30, auto_accept_new_host=True,
                  prompt_pattern=None, get_pty=False, expected_pattern=r'\S', unexpected_pattern=r'<timeout>',
-                 filter=None, add_stderr=True, *args,**kwargs):
-        #import is done only on demand, because it takes some little time
-        import paramiko
+                 filter=None, add_stderr=True, broker=None, *args,**kwargs):
         self.in_with = False
         self.is_connected = False
         self.prompt_pattern = prompt_pattern
@@ -1132,27 +2194,74 @@ class Ssh(object):
         self.unexpected_pattern = unexpected_pattern
         self.filter = filter
         self.add_stderr = add_stderr
-        self.client = paramiko.SSHClient()
+        self.client = None
         self.scpclient = None
+        self.sftpclient = None
+        self.broker = None
         if not host:
             raise ConnectionError('No host specified for Ssh')
         if not user:
             raise ConnectionError('No user specified for Ssh')
+        naghelp.logger.debug('collect -> #### Ssh( %s@%s ) ###############',user, host)
+        self.host = host
+        self._connect_params = (host, user, password, timeout, auto_accept_new_host, kwargs)
+        if broker is None:
+            broker = os.environ.get('NAGHELP_SSH_BROKER')
+        if broker and not prompt_pattern and 'sock' not in kwargs and 'pkey' not in kwargs:
+            from .broker import BrokerClient
+            try:
+                self.broker = BrokerClient(broker)
+            except socket.error,e:
+                naghelp.logger.debug('collect -> SSH broker not reachable on %s : %s',broker,e)
+        if self.broker is not None:
+            try:
+                with tracer.span('ssh.connect', host=host, user=user, broker=True):
+                    self.broker.connect(host, user, password, timeout, auto_accept_new_host, **kwargs)
+            except Exception,e:
+                self.broker.close()
+                raise ConnectionError(e)
+        else:
+            self._connect(host, user, password, timeout, auto_accept_new_host, kwargs)
+        naghelp.logger.debug('collect -> is_connected = True')
+        self.is_connected = True
+
+    def _connect(self, host, user, password, timeout, auto_accept_new_host, kwargs):
+        #import is done only on demand, because it takes some little time
+        import paramiko
+        self.client = paramiko.SSHClient()
         if auto_accept_new_host:
             self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self.client.load_system_host_keys()
-        naghelp.logger.debug('collect -> #### Ssh( %s@%s ) ###############',user, host)
         try:
-            self.client.connect(host,username=user,password=password, timeout=timeout, **kwargs)
-            if self.prompt_pattern:
-                self.prompt_pattern = re.compile(re.sub(r'^\^',r'[\r\n]',prompt_pattern))
-                self.chan = self.client.invoke_shell(width=160,height=48)
-                self.chan.settimeout(timeout)
-                self._read_to_prompt()
+            with tracer.span('ssh.connect', host=host, user=user) as span:
+                if span.enabled and 'sock' not in kwargs:
+                    kwargs['sock'] = _traced_connect('ssh', host, kwargs.get('port', 22), timeout)
+                with tracer.span('ssh.auth', host=host, user=user):
+                    self.client.connect(host,username=user,password=password, timeout=timeout, **kwargs)
+                if self.prompt_pattern:
+                    self.prompt_pattern = re.compile(re.sub(r'^\^',r'[\r\n]',self.prompt_pattern))
+                    with tracer.span('ssh.prompt', host=host):
+                        self.chan = self.client.invoke_shell(width=160,height=48)
+                        self.chan.settimeout(timeout)
+                        self._read_to_prompt()
         except Exception,e:
             raise ConnectionError(e)
-        naghelp.logger.debug('collect -> is_connected = True')
-        self.is_connected = True
+
+    def _get_transport(self):
+        if self.client is None:
+            # get()/put() are not done through the SSH broker
+            self._connect(*self._connect_params)
+        return self.client.get_transport()
+
+    def _open_sftp(self):
+        return self._get_transport().open_sftp_client()
+
+    def _get_sftp(self):
+        if not self.is_connected:
+            raise NotConnected('No ssh connection to do a sftp transfer.')
+        if self.sftpclient is None:
+            self.sftpclient = self._open_sftp()
+        return self.sftpclient
 
     def __enter__(self):
         self.in_with = True
@@ -1164,44 +2273,94 @@ class Ssh(object):
 
     def close(self):
         if not self.in_with:
-            self.client.close()
+            if self.broker is not None:
+                self.broker.close()
+            if self.sftpclient is not None:
+                self.sftpclient.close()
+                self.sftpclient = None
+            if self.client is not None:
+                self.client.close()
             self.is_connected = False
             naghelp.logger.debug('collect -> #### Ssh : Connection closed ###############')
 
+    def _read_until(self, pattern, start=''):
+        """Reads the channel until the pattern is found
+
+        The pattern is only searched in the newly received data and in the last
+        ``prompt_search_window`` bytes received before, this way, reading a big output is not
+        quadratic. ``start`` is some already received data where the pattern is searched too.
+
+        Returns:
+
+            str, int: The data read (without ``start``), the position of the end of the match in it
+
+        Raises:
+
+            socket.timeout: the data read so far is in its ``partial`` attribute
+        """
+        chunks = []
+        size = 0
+        tail = start[-self.prompt_search_window:]
+        while True:
+            try:
+                chunk = self.chan.recv(65536)
+            except socket.timeout, e:
+                e.partial = ''.join(chunks)
+                raise
+            if not chunk:
+                raise ConnectionError('Ssh channel closed while waiting for %s' % pattern.pattern)
+            data = tail + chunk
+            m = pattern.search(data)
+            chunks.append(chunk)
+            if m:
+                return ''.join(chunks), size - len(tail) + m.end()
+            size += len(chunk)
+            tail = data[-self.prompt_search_window:]
+
     def _read_to_prompt(self):
-        buff = ''
-        while not self.prompt_pattern.search(buff):
-            buff += self.chan.recv(8192)
-        return buff
+        return self._read_until(self.prompt_pattern)[0]
 
     def _run_cmd(self,cmd,timeout):
         naghelp.logger.debug('collect -> run("%s") %s',cmd,naghelp.debug_caller())
         if self.prompt_pattern is None:
-            stdin, stdout, stderr = self.client.exec_command(cmd,timeout=timeout,get_pty=self.get_pty)
-            out = stdout.read()
-            if self.add_stderr:
-                out += stderr.read()
+            with tracer.span('ssh.command', host=self.host, cmd=cmd) as span:
+                if self.broker is not None:
+                    out, err, status = self.broker.exec_command(cmd,timeout=timeout,get_pty=self.get_pty)
+                    span.set(bytes_out=len(out), broker=True)
+                    if self.add_stderr:
+                        span.set(bytes_err=len(err))
+                        out += err
+                else:
+                    stdin, stdout, stderr = self.client.exec_command(cmd,timeout=timeout,get_pty=self.get_pty)
+                    out = stdout.read()
+                    span.set(bytes_out=len(out))
+                    if self.add_stderr:
+                        err = stderr.read()
+                        span.set(bytes_err=len(err))
+                        out += err
             naghelp.debug_listing(out)
             return out
         else:
-            self.chan.send('%s\n' % cmd)
-            out = self._read_to_prompt()
-            out = out.replace('\r','')
-            # use re.compile to be compatible with python 2.6 (flags in re.sub only for python 2.7+)
-            rmcmd = re.compile(r'^.*?%s\n*' % cmd, re.DOTALL)
-            out = rmcmd.sub('', out)
+            with tracer.span('ssh.command', host=self.host, cmd=cmd) as span:
+                self.chan.send('%s\n' % cmd)
+                out = self._read_to_prompt()
+                span.set(bytes_out=len(out))
             # remove cmd and prompt (first and last line)
-            out = out.splitlines()[:-1]
-            cmd_out = '\n'.join(out)
+            cmd_out = _strip_echo(out.replace('\r',''), cmd)
+            eol = cmd_out.rfind('\n')
+            cmd_out = cmd_out[:eol] if eol >= 0 else ''
             naghelp.debug_listing(cmd_out)
             return cmd_out
 
     def _run_cmd_channels(self,cmd,timeout):
         naghelp.logger.debug('collect -> run_channels("%s") %s',cmd,naghelp.debug_caller())
-        stdin, stdout, stderr = self.client.exec_command(cmd,timeout=timeout,get_pty=self.get_pty)
-        out = stdout.read()
-        err = stderr.read()
-        status = stdout.channel.recv_exit_status()
+        with tracer.span('ssh.command', host=self.host, cmd=cmd) as span:
+            if self.broker is not None:
+                out, err, status = self.broker.exec_command(cmd,timeout=timeout,get_pty=self.get_pty)
+            else:
+                stdin, stdout, stderr = self.client.exec_command(cmd,timeout=timeout,get_pty=self.get_pty)
+                out, err, status = _read_exec_channel(stdout.channel)
+            span.set(bytes_out=len(out), bytes_err=len(err), rc=status)
         naghelp.debug_listing(out + err)
         return out, err, status
 
@@ -1309,9 +2468,17 @@ class Ssh(object):
             self.close()
         return out, err, status
 
-    def run_script(self, script, timeout=30, auto_close=True, expected_pattern=0, unexpected_pattern=0, filter=0, auto_strip=True, format_dict={}, **kwargs):
+    def run_script(self, script, timeout=30, auto_close=True, expected_pattern=0, unexpected_pattern=0, filter=0, auto_strip=True, format_dict={}, pipeline=False, **kwargs):
         r"""Execute a script
 
+        Each line of the script is run as a command, outputs are concatenated.
+
+        Args:
+
+            script (str): The script to run
+            pipeline (bool): If True, all script lines are sent at once (see :meth:`mrun`),
+                otherwise, there is one round trip per line (Default : False)
+
         Return:
 
             :class:`textops.StrExt` : The script output or None on timeout
@@ -1321,11 +2488,15 @@ class Ssh(object):
             raise NotConnected('No ssh connection to run your command.')
         try:
             out = ''
+            cmds = []
             for cmd in script.splitlines():
                 if auto_strip:
                     cmd = cmd.strip()
                 if cmd:
-                    out += self._run_cmd(cmd.format(**format_dict),timeout=timeout)
+                    cmds.append(('',cmd.format(**format_dict)))
+            run_cmd = self._run_pipeline(cmds, timeout) if pipeline and cmds else self._run_cmd
+            for k,cmd in cmds:
+                out += run_cmd(cmd,timeout=timeout)
         except socket.timeout:
             out = '<timeout>'
         if auto_close:
@@ -1340,8 +2511,9 @@ class Ssh(object):
             raise NotConnected('No ssh connection to do a scp.')
         if not self.scpclient:
             from scp import SCPClient
-            self.scpclient = SCPClient(self.client.get_transport())
-        return self.scpclient.get(*args,**kwargs)
+            self.scpclient = SCPClient(self._get_transport())
+        with tracer.span('ssh.scp_get', host=self.host, args=args):
+            return self.scpclient.get(*args,**kwargs)
 
     def put(self,*args,**kwargs):
         naghelp.logger.debug('collect -> put(%s,%s)',args,kwargs)
@@ -1349,10 +2521,156 @@ class Ssh(object):
             raise NotConnected('No ssh connection to do a scp.')
         if not self.scpclient:
             from scp import SCPClient
-            self.scpclient = SCPClient(self.client.get_transport())
-        return self.scpclient.put(*args,**kwargs)
+            self.scpclient = SCPClient(self._get_transport())
+        with tracer.span('ssh.scp_put', host=self.host, args=args):
+            return self.scpclient.put(*args,**kwargs)
 
-    def mrun(self, cmds, timeout=30, auto_close=True, expected_pattern=0, unexpected_pattern=0, filter=0, **kwargs):
+    def _run_pipeline(self, cmds, timeout, channels=False):
+        """Runs all commands at once, each one wrapped with unique markers
+
+        Returns a function to be called instead of ``_run_cmd`` (or ``_run_cmd_channels`` if
+        ``channels`` is True) for each command, in the same order : it returns the result or
+        raises socket.timeout if the command did not finish on time.
+        """
+        cmds = [ cmd for k,cmd in cmds ]
+        marker = 'NAGHELP_%s' % uuid.uuid4().hex
+        naghelp.logger.debug('collect -> run %s pipelined commands %s',len(cmds),naghelp.debug_caller())
+        with tracer.span('ssh.pipeline', host=self.host, cmds=len(cmds)):
+            if self.prompt_pattern is None:
+                results = self._run_pipeline_exec(cmds, marker, timeout)
+            else:
+                results = self._run_pipeline_prompt(cmds, marker)
+        outputs = iter(results)
+
+        def get_output(cmd, timeout):
+            result = next(outputs)
+            if result is None:
+                raise socket.timeout()
+            out, err, status = result
+            if channels:
+                return out, err, status
+            if self.add_stderr:
+                out += err
+            return out
+        return get_output
+
+    def _run_pipeline_exec(self, cmds, marker, timeout):
+        """Runs all commands in one exec request : returns a list of (out, err, status) or None
+
+        With a pty, lines end with ``\\r\\n`` and stderr is merged into stdout : the error
+        channel of all commands is then empty.
+        """
+        if self.get_pty:
+            err_markers = { 'begin':'', 'end':'' }
+        else:
+            err_markers = { 'begin':" echo %(m)s_%(i)d_BEGIN >&2;",
+                            'end':" printf '\\n%(m)s_%(i)d_END\\n' >&2;" }
+        script = ''.join([ ("echo %(m)s_%(i)d_BEGIN;" + err_markers['begin'] + "\n"
+                            "( %(cmd)s\n) </dev/null\n"
+                            "printf '\\n%(m)s_%(i)d_END:%%s\\n' $?;" + err_markers['end'] + "\n")
+                           % { 'm':marker, 'i':i, 'cmd':cmd } for i,cmd in enumerate(cmds) ])
+        try:
+            out, err, status = self._run_cmd_channels(script, timeout)
+        except socket.timeout, e:
+            # keep the results of the commands that finished on time
+            out, err = getattr(e, 'partial', ('', ''))
+        results = []
+        for i,cmd in enumerate(cmds):
+            begin_marker = r'%s_%d_BEGIN\r?\n' % (marker,i)
+            end_marker = r'\r?\n%s_%d_END' % (marker,i)
+            cmd_out = _demux_output(out, begin_marker, end_marker + r':(\d+)\r?\n')
+            if cmd_out is None:
+                results.append(None)
+                continue
+            cmd_err = None if self.get_pty else _demux_output(err, begin_marker, end_marker + r'\r?\n')
+            results.append((cmd_out[0], cmd_err[0] if cmd_err else '', int(cmd_out[1].group(1))))
+        return results
+
+    def _run_pipeline_prompt(self, cmds, marker):
+        """Sends all commands as one burst on the interactive channel
+
+        Returns a list of (out, '', status) or None. The shell at the prompt must understand
+        ``echo $?``.
+
+        Echoed input lines are removed in the order they were sent : the terminal may echo them
+        after a prompt or all at once when they are typed ahead, so output lines looking like a
+        command are kept. A shell reading typed ahead lines may also print its prompt before the
+        output : prompts are removed at the beginning of the lines.
+        """
+        sent = []
+        resync = []
+        for i,cmd in enumerate(cmds):
+            sent += cmd.split('\n') + [ 'echo %s""_%d:$?' % (marker, i) ]
+            resync.append(len(sent))
+        burst = ''.join([ l + '\n' for l in sent ])
+        last_marker = re.compile(r'(?m)%s_%d:\d+\r?$' % (marker, len(cmds) - 1))
+        buff = ''
+        try:
+            self.chan.send(burst)
+            buff, end = self._read_until(last_marker)
+            # then wait for the prompt
+            if not self.prompt_pattern.search(buff, end):
+                buff += self._read_until(self.prompt_pattern, buff[end:])[0]
+        except socket.timeout, e:
+            # keep the results of the commands that finished on time
+            buff += e.partial
+        buff = buff.replace('\r','')
+        naghelp.debug_listing(buff)
+        results = []
+        out = []
+        echo = 0
+        marker_status = re.compile(r'%s_(\d+):(\d+)$' % marker)
+        marker_echo = re.compile(r'%s""_(\d+)' % marker)
+        for l in buff.split('\n'):
+            m = self.prompt_pattern.search('\n' + l)
+            if m:
+                l = ('\n' + l)[m.end():]
+                if not l:
+                    continue
+            if echo < len(sent) and l == sent[echo]:
+                # the next line sent
+                echo += 1
+                continue
+            m = marker_echo.search(l)
+            if m:
+                # the following echoes are for the next command
+                echo = max(echo, resync[int(m.group(1))])
+                continue
+            m = marker_status.search(l)
+            if m and int(m.group(1)) == len(results):
+                if m.start():
+                    # the output did not end with a newline
+                    out.append(l[:m.start()])
+                results.append(('\n'.join(out), '', int(m.group(2))))
+                out = []
+            elif len(results) < len(cmds):
+                out.append(l)
+        # the commands that did not finish on time
+        results += [ None ] * (len(cmds) - len(results))
+        return results
+
+    def _run_concurrently(self, cmds, timeout, concurrency, run_cmd):
+        """Runs commands in concurrent channels
+
+        Returns a function to be called instead of ``run_cmd`` for each command, in the same order :
+        it returns the result or raises the exception of the command.
+        """
+        tasks = [ (i, ((lambda cmd=cmd: run_cmd(cmd,timeout=timeout)), timeout))
+                  for i,(k,cmd) in enumerate(cmds) ]
+        with tracer.span('ssh.mrun', host=self.host, cmds=len(tasks), concurrency=concurrency):
+            results, errors = run_concurrently(tasks, max_workers=concurrency)
+        outputs = iter([ (results.get(i), errors.get(i)) for i in range(len(tasks)) ])
+
+        def get_output(cmd, timeout):
+            result, error = next(outputs)
+            if isinstance(error, TimeoutError):
+                raise socket.timeout()
+            if error is not None:
+                raise error
+            return result
+        return get_output
+
+    def mrun(self, cmds, timeout=30, auto_close=True, expected_pattern=0, unexpected_pattern=0, filter=0, concurrency=1, pipeline=False, **kwargs):
         r"""Execute many commands at the same time
 
         Runs a dictionary of commands at the specified prompt and then close the connection.
@@ -1376,6 +2694,18 @@ class Ssh(object):
                 that generated the ``result`` and ``key`` the key in the dictionary for ``mrun``,
                 ``mget`` and ``mwalk``.
                 By default, use the filter defined at object level.
+            concurrency (int): The maximum number of commands running at the same time, each one
+                in its own SSH channel (Default : 1, commands are run one after another).
+                This is useful on high latency links. Note that OpenSSH servers accept by default
+                10 channels per connection (``MaxSessions``). This is ignored when a
+                ``prompt_pattern`` has been given.
+            pipeline (bool): If True, all commands are sent at once, each one wrapped with unique
+                markers, then outputs are split back : there is only one round trip instead of one
+                per command. In exec mode, the commands are run in one exec request, each one in
+                a subshell. In prompt mode, the commands are sent as one burst on the interactive
+                channel : the remote shell must understand ``echo $?``. If the commands do not
+                all finish on time, the unfinished ones are considered as timed out.
+                (Default : False)
 
         Return:
 
@@ -1400,15 +2730,27 @@ class Ssh(object):
                 ssh = Ssh('localhost','www','wwwpassword')
                 print ssh.mrun( (('cmd','./mycommand'),('cmd_err','echo $?')) )
 
+            To run up to 8 commands at the same time::
+
+                ssh = Ssh('localhost','www','wwwpassword')
+                print ssh.mrun({'df':'df -k','ps':'ps -ef','uptime':'uptime'}, concurrency=8)
+
         """
         if not self.is_connected:
             raise NotConnected('No ssh connection to run your command.')
         dct = textops.DictExt()
         if isinstance(cmds,dict):
             cmds = cmds.items()
+        run_cmd = self._run_cmd
+        if pipeline:
+            cmds = list(cmds)
+            run_cmd = self._run_pipeline(cmds, timeout)
+        elif concurrency > 1 and self.prompt_pattern is None:
+            cmds = list(cmds)
+            run_cmd = self._run_concurrently(cmds, timeout, concurrency, self._run_cmd)
         for k,cmd in cmds:
             try:
-                out = self._run_cmd(cmd,timeout=timeout)
+                out = run_cmd(cmd,timeout=timeout)
                 if k:
                     dct[k] = _filter_result(out,k,cmd, expected_pattern if expected_pattern != 0 else self.expected_pattern,
                                                          unexpected_pattern if unexpected_pattern != 0 else self.unexpected_pattern,
@@ -1422,7 +2764,7 @@ class Ssh(object):
             self.close()
         return dct
 
-    def mrun_channels(self, cmds, timeout=30, auto_close=True):
+    def mrun_channels(self, cmds, timeout=30, auto_close=True, concurrency=1, pipeline=False):
         r"""Execute many commands at the same time
 
         Runs a dictionary of commands at the specified prompt and then close the connection.
@@ -1435,11 +2777,27 @@ class Ssh(object):
             cmds (dict or list of items): The commands to be executed by remote host
             timeout (int): A timeout in seconds after which the result will be None
             auto_close (bool): Automatically close the connection.
+            concurrency (int): The maximum number of commands running at the same time, each one
+                in its own SSH channel (Default : 1, commands are run one after another).
+                This is useful on high latency links. Note that OpenSSH servers accept by default
+                10 channels per connection (``MaxSessions``). This is ignored when a
+                ``prompt_pattern`` has been given.
+            pipeline (bool): If True, all commands are sent at once, each one wrapped with unique
+                markers, then outputs are split back : there is only one round trip instead of one
+                per command. In exec mode, the commands are run in one exec request, each one in
+                a subshell. If the commands do not
+                all finish on time, the unfinished ones are considered as timed out.
+                It cannot be used with ``get_pty`` or a ``prompt_pattern`` as the error channel is
+                then merged into the output (Default : False)
 
         Return:
 
             :class:`textops.DictExt` : The commands output, error and status channels.
 
+        Raises:
+
+            CollectError: ``pipeline`` is used with ``get_pty`` or a ``prompt_pattern``
+
         Example:
 
             SSH with multiple commands::
@@ -1473,9 +2831,19 @@ class Ssh(object):
         dct = textops.DictExt()
         if isinstance(cmds,dict):
             cmds = cmds.items()
+        run_cmd_channels = self._run_cmd_channels
+        if pipeline:
+            if self.get_pty or self.prompt_pattern is not None:
+                raise CollectError('pipeline=True cannot separate the error channel with a pty or a '
+                                   'prompt_pattern : use mrun(..., pipeline=True) instead')
+            cmds = list(cmds)
+            run_cmd_channels = self._run_pipeline(cmds, timeout, channels=True)
+        elif concurrency > 1 and self.prompt_pattern is None:
+            cmds = list(cmds)
+            run_cmd_channels = self._run_concurrently(cmds, timeout, concurrency, self._run_cmd_channels)
         for k,cmd in cmds:
             try:
-                out, err, status = self._run_cmd_channels(cmd,timeout=timeout)
+                out, err, status = run_cmd_channels(cmd,timeout=timeout)
                 if k:
                     dct[k] = { 'out':out, 'err':err, 'status':status }
             except socket.timeout:
@@ -1486,7 +2854,7 @@ class Ssh(object):
         return dct
 
 
-class Sftp(object):
+class Sftp(SftpTransferMixin):
     r"""Sftp class helper
 
     This class is a wrapper around the paramiko sftp client, see
@@ -1547,6 +2915,7 @@ class Sftp(object):
         import paramiko
         self.in_with = False
         self.is_connected = False
+        self.host = host
         self.prompt_pattern = prompt_pattern
         self.get_pty = get_pty
         self.client = paramiko.SSHClient()
@@ -1559,13 +2928,25 @@ class Sftp(object):
         self.client.load_system_host_keys()
         naghelp.logger.debug('collect -> #### Sftp( %s@%s ) ###############',user, host)
         try:
-            self.client.connect(host,username=user,password=password, timeout=timeout, **kwargs)
-            self.sftp = self.client.open_sftp()
+            with tracer.span('sftp.connect', host=host, user=user) as span:
+                if span.enabled and 'sock' not in kwargs:
+                    kwargs['sock'] = _traced_connect('sftp', host, kwargs.get('port', 22), timeout)
+                with tracer.span('sftp.auth', host=host, user=user):
+                    self.client.connect(host,username=user,password=password, timeout=timeout, **kwargs)
+                self.sftp = self.client.open_sftp()
         except Exception,e:
             raise ConnectionError(e)
         naghelp.logger.debug('collect -> is_connected = True')
         self.is_connected = True
 
+    def _open_sftp(self):
+        return self.client.open_sftp()
+
+    def _get_sftp(self):
+        if not self.is_connected:
+            raise NotConnected('No sftp connection to run your command.')
+        return self.sftp
+
     def __enter__(self):
         self.in_with = True
         return self
@@ -1589,6 +2970,293 @@ class Sftp(object):
             naghelp.logger.debug('collect -> #### Sftp : Connection closed ###############')
 
 
+LOG_READER_SCRIPT = r'''f=%(path)s
+l=$(ls -inLd -- "$f") || exit 1
+set -- $l
+if [ %(offset)d -lt 0 ]; then o=$6
+elif [ "$1" = "%(inode)s" ] && [ "$6" -ge %(offset)d ] && { [ %(head_size)d -eq 0 ] ||
+     [ "$(head -c %(head_size)d -- "$f" | cksum)" = "%(head)s" ]; }; then o=%(offset)d
+else o=0; fi
+n=$6; [ $n -gt %(max_head_size)d ] && n=%(max_head_size)d
+echo "$1 $6 $o $n $(head -c $n -- "$f" | cksum)"
+if [ "$6" -gt "$o" ]; then tail -c +$((o+1)) -- "$f" | head -c %(max_bytes)d; fi
+'''
+
+def _split_log_lines(data, max_bytes):
+    """Returns the complete lines found in data and the number of bytes they use
+
+    The last line is kept for the next read if it is not terminated, except when it is longer than
+    ``max_bytes``.
+
+    >>> _split_log_lines('line1\\nline2\\nline', 1024)
+    (['line1', 'line2'], 12)
+    >>> _split_log_lines('a very long line', 16)
+    (['a very long line'], 16)
+    """
+    eol = data.rfind('\n')
+    if eol >= 0:
+        size = eol + 1
+    elif len(data) >= max_bytes:
+        size = len(data)
+    else:
+        size = 0
+    return data[:size].splitlines(), size
+
+class RemoteLogReader(object):
+    r"""Incremental remote log reader
+
+    Reads only the lines that have been appended to remote log files since the last plugin
+    execution. For each file, the inode, the size and the offset already read are stored into the
+    :class:`~naghelp.Host` persistent data, which are saved at the end of the plugin execution.
+    If the file inode changed (rotation) or if the file is smaller than the offset (truncation),
+    the file is read again from its beginning.
+
+    A checksum of the first bytes of the file is also persisted to detect a file that has been
+    rewritten in place (``copytruncate`` rotation) : the SFTP protocol does not give the inode,
+    so this is the only rotation detection with an :class:`Sftp` collector. With an :class:`Ssh`
+    collector, only one command is sent per file (it uses ``ls``, ``cksum``, ``tail`` and
+    ``head``).
+
+    Args:
+
+        collector (:class:`Ssh` or :class:`Sftp`): The collector to use to read remote files
+        host (:class:`~naghelp.Host`): The object where offsets are persisted, usually the plugin
+            ``self.host`` attribute.
+        key (str): The key used to store offsets into ``host`` (Default : 'remote_log_reader')
+        max_bytes (int): The maximum number of bytes to read per file and per execution,
+            the remaining bytes will be read at next execution (Default : 10MB)
+        from_start (bool): If True, a file that has never been read is read from its beginning,
+            otherwise only the lines appended from now will be read at next executions
+            (Default : False)
+        timeout (int): Timeout in seconds for each file with an :class:`Ssh` collector
+            (Default : 30)
+
+    Example:
+
+        In a plugin ``collect_data()`` method::
+
+            with Ssh(self.host.ip, self.host.user, self.host.password) as ssh:
+                reader = RemoteLogReader(ssh, self.host)
+                data.messages = reader.read('/var/log/messages')
+                data.syslog = reader.read('/var/log/syslog')
+    """
+    head_size = 512
+
+    def __init__(self, collector, host, key='remote_log_reader', max_bytes=10*1024*1024,
+                 from_start=False, timeout=30):
+        self.collector = collector
+        self.host = host
+        self.key = key
+        self.max_bytes = max_bytes
+        self.from_start = from_start
+        self.timeout = timeout
+
+    def get_state(self, path):
+        """Returns the persisted state of the file ``path`` or None if it has never been read"""
+        return (self.host.get(self.key) or {}).get(path)
+
+    def set_state(self, path, state):
+        """Stores the state of the file ``path`` into the host persistent data"""
+        states = dict(self.host.get(self.key) or {})
+        states[path] = state
+        self.host.set(self.key, states)
+
+    def reset(self, path=None):
+        """Forgets the offset of one file or of all files if ``path`` is None"""
+        if path is None:
+            self.host.delete(self.key)
+        else:
+            states = dict(self.host.get(self.key) or {})
+            states.pop(path, None)
+            self.host.set(self.key, states)
+
+    def read(self, path):
+        r"""Reads the lines appended to a remote file since the last execution
+
+        Args:
+
+            path (str): The remote file path
+
+        Return:
+
+            :class:`textops.ListExt` : The new complete lines. A line that is not terminated by a
+            newline is returned at next execution.
+
+        Raises:
+
+            CollectError: if the file cannot be read
+        """
+        state = self.get_state(path)
+        naghelp.logger.debug('collect -> RemoteLogReader.read("%s") state=%s', path, state)
+        with tracer.span('logreader.read', path=path) as span:
+            if isinstance(self.collector, Sftp):
+                lines, state = self._read_sftp(path, state)
+            else:
+                lines, state = self._read_ssh(path, state)
+            span.set(lines=len(lines), offset=state['offset'])
+        self.set_state(path, state)
+        naghelp.logger.debug('collect -> RemoteLogReader : %s new lines, offset=%s',
+                             len(lines), state['offset'])
+        return textops.ListExt(lines)
+
+    def _read_ssh(self, path, state):
+        if state:
+            inode, offset = state.get('inode'), state.get('offset', 0)
+            head_size, head = state.get('head') or (0, '')
+        else:
+            inode, offset, head_size, head = '', 0 if self.from_start else -1, 0, ''
+        cmd = LOG_READER_SCRIPT % dict(path="'%s'" % path.replace("'", "'\\''"), inode=inode,
+                                       offset=offset, head_size=head_size, head=head,
+                                       max_head_size=self.head_size, max_bytes=self.max_bytes)
+        out, err, status = self.collector._run_cmd_channels(cmd, self.timeout)
+        header, sep, data = out.partition('\n')
+        fields = header.split()
+        if status or len(fields) != 6 or not all(f.isdigit() for f in fields):
+            raise CollectError('Cannot read %s : %s' % (path, (err or out).strip()))
+        inode, size, offset, head_size = fields[:4]
+        lines, used = _split_log_lines(data, self.max_bytes)
+        return lines, {'inode': inode, 'size': int(size), 'offset': int(offset) + used,
+                       'head': (int(head_size), ' '.join(fields[4:]))}
+
+    def _read_sftp(self, path, state):
+        import hashlib
+        try:
+            with self.collector.open(path, 'rb') as fh:
+                size = fh.stat().st_size
+                head = None
+                if not state:
+                    offset = 0 if self.from_start else size
+                else:
+                    offset = state.get('offset', 0)
+                    head = state.get('head')
+                    if size < offset:
+                        offset, head = 0, None
+                    elif head and hashlib.sha1(fh.read(head[0])).hexdigest() != head[1]:
+                        offset, head = 0, None
+                to_read = min(size - offset, self.max_bytes)
+                data = ''
+                if to_read > 0:
+                    fh.seek(offset)
+                    fh.prefetch(offset + to_read)
+                    data = fh.read(to_read)
+                lines, used = _split_log_lines(data, self.max_bytes)
+                offset += used
+                # the checksum is computed on the first bytes already read
+                head_size = min(offset, self.head_size)
+                if head_size and (not head or head[0] != head_size):
+                    fh.seek(0)
+                    head = (head_size, hashlib.sha1(fh.read(head_size)).hexdigest())
+        except IOError, e:
+            raise CollectError('Cannot read %s : %s' % (path, e))
+        return lines, {'inode': None, 'size': size, 'offset': offset, 'head': head}
+
+class _SnmpRequestQueue(object):
+    """Sends asynchronous snmp requests with one pysnmp engine
+
+    Requests are sent as soon as the limits allow it : at most ``max_in_flight`` requests wait
+    for a response at the same time, at most ``max_per_agent`` for one agent, and two requests
+    to the same agent are sent at least ``min_interval`` seconds apart. Agents are served in
+    turn. Response callbacks may add new requests : :meth:`run` returns once all are done.
+    """
+    def __init__(self, snmpEngine, max_in_flight=64, max_per_agent=None, min_interval=0):
+        self.snmpEngine = snmpEngine
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_per_agent = max_per_agent or self.max_in_flight
+        self.min_interval = min_interval
+        self.agents = []
+        self.waiting = {}
+        self.agent_in_flight = {}
+        self.last_sent = {}
+        self.in_flight = 0
+        self.queued = 0
+        self.sent = 0
+        self.holding = False
+
+    def add(self, cmd, authData, transportTarget, args, cbFun):
+        """Adds a request
+
+        Args:
+
+            cmd (str): The pysnmp asynchronous command : 'getCmd', 'nextCmd' or 'bulkCmd'
+            authData: pysnmp authentication data
+            transportTarget: pysnmp transport target, it identifies the agent
+            args (tuple): The command arguments after the context data (var-binds...)
+            cbFun: Called with errorIndication, errorStatus, errorIndex and var-binds
+        """
+        agent = transportTarget.transportAddr
+        if agent not in self.waiting:
+            self.agents.append(agent)
+            self.waiting[agent] = []
+            self.agent_in_flight[agent] = 0
+        self.waiting[agent].append((cmd, authData, transportTarget, args, cbFun))
+        self.queued += 1
+
+    def run(self):
+        """Sends all requests and waits for all responses"""
+        dispatcher = self.snmpEngine.transportDispatcher
+        if self.min_interval:
+            # delayed requests are sent by a dispatcher timer : it must tick often enough
+            if dispatcher is None:
+                from pysnmp.carrier.asyncore.dispatch import AsyncoreDispatcher
+                dispatcher = AsyncoreDispatcher()
+                self.snmpEngine.registerTransportDispatcher(dispatcher)
+            dispatcher.setTimerResolution(min(0.5, max(0.01, self.min_interval / 2.0)))
+            dispatcher.registerTimerCbFun(self._timer_cbFun)
+            dispatcher.jobStarted(id(self))
+            self.holding = True
+        try:
+            self._send_ready()
+            if self.snmpEngine.transportDispatcher is not None:
+                self.snmpEngine.transportDispatcher.runDispatcher()
+        finally:
+            if self.min_interval:
+                dispatcher.unregisterTimerCbFun(self._timer_cbFun)
+                if self.holding:
+                    dispatcher.jobFinished(id(self))
+                    self.holding = False
+
+    def _send_ready(self):
+        for agent in self.agents[:]:
+            waiting = self.waiting[agent]
+            while (waiting and self.in_flight < self.max_in_flight
+                   and self.agent_in_flight[agent] < self.max_per_agent
+                   and time.time() - self.last_sent.get(agent, 0) >= self.min_interval):
+                self._send(agent, waiting.pop(0))
+        if self.agents:
+            # next time, begin with another agent
+            self.agents.append(self.agents.pop(0))
+        if self.holding and not self.queued and not self.in_flight:
+            self.snmpEngine.transportDispatcher.jobFinished(id(self))
+            self.holding = False
+
+    def _send(self, agent, request):
+        from pysnmp.hlapi.asyncore import cmdgen
+        from pysnmp.hlapi.context import ContextData
+        cmd, authData, transportTarget, args, cbFun = request
+        self.queued -= 1
+        self.last_sent[agent] = time.time()
+        try:
+            getattr(cmdgen, cmd)(self.snmpEngine, authData, transportTarget, ContextData(), *args,
+                                 cbFun=self._cbFun, cbCtx=(agent, cbFun), lookupMib=False)
+        except Exception, e:
+            naghelp.logger.debug('collect -> snmp %s to %s failed : %s', cmd, agent, e)
+            cbFun(str(e), 0, 0, [])
+            return
+        self.in_flight += 1
+        self.agent_in_flight[agent] += 1
+        self.sent += 1
+
+    def _cbFun(self, snmpEngine, sendRequestHandle, errorIndication, errorStatus, errorIndex,
+               varBinds, cbCtx):
+        agent, cbFun = cbCtx
+        self.in_flight -= 1
+        self.agent_in_flight[agent] -= 1
+        cbFun(errorIndication, errorStatus, errorIndex, varBinds)
+        self._send_ready()
+
+    def _timer_cbFun(self, timeNow):
+        self._send_ready()
+
 class Snmp(object):
     r"""Snmp class helper
 
@@ -1608,10 +3276,25 @@ class Snmp(object):
         auth_protocol (str): snmp v3 auth protocol ('md5' or 'sha')
         priv_passwd (str): snmp v3 privacy password
         priv_protocol (str): snmp v3 privacy protocol ('des' or 'aes')
+        max_repetitions (int): With protocols 2c and 3, walks use GETBULK requests asking this
+            number of values per request : it is automatically divided by 2 if the agent answers
+            ``tooBig``. Use 0 to walk with GETNEXT requests, that is always the case with protocol 1
+            (Default : 25)
+        max_in_flight (int): With GETBULK requests, :meth:`mwalk` and :meth:`jwalk` walk their
+            OID root paths concurrently : this is the maximum number of requests waiting for a
+            response at the same time (Default : 8)
+        cmd_generator (CommandGenerator): pysnmp command generator to use, it carries the snmp
+            engine : :class:`SnmpPoller` shares one between many agents (Default : a new one)
+        max_pdu_size (int): :meth:`mget` splits its OIDs into requests whose responses should
+            not exceed this size in bytes. A response size is estimated to 100 bytes of message
+            headers plus, for each OID, its encoded size and 20 bytes for the value (up to 16
+            bytes) and the var-bind header : the requests answered ``tooBig`` are split again
+            (Default : 1400)
     """
     def __init__(self,host, community='public', version=None, timeout=30, port=161, user=None,
                  auth_passwd=None, auth_protocol='', priv_passwd=None, priv_protocol='',
-                 object_identity_to_string=True, *args,**kwargs):
+                 object_identity_to_string=True, max_repetitions=25, max_in_flight=8,
+                 cmd_generator=None, max_pdu_size=1400, *args,**kwargs):
         #import is done only on demand, because it takes some time
         from pysnmp.entity.rfc3413.oneliner import cmdgen
         from pysnmp.proto.api import v2c
@@ -1623,17 +3306,22 @@ class Snmp(object):
         self.cmdgen = cmdgen
         self.v2c = v2c
         self.noSuchInstance = noSuchInstance
-        self.cmdGenerator = cmdgen.CommandGenerator()
+        self.no_value_types = (v2c.NoSuchObject, v2c.NoSuchInstance, v2c.EndOfMibView)
+        self.cmdGenerator = cmd_generator or cmdgen.CommandGenerator()
         self.ContextData = ContextData
         self.null = null
         self.sync = sync
         self.ObjectIdentity = ObjectIdentity
+        self.host = host
         self.version = version
         self.object_identity_to_string = object_identity_to_string
         self.cmd_args = []
 
         if not version:
             version = user and 3 or 2
+        self.max_repetitions = max_repetitions if version != 1 else 0
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_pdu_size = max_pdu_size
 
         if version == 1:
             self.cmd_args.append(cmdgen.CommunityData(community, mpModel=0))
@@ -1751,7 +3439,8 @@ class Snmp(object):
         oid_or_mibvar = self.normalize_oid(oid_or_mibvar)
         args = list(self.cmd_args)
         args.append(oid_or_mibvar)
-        errorIndication, errorStatus, errorIndex, varBinds = self.cmdGenerator.getCmd(*args)
+        with tracer.span('snmp.get', host=self.host, oid=oid_or_mibvar):
+            errorIndication, errorStatus, errorIndex, varBinds = self.cmdGenerator.getCmd(*args)
         if errorIndication:
             raise CollectError(errorIndication)
         else:
@@ -1787,6 +3476,121 @@ class Snmp(object):
 
         return errorIndication, errorStatus, errorIndex, varBindTable
 
+    def resolve_oid(self, oid_or_mibvar):
+        """Returns the numerical OID object of an OID path or a pysnmp ObjectIdentity"""
+        if isinstance(oid_or_mibvar, basestring) and re.match(r'^\.?\d+(\.\d+)*$', oid_or_mibvar):
+            return self.v2c.ObjectIdentifier(oid_or_mibvar.lstrip('.'))
+        from pysnmp.hlapi.varbinds import CommandGeneratorVarBinds
+        mib_view = CommandGeneratorVarBinds().getMibViewController(self.cmdGenerator.snmpEngine)
+        if not isinstance(oid_or_mibvar, self.ObjectIdentity):
+            oid_or_mibvar = self.ObjectIdentity(oid_or_mibvar)
+        return oid_or_mibvar.resolveWithMib(mib_view).getOid()
+
+    def bulkWalkCmd(self, authData, transportTarget, varName):
+        """Walks with GETBULK requests, returns the same as :meth:`nextCmd`
+
+        Each request asks ``max_repetitions`` values, this number is divided by 2 and the request
+        sent again when the agent answers ``tooBig``. MIB are not looked up.
+        """
+        return self.bulkWalkCmds(authData, transportTarget, {None: varName})[None]
+
+    def bulkWalkCmds(self, authData, transportTarget, varNames, max_in_flight=1):
+        """Walks several OID root paths concurrently with GETBULK requests
+
+        All walks share the same snmp engine and dispatcher : up to ``max_in_flight`` requests are
+        waiting for a response at the same time. Each walk behaves like :meth:`bulkWalkCmd`.
+
+        Args:
+
+            authData: pysnmp authentication data
+            transportTarget: pysnmp transport target
+            varNames (dict): keyname/OID root path dictionary
+            max_in_flight (int): maximum number of walks in progress at the same time
+
+        Returns:
+
+            dict: keyname/(errorIndication, errorStatus, errorIndex, varBindTable) dictionary
+        """
+        queue = _SnmpRequestQueue(self.cmdGenerator.snmpEngine, max_in_flight)
+        results = {}
+
+        def walk_done(key):
+            def cbFun(*result):
+                results[key] = result
+            return cbFun
+
+        for key, varName in varNames.items():
+            self._queue_walk(queue, varName, walk_done(key), authData, transportTarget)
+        queue.run()
+        return results
+
+    def _queue_walk(self, queue, varName, cbFun, authData=None, transportTarget=None):
+        """Adds an asynchronous walk to a :class:`_SnmpRequestQueue`
+
+        GETBULK requests are used if ``max_repetitions`` is not 0, GETNEXT requests otherwise. At
+        the end, ``cbFun`` is called with the same values as :meth:`nextCmd` returns.
+        """
+        from pysnmp.proto import errind
+        from pyasn1.type.univ import Null
+        authData = authData or self.cmd_args[0]
+        transportTarget = transportTarget or self.cmd_args[1]
+        root = self.resolve_oid(varName)
+        walk = dict(last_oid=root, max_repetitions=self.max_repetitions, table=[])
+
+        def send():
+            if walk['max_repetitions']:
+                queue.add('bulkCmd', authData, transportTarget,
+                          (0, walk['max_repetitions'], (walk['last_oid'], Null(''))), response)
+            else:
+                queue.add('nextCmd', authData, transportTarget, ((walk['last_oid'], Null('')),),
+                          response)
+
+        def response(errorIndication, errorStatus, errorIndex, rows):
+            table = walk['table']
+            if errorIndication:
+                return cbFun(errorIndication, errorStatus, errorIndex, table)
+            if errorStatus:
+                if errorStatus == 1 and walk['max_repetitions'] > 1:
+                    # tooBig
+                    walk['max_repetitions'] //= 2
+                    naghelp.logger.debug('collect -> tooBig : max_repetitions = %s',
+                                         walk['max_repetitions'])
+                    return send()
+                if errorStatus == 2 and not walk['max_repetitions']:
+                    # noSuchName : end of the MIB with protocol 1
+                    return cbFun(None, 0, 0, table)
+                return cbFun(errorIndication, errorStatus, errorIndex, table)
+            if not rows:
+                return cbFun(None, 0, 0, table)
+            for row in rows:
+                name, val = row[0]
+                if isinstance(val, Null) or not root.isPrefixOf(name):
+                    return cbFun(None, 0, 0, table)
+                if name <= walk['last_oid']:
+                    return cbFun(errind.oidNotIncreasing, 0, 0, table)
+                table.append(row)
+                walk['last_oid'] = name
+            send()
+
+        send()
+
+    def _walk_result(self, errorIndication, errorStatus, errorIndex, varBindTable):
+        """Converts a walk response, returns the list of tuples (OID,value) and the error message"""
+        lst = textops.ListExt()
+        for varBindTableRow in varBindTable:
+            for name, val in varBindTableRow:
+                lst.append((str(name),self.to_native_type(val)))
+        error = None
+        if errorIndication:
+            error = errorIndication
+        elif errorStatus:
+            try:
+                err_at = errorIndex and varBindTable[-1][int(errorIndex)-1] or '?'
+            except:
+                err_at = '?'
+            error = '%s at %s' % (errorStatus.prettyPrint(),err_at)
+        return lst, error
+
     def walk(self, oid_or_mibvar, ignore_errors=False):
         """Walk from a OID root path
 
@@ -1812,28 +3616,29 @@ class Snmp(object):
         """
         naghelp.logger.debug('collect -> walk(%s) %s',oid_or_mibvar,naghelp.debug_caller())
         oid_or_mibvar = self.normalize_oid(oid_or_mibvar)
-        lst = textops.ListExt()
         args = list(self.cmd_args)
         args.append(oid_or_mibvar)
-        errorIndication, errorStatus, errorIndex, varBindTable = self.nextCmd(*args)
-        for varBindTableRow in varBindTable:
-            for name, val in varBindTableRow:
-                lst.append((str(name),self.to_native_type(val)))
-        if not ignore_errors:
-            if errorIndication:
-                raise SnmpWalkError(lst,errorIndication)
+        with tracer.span('snmp.walk', host=self.host, oid=oid_or_mibvar) as span:
+            if self.max_repetitions > 0:
+                errorIndication, errorStatus, errorIndex, varBindTable = self.bulkWalkCmd(*args)
             else:
-                if errorStatus:
-                    try:
-                        err_at = errorIndex and varBindTable[-1][int(errorIndex)-1] or '?'
-                    except:
-                        err_at = '?'
-                    raise SnmpWalkError(lst,'%s at %s' % (errorStatus.prettyPrint(),err_at) )
+                errorIndication, errorStatus, errorIndex, varBindTable = self.nextCmd(*args)
+            span.set(values=len(varBindTable), error_indication=errorIndication or None,
+                     error_status=errorStatus and errorStatus.prettyPrint() or None)
+        lst, error = self._walk_result(errorIndication, errorStatus, errorIndex, varBindTable)
+        if error and not ignore_errors:
+            raise SnmpWalkError(lst,error)
         return lst
 
     def mwalk(self, vars_oids, ignore_errors=False):
         """Walk from multiple OID root pathes
 
+        With GETBULK requests (protocols 2c and 3), OID root pathes are walked concurrently, up to
+        ``max_in_flight`` requests at the same time. With GETNEXT requests, they are walked one after
+        another. If some walks failed, a :class:`SnmpWalkError` is raised once all walks are done :
+        its ``truncated_result`` is the whole dictionary and its ``errors`` gives the error message
+        for each failed keyname.
+
         Args:
 
             vars_oids (dict): keyname/OID root path dictionary
@@ -1856,29 +3661,44 @@ class Snmp(object):
 
         """
         dct = textops.DictExt()
-        for var,oid in vars_oids.items():
-            dct[var] = self.walk(oid, ignore_errors)
+        errors = {}
+        if self.max_repetitions > 0 and len(vars_oids) > 1:
+            naghelp.logger.debug('collect -> mwalk(%s) %s',vars_oids,naghelp.debug_caller())
+            oids = dict([ (var,self.normalize_oid(oid)) for var,oid in vars_oids.items() ])
+            with tracer.span('snmp.mwalk', host=self.host, walks=len(oids),
+                             max_in_flight=self.max_in_flight) as span:
+                results = self.bulkWalkCmds(*self.cmd_args, varNames=oids,
+                                            max_in_flight=self.max_in_flight)
+                for var,result in results.items():
+                    dct[var], error = self._walk_result(*result)
+                    if error:
+                        errors[var] = str(error)
+                span.set(values=sum([ len(lst) for lst in dct.values() ]), errors=len(errors))
+        else:
+            for var,oid in vars_oids.items():
+                try:
+                    dct[var] = self.walk(oid)
+                except SnmpWalkError as e:
+                    dct[var] = e.truncated_result
+                    errors[var] = str(e)
+        if errors and not ignore_errors:
+            raise SnmpWalkError(dct, '; '.join([ '%s : %s' % (var,error)
+                                                 for var,error in sorted(errors.items()) ]),
+                                errors=errors)
         return dct
 
-    def dwalk(self,oid_or_mibvar,irow=-2,icol=-1,cols=None, ignore_errors=False):
-        walk_data = self.walk(oid_or_mibvar, ignore_errors)
+    def _make_dict(self,walk_data,irow=-2,icol=-1):
         dct={}
         for oid,val in walk_data:
             oid_bits = str(oid).split('.')
             row=int(oid_bits[irow])
             col=int(oid_bits[icol])
             dct.setdefault(row,{}).setdefault(col,val)
-        return textops.DictExt(dct)
+        return dct
 
-    def twalk(self,oid_or_mibvar,irow=-2,icol=-1,cols=None, ignore_errors=False):
-        walk_data = self.walk(oid_or_mibvar, ignore_errors)
-        dct={}
+    def _make_table(self,walk_data,irow=-2,icol=-1,cols=None):
+        dct=self._make_dict(walk_data,irow,icol)
         table=textops.ListExt()
-        for oid,val in walk_data:
-            oid_bits = str(oid).split('.')
-            row=int(oid_bits[irow])
-            col=int(oid_bits[icol])
-            dct.setdefault(row,{}).setdefault(col,val)
         if cols is None:
             for row_id,rec_dct in sorted(dct.items()):
                 table.append( [ row_id ] + [ rec_dct.get(c,NoAttr) for c in sorted(rec_dct) ] )
@@ -1890,10 +3710,21 @@ class Snmp(object):
                 table.append( dict([ (k,rec_dct.get(v,NoAttr)) for k,v in cols.items() ],_row=row_id) )
         return table
 
+    def dwalk(self,oid_or_mibvar,irow=-2,icol=-1,cols=None, ignore_errors=False):
+        walk_data = self.walk(oid_or_mibvar, ignore_errors)
+        return textops.DictExt(self._make_dict(walk_data,irow,icol))
+
+    def twalk(self,oid_or_mibvar,irow=-2,icol=-1,cols=None, ignore_errors=False):
+        walk_data = self.walk(oid_or_mibvar, ignore_errors)
+        return self._make_table(walk_data,irow,icol,cols)
+
     def jwalk(self, *twalks_args, **kwargs):
         ignore_errors = kwargs.get('ignore_errors',False)
         dct={}
-        tables = textops.ListExt([ self.twalk(*twalk_args,ignore_errors=ignore_errors) for twalk_args in twalks_args ])
+        walks_data = self.mwalk(dict([ (i,twalk_args[0]) for i,twalk_args in enumerate(twalks_args) ]),
+                                ignore_errors)
+        tables = textops.ListExt([ self._make_table(walks_data[i],*twalk_args[1:])
+                                   for i,twalk_args in enumerate(twalks_args) ])
         if isinstance(twalks_args[0][-1],(list,tuple,type(None))):
             for args in twalks_args:
                 assert isinstance(args[-1],(list,tuple,type(None))), 'All wanted columns specifications must be lists/tuples/None'
@@ -1938,6 +3769,18 @@ class Snmp(object):
         For instance, '1.3.6.1.2.1.1.2-4.1' means : [ 1.3.6.1.2.1.1.2.1,
         1.3.6.1.2.1.1.3.1, 1.3.6.1.2.1.1.4.1 ]
 
+        OIDs are split into requests that fit in ``max_pdu_size`` : they are sent concurrently, up
+        to ``max_in_flight`` at the same time. A request answered ``tooBig`` is split in two, an OID
+        unknown to a protocol 1 agent (``noSuchName``) gets a ``NoAttr`` value and the other OIDs
+        of its request are asked again. With protocol 2c and 3 agents, an unknown OID
+        (``noSuchObject``, ``noSuchInstance`` or ``endOfMibView``) gets a ``NoAttr`` value too.
+
+        Note:
+
+            An unknown OID used to raise a :class:`CollectError` (``noSuchName``) with a protocol
+            1 agent and to get a raw pysnmp ``NoSuchInstance`` or ``NoSuchObject`` value with
+            protocol 2c and 3 agents : it now always gets a ``NoAttr`` value.
+
         Args:
 
             vars_oids (dict): keyname/OID dictionary
@@ -1947,6 +3790,10 @@ class Snmp(object):
             :class:`textops.DictExt`: List of tuples (OID,value).
                 Values type are int or :class:`textops.StrExt`
 
+        Raises:
+
+            CollectError: a request failed (no response, other error than ``noSuchName``...)
+
         Example:
 
             >>> snmp = Snmp('demo.snmplabs.com')
@@ -1956,31 +3803,39 @@ class Snmp(object):
 
         """
         naghelp.logger.debug('collect -> mget(...) %s',naghelp.debug_caller())
-        dct = textops.DictExt()
-        oid_to_var = {}
-        args = list(self.cmd_args)
-        for var,oid in vars_oids.items():
-            if '-' in oid:
-                for real_oid in self.get_oid_range(oid):
-                    args.append(real_oid)
-                    oid_to_var[real_oid] = var
-            else:
-                args.append(oid)
-                oid_to_var[oid] = var
+        queue = _SnmpRequestQueue(self.cmdGenerator.snmpEngine, self.max_in_flight)
+        result = {}
 
-        errorIndication, errorStatus, errorIndex, varBinds = self.cmdGenerator.getCmd(*args)
-        if errorIndication:
-            raise CollectError(errorIndication)
-        else:
-            if errorStatus:
-                try:
-                    err_at = errorIndex and varBinds[int(errorIndex)-1] or '?'
-                except:
-                    err_at = '?'
-                raise CollectError('%s at %s' % (errorStatus.prettyPrint(),err_at) )
+        def get_done(dct, errors):
+            result.update(dct=dct, errors=errors)
+
+        with tracer.span('snmp.mget', host=self.host) as span:
+            span.set(oids=self._queue_get(queue, vars_oids, get_done))
+            queue.run()
+            span.set(requests=queue.sent, errors=len(result['errors']))
+        if result['errors']:
+            raise CollectError(sorted(result['errors'].items())[0][1])
+        return textops.DictExt(result['dct'])
+
+    def _add_get_values(self, dct, varBinds, oid_to_var):
+        """Adds var-binds values to a keyname/value dictionary, values of a range become a list
+
+        Unknown OIDs get a ``NoAttr`` value.
+
+        Example:
+
+            >>> from pysnmp.proto.api import v2c
+            >>> snmp = Snmp('127.0.0.1')
+            >>> dct = {}
+            >>> snmp._add_get_values(dct, [('1.1', v2c.Integer(1)), ('1.2', v2c.NoSuchInstance()),
+            ...                            ('1.3', v2c.NoSuchObject()), ('1.4', v2c.EndOfMibView())],
+            ...                      {'1.1':'ok', '1.2':'range', '1.3':'range', '1.4':'end'})
+            >>> print sorted(dct.items())
+            [('end', NoAttr), ('ok', 1), ('range', [NoAttr, NoAttr])]
+        """
         for oid,val in varBinds:
             var = oid_to_var[str(oid)]
-            val = self.to_native_type(val) if not (val is self.noSuchInstance) else NoAttr
+            val = NoAttr if isinstance(val, self.no_value_types) else self.to_native_type(val)
             if var in dct:
                 if isinstance(dct[var],list):
                     dct[var].append(val)
@@ -1988,7 +3843,85 @@ class Snmp(object):
                     dct[var] = [dct[var],val]
             else:
                 dct[var] = val
-        return dct
+
+    def _queue_get(self, queue, vars_oids, cbFun):
+        """Adds an asynchronous get of multiple OIDs to a :class:`_SnmpRequestQueue`
+
+        OID ranges are expanded and OIDs are split into requests as in :meth:`mget`. At the end,
+        ``cbFun`` is called with the keyname/value dictionary and the keyname/error message
+        dictionary. Returns the number of OIDs.
+        """
+        from pyasn1.type.univ import Null
+        from pyasn1.codec.ber import encoder
+        authData, transportTarget = self.cmd_args[0], self.cmd_args[1]
+        oids = []
+        oid_vars = []
+        oid_to_var = {}
+        for var,oid in vars_oids.items():
+            for real_oid in (self.get_oid_range(oid) if '-' in oid else [oid]):
+                real_oid = self.resolve_oid(self.normalize_oid(real_oid))
+                oids.append(real_oid)
+                oid_vars.append(var)
+                oid_to_var[str(real_oid)] = var
+        values = [ NoAttr ] * len(oids)
+        errors = {}
+        waiting = [ 0 ]
+
+        def send(chunk):
+            waiting[0] += 1
+            queue.add('getCmd', authData, transportTarget,
+                      tuple([ (oids[i], Null('')) for i in chunk ]),
+                      lambda *response: chunk_done(chunk, *response))
+
+        def chunk_done(chunk, errorIndication, errorStatus, errorIndex, varBinds):
+            waiting[0] -= 1
+            if errorIndication:
+                for i in chunk:
+                    errors[oid_vars[i]] = str(errorIndication)
+            elif errorStatus == 1 and len(chunk) > 1:
+                # tooBig
+                naghelp.logger.debug('collect -> tooBig : %s OIDs split in two', len(chunk))
+                send(chunk[:len(chunk)//2])
+                send(chunk[len(chunk)//2:])
+            elif errorStatus:
+                failed = chunk[int(errorIndex)-1] if 0 < int(errorIndex) <= len(chunk) else None
+                if failed is None:
+                    for i in chunk:
+                        errors[oid_vars[i]] = '%s at ?' % errorStatus.prettyPrint()
+                else:
+                    if errorStatus != 2:
+                        # noSuchName only leaves a NoAttr value
+                        errors[oid_vars[failed]] = '%s at %s' % (errorStatus.prettyPrint(),
+                                                                 oids[failed])
+                    others = [ i for i in chunk if i != failed ]
+                    if others:
+                        send(others)
+            else:
+                for i,(oid,val) in zip(chunk, varBinds):
+                    values[i] = val
+            if not waiting[0]:
+                dct = {}
+                self._add_get_values(dct, zip(oids, values), oid_to_var)
+                cbFun(dct, errors)
+
+        # the encoded OID plus 20 bytes per var-bind for the value (up to 16 bytes) and the
+        # var-bind header, 100 bytes for the message headers
+        max_size = self.max_pdu_size - 100
+        chunk = []
+        size = 0
+        for i,oid in enumerate(oids):
+            oid_size = len(encoder.encode(oid)) + 20
+            if chunk and size + oid_size > max_size:
+                send(chunk)
+                chunk = []
+                size = 0
+            chunk.append(i)
+            size += oid_size
+        if chunk:
+            send(chunk)
+        else:
+            cbFun({}, {})
+        return len(oids)
 
     def exists(self,oid_or_mibvar):
         """Return True if the OID exists
@@ -2016,11 +3949,135 @@ class Snmp(object):
         oid_or_mibvar = self.normalize_oid(oid_or_mibvar)
         args = list(self.cmd_args)
         args.append(oid_or_mibvar)
-        errorIndication, errorStatus, errorIndex, varBinds = self.cmdGenerator.getCmd(*args)
+        with tracer.span('snmp.get', host=self.host, oid=oid_or_mibvar):
+            errorIndication, errorStatus, errorIndex, varBinds = self.cmdGenerator.getCmd(*args)
         if errorIndication or errorStatus:
             return False
         return True
 
+class SnmpPoller(object):
+    r"""Polls many snmp agents at the same time with one shared pysnmp engine
+
+    Each :class:`Snmp` object builds its own pysnmp engine and waits for a response before sending
+    the next request : this is slow when polling hundreds of agents. A poller builds one engine
+    for all of them : agents are added with :meth:`add`, then :meth:`run` sends all gets and walks
+    asynchronously, within the in-flight and rate limits, and returns all the results.
+
+    The shared engine keeps the SNMP v3 keys per user name : all the v3 agents of a poller using
+    the same user name must have the same passwords and protocols, otherwise :meth:`add` raises
+    a :class:`CollectError`. Use another poller for these agents.
+
+    Args:
+
+        max_in_flight (int): The maximum number of requests waiting for a response, all agents
+            together (Default : 64)
+        max_per_agent (int): The maximum number of requests waiting for a response from one
+            agent (Default : 2)
+        min_interval (float): The minimum time in seconds between two requests sent to the same
+            agent (Default : 0)
+        timeout (int): The default timeout of the agents (Default : 30)
+        max_repetitions (int): The default ``max_repetitions`` of the agents (Default : 25)
+
+    Example:
+
+        >>> poller = SnmpPoller(max_per_agent=2, min_interval=0.01)
+        >>> poller.add('switch1', community='private', get={'name':'1.3.6.1.2.1.1.5.0'},
+        ...            walk={'descr':'1.3.6.1.2.1.2.2.1.2'})
+        >>> poller.add('switch2', version=1, get={'name':'1.3.6.1.2.1.1.5.0',
+        ...                                       'status':'1.3.6.1.2.1.2.2.1.8.1-3'})
+        >>> print poller.run()   #doctest: +NORMALIZE_WHITESPACE
+        {'switch1': {'name': 'switch1',
+                     'descr': [('1.3.6.1.2.1.2.2.1.2.1', 'GigabitEthernet0/1'), ... ]},
+         'switch2': {'name': 'switch2', 'status': [1, 1, 2]}}
+        >>> poller.errors
+        {}
+    """
+    def __init__(self, max_in_flight=64, max_per_agent=2, min_interval=0, timeout=30,
+                 max_repetitions=25):
+        from pysnmp.entity.rfc3413.oneliner import cmdgen
+        self.cmdGenerator = cmdgen.CommandGenerator()
+        self.max_in_flight = max_in_flight
+        self.max_per_agent = max_per_agent
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.max_repetitions = max_repetitions
+        self.jobs = []
+        self.errors = {}
+        self.usm_users = {}
+
+    def add(self, host, get=None, walk=None, key=None, **kwargs):
+        """Adds an agent to poll
+
+        Args:
+
+            host (str): IP address or hostname of the agent
+            get (dict): keyname/OID dictionary of the values to get, OID ranges are accepted as
+                in :meth:`Snmp.mget`
+            walk (dict): keyname/OID root path dictionary of the subtrees to walk
+            key (str): The key of the agent in the results (Default : host)
+            kwargs: Other :class:`Snmp` parameters : community, version, port, user, ...
+
+        Raises:
+
+            CollectError: a v3 agent with the same user name but other credentials was added
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('max_repetitions', self.max_repetitions)
+        snmp = Snmp(host, cmd_generator=self.cmdGenerator, **kwargs)
+        auth = snmp.cmd_args[0]
+        if hasattr(auth, 'userName'):
+            # pysnmp configures the engine only once per user name : other keys would be ignored
+            credentials = (auth.authProtocol, auth.authKey, auth.privProtocol, auth.privKey)
+            if self.usm_users.setdefault(auth.userName, credentials) != credentials:
+                raise CollectError('SnmpPoller : snmp v3 user %s is already used with other '
+                                   'credentials, use another poller for %s' % (auth.userName, host))
+        self.jobs.append((key or host, snmp, get or {}, walk or {}))
+
+    def run(self):
+        """Polls all the agents added since the last run
+
+        Failed gets have a ``NoAttr`` value and failed walks a truncated list : the error messages
+        are in the ``errors`` attribute, an agent key/(keyname/error message) dictionary.
+
+        Returns:
+
+            :class:`textops.DictExt`: agent key/results dictionary, the results are keyname/value
+                dictionaries with the same values as :meth:`Snmp.mget` and :meth:`Snmp.walk` ones
+        """
+        naghelp.logger.debug('collect -> SnmpPoller.run() %s agents %s',len(self.jobs),naghelp.debug_caller())
+        jobs, self.jobs = self.jobs, []
+        queue = _SnmpRequestQueue(self.cmdGenerator.snmpEngine, self.max_in_flight,
+                                  self.max_per_agent, self.min_interval)
+        results = {}
+        errors = {}
+
+        def get_done(key):
+            def cbFun(dct, get_errors):
+                results[key].update(dct)
+                errors[key].update(get_errors)
+            return cbFun
+
+        def walk_done(key, snmp, var):
+            def cbFun(*result):
+                results[key][var], error = snmp._walk_result(*result)
+                if error:
+                    errors[key][var] = str(error)
+            return cbFun
+
+        with tracer.span('snmp.poll', agents=len(jobs), max_in_flight=self.max_in_flight,
+                         max_per_agent=self.max_per_agent) as span:
+            for key, snmp, gets, walks in jobs:
+                results.setdefault(key, {})
+                errors.setdefault(key, {})
+                if gets:
+                    snmp._queue_get(queue, gets, get_done(key))
+                for var, oid in walks.items():
+                    snmp._queue_walk(queue, oid, walk_done(key, snmp, var))
+            queue.run()
+            self.errors = dict([ (key,dct) for key,dct in errors.items() if dct ])
+            span.set(requests=queue.sent, failed_agents=len(self.errors))
+        return textops.DictExt(results)
+
 class Http(object):
     r"""Http class helper
 
@@ -2047,10 +4104,12 @@ class Http(object):
         naghelp.logger.debug('collect -> get("%s") %s',url,naghelp.debug_caller())
         params = dict(self.kwargs)
         params.update(kwargs)
-        try:
-            r = self.session.get(url,**params)
-        except self.requests.Timeout,e:
-            raise ConnectionError(e)
+        with tracer.span('http.get', url=url) as span:
+            try:
+                r = self.session.get(url,**params)
+            except self.requests.Timeout,e:
+                raise ConnectionError(e)
+            span.set(status=r.status_code, bytes_out=len(r.content))
         return r.text if r.status_code==200 else ''
 
     def get(self,url, expected_pattern=0, unexpected_pattern=0, filter=0,*args,**kwargs):
@@ -2098,10 +4157,12 @@ class Http(object):
         naghelp.logger.debug('collect -> post("%s") %s',url,naghelp.debug_caller())
         params = dict(self.kwargs)
         params.update(kwargs)
-        try:
-            r = self.session.post(url,**params)
-        except self.requests.Timeout,e:
-            raise ConnectionError(e)
+        with tracer.span('http.post', url=url) as span:
+            try:
+                r = self.session.post(url,**params)
+            except self.requests.Timeout,e:
+                raise ConnectionError(e)
+            span.set(status=r.status_code, bytes_out=len(r.content))
         return r.text if r.status_code==200 else ''
 
     def post(self,url, expected_pattern=0, unexpected_pattern=0, filter=0,*args,**kwargs):
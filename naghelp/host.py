@@ -37,7 +37,6 @@ from database.
 
 import os
 from textops import DictExt, NoAttr, dformat, pp
-import dateutil.parser
 
 __all__ = ['Host']
 
@@ -219,6 +218,8 @@ class Host(dict):
         if not val:
             return default
         if isinstance(val,basestring):
+            #import is done only on demand, because it takes some little time
+            import dateutil.parser
             return dateutil.parser.parse(val)
         return val
 
@@ -6,6 +6,20 @@
 # @author: Eric Lapouyade
 
 import sys
+import os
+import socket
+import select
+import errno
+import signal
+import tempfile
+import traceback
+from .tools import send_msg, recv_msg, bind_unix_socket, connect_unix_socket
+
+DEFAULT_SOCKET_PATH = '/tmp/naghelp/launcher.sock'
+"""Default unix socket path used by :func:`launch_server` and :func:`launch_client`"""
+
+UNKNOWN_EXIT_CODE = 3
+"""Exit code sent to Nagios when the launcher server cannot run the plugin"""
 
 def usage(plugin_base_class,error=''):
     """Prints launcher usage and display all available plugin classes"""
@@ -91,4 +105,206 @@ def launch(plugin_base_class):
     if not plugin:
         usage(plugin_base_class,'*** "%s" is not a valid plugin' % plugin_name)
     plugin.usage = 'usage: \n%prog <plugin name or path.to.module.PluginClass> [options]'
-    plugin.run()
\ No newline at end of file
+    plugin.run()
+
+def _exit_code(code):
+    """Converts a SystemExit code into a process exit code the way python interpreter does"""
+    if code is None:
+        return 0
+    if isinstance(code, (int, long)):
+        return code
+    print >>sys.stderr, code
+    return 1
+
+def _run_worker(plugin_base_class, conn):
+    """Runs in a forked worker : replays client's environment, runs the plugin, sends back outputs"""
+    request = recv_msg(conn)
+    if request is None:
+        return 1
+    # tells the client that its plugin is running
+    send_msg(conn, { 'accepted' : True })
+    os.environ.clear()
+    os.environ.update(dict([ (k.encode('latin-1'),v.encode('latin-1')) for k,v in request['env'].items() ]))
+    try:
+        os.chdir(request['cwd'].encode('latin-1'))
+    except OSError:
+        pass
+    sys.argv = [ a.encode('latin-1') for a in request['argv'] ]
+
+    stdout = tempfile.TemporaryFile()
+    stderr = tempfile.TemporaryFile()
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(devnull, 0)
+    os.dup2(stdout.fileno(), 1)
+    os.dup2(stderr.fileno(), 2)
+    try:
+        launch(plugin_base_class)
+        exit_code = 0
+    except SystemExit, e:
+        exit_code = _exit_code(e.code)
+    except:
+        traceback.print_exc()
+        exit_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    stdout.seek(0)
+    stderr.seek(0)
+    # latin-1 is used to transport raw bytes into json strings
+    send_msg(conn, { 'exit_code' : exit_code,
+                     'stdout' : stdout.read().decode('latin-1'),
+                     'stderr' : stderr.read().decode('latin-1') })
+    # the worker ends with os._exit() : atexit handlers are not called
+    from .collect import expect_pool
+    expect_pool.close_all()
+    return 0
+
+def _reap_workers(workers, block=False):
+    """Waits for finished workers, blocks until one finishes if ``block`` is True"""
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.ECHILD:
+                workers.clear()
+            return
+        if not pid:
+            return
+        workers.discard(pid)
+        block = False
+
+def launch_server(plugin_base_class, socket_path=DEFAULT_SOCKET_PATH, max_workers=32, socket_mode=0o600):
+    """Preload all plugins then run them on request from a unix socket
+
+    Starting a plugin with :func:`launch` means starting a new python interpreter, importing
+    naghelp and its dependencies then searching and importing the plugin module : for short checks,
+    this fixed cost may be bigger than the check itself. This function does all that only once :
+    It imports all plugins found in ``plugin_base_class.plugins_basedir`` then waits for
+    requests sent by :func:`launch_client` on a unix socket. For each request, a worker is forked :
+    it gets the client command line arguments, environment variables and current directory, runs
+    the plugin exactly like :func:`launch` would do, then sends back stdout, stderr and exit code.
+
+    Args:
+
+        plugin_base_class(:class:`naghelp.ActivePlugin`): the base class from which all your active
+            plugins are inherited (see :func:`launch`).
+        socket_path (str): The unix socket path to listen to (Default : ``/tmp/naghelp/launcher.sock``)
+        max_workers (int): The maximum number of plugins running at the same time (Default : 32)
+        socket_mode (int): The socket file permissions (Default : 0600, only the server user can
+            send requests). The socket directory is created with 0700 permissions.
+
+    This function has to be used in a server script, for example::
+
+        #!/usr/bin/python
+        from plugin_commons import MyProjectActivePlugin
+        from naghelp.launcher import launch_server
+
+        if __name__ == '__main__':
+            launch_server(MyProjectActivePlugin)
+
+    Then, Nagios will use a launcher script calling :func:`launch_client`.
+    """
+    # do not use the plugins manifest : all plugin modules must be imported once for all
+    plugin_base_class.find_plugins(use_manifest=False)
+
+    server = bind_unix_socket(socket_path, socket_mode)
+
+    def handle_sigterm(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    workers = set()
+    try:
+        while True:
+            _reap_workers(workers, block=len(workers) >= max_workers)
+            try:
+                readable,_,_ = select.select([server],[],[],1.0)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                continue
+            conn,_ = server.accept()
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    code = _run_worker(plugin_base_class, conn)
+                except:
+                    code = 1
+                os._exit(code)
+            conn.close()
+            workers.add(pid)
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+def launch_client(socket_path=DEFAULT_SOCKET_PATH, plugin_base_class=None, timeout=10):
+    """Ask a launcher server to run the plugin specified in command line
+
+    This is the client part of :func:`launch_server` : it keeps the same command line contract as
+    :func:`launch` (same arguments, same output, same exit code) but the plugin itself is run by a
+    worker forked from the server where naghelp and all plugins are already imported.
+
+    Args:
+
+        socket_path (str): The launcher server unix socket path
+            (Default : ``/tmp/naghelp/launcher.sock``)
+        plugin_base_class(:class:`naghelp.ActivePlugin`): If specified and the server is not
+            reachable, the plugin is run locally with :func:`launch`. If not specified, an UNKNOWN
+            status is returned to Nagios when the server is not reachable.
+        timeout (int): The maximum time in seconds for the server to start the plugin, when
+            reached, the server is considered as not reachable (Default : 10)
+
+    The command line and the environment (they may contain passwords) are only sent to a server
+    running with the same user as the client.
+
+    The launcher script for Nagios becomes::
+
+        #!/usr/bin/python
+        from naghelp.launcher import launch_client
+
+        if __name__ == '__main__':
+            launch_client()
+
+    The command line is unchanged::
+
+        /path/to/your/launcher myplugin --name=myhost --user=nagiosuser --passwd=nagiospwd
+    """
+    sock = None
+    try:
+        sock = connect_unix_socket(socket_path, timeout)
+        # latin-1 is used to transport raw bytes into json strings
+        send_msg(sock, { 'argv' : [ a.decode('latin-1') for a in sys.argv ],
+                         'env' : dict([ (k.decode('latin-1'),v.decode('latin-1')) for k,v in os.environ.items() ]),
+                         'cwd' : os.getcwd().decode('latin-1') })
+        # a busy or hung server does not start a worker
+        if recv_msg(sock) is None:
+            raise socket.error('the connection has been closed')
+    except socket.error, e:
+        if sock is not None:
+            sock.close()
+        if plugin_base_class is not None:
+            launch(plugin_base_class)
+            return
+        print 'UNKNOWN : launcher server is not reachable on %s (%s)' % (socket_path, e)
+        sys.exit(UNKNOWN_EXIT_CODE)
+
+    # the plugin is running : it has its own timeouts
+    sock.settimeout(None)
+    response = recv_msg(sock)
+    sock.close()
+    if response is None:
+        print 'UNKNOWN : launcher server closed the connection without response'
+        sys.exit(UNKNOWN_EXIT_CODE)
+    sys.stdout.write(response['stdout'].encode('latin-1'))
+    sys.stderr.write(response['stderr'].encode('latin-1'))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.exit(response['exit_code'])
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# Création : 16 Oct 2026
+#
+# @author: Eric Lapouyade
+"""This module exports plugin runs metrics to a monitoring backend
+
+To get an aggregated view of all the plugins executions (run duration, collect duration, exit
+level, timeouts, collected bytes, response size), set the
+:attr:`~naghelp.ActivePlugin.metrics_exporter` attribute in your plugins base class::
+
+    from naghelp import ActivePlugin
+    from naghelp.metrics import StatsdExporter
+
+    class MyProjectActivePlugin(ActivePlugin):
+        metrics_exporter = StatsdExporter('127.0.0.1', 8125)
+
+Metrics are exported once at the end of :meth:`~naghelp.ActivePlugin.run`, whatever the plugin
+result is. An exporter must never make the plugin fail or wait : errors are only logged in debug
+mode.
+
+The metrics dictionary given to exporters has these keys :
+
+    ================  ====================================================================
+    key               description
+    ================  ====================================================================
+    plugin            The plugin name (``module.ClassName``)
+    level             The exit level name (``OK``, ``WARNING``, ``CRITICAL``, ``UNKNOWN``)
+    run_duration      The whole plugin run duration in seconds
+    collect_duration  The collect duration in seconds
+    timeouts          The number of timeouts that occured during the collect
+    collected_bytes   The size of collected raw data
+    response_size     The size of the response sent to Nagios
+    ================  ====================================================================
+"""
+
+import os
+import socket
+import json
+import tempfile
+import naghelp
+from .tools import Lockfile, TimeoutError
+
+__all__ = ['MetricsExporter', 'StatsdExporter', 'TextfileExporter']
+
+METRICS_HISTOGRAMS = [
+    ('run_duration', 'naghelp_run_duration_seconds', 'Plugin run duration',
+     [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]),
+    ('collect_duration', 'naghelp_collect_duration_seconds', 'Plugin collect duration',
+     [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]),
+    ('collected_bytes', 'naghelp_collected_bytes', 'Size of collected raw data',
+     [1024, 10240, 102400, 1048576, 10485760]),
+    ('response_size', 'naghelp_response_bytes', 'Size of the response sent to Nagios',
+     [256, 1024, 4096, 16384, 65536]),
+]
+
+class MetricsExporter(object):
+    """Base class for metrics exporters
+
+    An exporter only has to implement the :meth:`export` method.
+    """
+    def export(self, metrics):
+        """Export the metrics of one plugin run
+
+        Args:
+
+            metrics (dict): The metrics dictionary (see :mod:`naghelp.metrics`)
+        """
+        raise NotImplementedError
+
+class StatsdExporter(MetricsExporter):
+    """Exports metrics to a statsd server
+
+    All metrics of a plugin run are sent into a single non-blocking UDP datagram : durations and
+    sizes are sent as timers/histograms, the exit level and the timeouts as counters.
+    The metrics names are ``<prefix>.<plugin>.<metric>``, dots in the plugin name are
+    replaced by underscores.
+
+    Args:
+
+        host (str): The statsd server host (Default : '127.0.0.1')
+        port (int): The statsd server UDP port (Default : 8125)
+        prefix (str): The metrics name prefix (Default : 'naghelp')
+
+    Example:
+
+        >>> import socket
+        >>> from naghelp.metrics import StatsdExporter
+        >>> listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        >>> listener.bind(('127.0.0.1', 0))
+        >>> listener.settimeout(5)
+        >>> exporter = StatsdExporter(port=listener.getsockname()[1])
+        >>> exporter.export({'plugin':'myplugins.CheckDisk', 'level':'OK', 'run_duration':1.5,
+        ...                  'collect_duration':1.25, 'timeouts':0, 'collected_bytes':1234,
+        ...                  'response_size':321 })
+        >>> print listener.recv(65535)
+        naghelp.myplugins_CheckDisk.run_duration:1500|ms
+        naghelp.myplugins_CheckDisk.collect_duration:1250|ms
+        naghelp.myplugins_CheckDisk.collected_bytes:1234|h
+        naghelp.myplugins_CheckDisk.response_size:321|h
+        naghelp.myplugins_CheckDisk.level.OK:1|c
+        naghelp.myplugins_CheckDisk.timeouts:0|c
+        >>> listener.close()
+    """
+    def __init__(self, host='127.0.0.1', port=8125, prefix='naghelp'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = None
+
+    def format(self, metrics):
+        """Returns the statsd datagram for the given metrics"""
+        name = '%s.%s' % (self.prefix, metrics['plugin'].replace('.','_'))
+        lines = []
+        for key in ['run_duration', 'collect_duration']:
+            if metrics.get(key) is not None:
+                lines.append('%s.%s:%d|ms' % (name, key, round(metrics[key] * 1000)))
+        for key in ['collected_bytes', 'response_size']:
+            if metrics.get(key) is not None:
+                lines.append('%s.%s:%d|h' % (name, key, metrics[key]))
+        lines.append('%s.level.%s:1|c' % (name, metrics['level']))
+        lines.append('%s.timeouts:%d|c' % (name, metrics.get('timeouts') or 0))
+        return '\n'.join(lines)
+
+    def export(self, metrics):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setblocking(0)
+        try:
+            self.sock.sendto(self.format(metrics), self.address)
+        except socket.error,e:
+            naghelp.logger.debug('metrics -> statsd export failed : %s',e)
+
+class TextfileExporter(MetricsExporter):
+    """Exports metrics into a Prometheus textfile
+
+    The file is to be read by the node_exporter textfile collector. As each plugin run is a
+    distinct process, counters and histograms are accumulated into a JSON state file
+    (``.<filename>.json`` in the same directory), then the ``.prom`` file is atomically
+    rewritten. As the export is done at the end of each plugin run, the lock is not waited for by
+    default : if the state file is locked by another plugin (for more than ``lock_timeout``
+    seconds), the metrics of the run are dropped.
+
+    Args:
+
+        directory (str): The node_exporter textfile directory
+        filename (str): The Prometheus file name (Default : 'naghelp.prom')
+        lock_timeout (float): Maximum time in seconds to wait for the state file lock
+            (Default : 0, only one non-blocking attempt)
+
+    Example:
+
+        >>> import tempfile
+        >>> from naghelp.metrics import TextfileExporter
+        >>> exporter = TextfileExporter(tempfile.mkdtemp())
+        >>> metrics = {'plugin':'myplugins.CheckDisk', 'level':'OK', 'run_duration':1.5,
+        ...            'collect_duration':1.25, 'timeouts':1, 'collected_bytes':1234,
+        ...            'response_size':321 }
+        >>> exporter.export(metrics)
+        >>> exporter.export(metrics)
+        >>> prom = open(exporter.prom_file).read()
+        >>> print '\\n'.join([ l for l in prom.splitlines() if 'run' in l ][:7])
+        # HELP naghelp_runs_total Number of plugin runs
+        # TYPE naghelp_runs_total counter
+        naghelp_runs_total{plugin="myplugins.CheckDisk",level="OK"} 2
+        # HELP naghelp_run_duration_seconds Plugin run duration
+        # TYPE naghelp_run_duration_seconds histogram
+        naghelp_run_duration_seconds_bucket{plugin="myplugins.CheckDisk",le="0.1"} 0
+        naghelp_run_duration_seconds_bucket{plugin="myplugins.CheckDisk",le="0.25"} 0
+        >>> print '\\n'.join([ l for l in prom.splitlines() if 'run_duration_seconds_' in l ][-3:])
+        naghelp_run_duration_seconds_bucket{plugin="myplugins.CheckDisk",le="+Inf"} 2
+        naghelp_run_duration_seconds_sum{plugin="myplugins.CheckDisk"} 3.0
+        naghelp_run_duration_seconds_count{plugin="myplugins.CheckDisk"} 2
+        >>> print [ l for l in prom.splitlines() if l.startswith('naghelp_timeouts_total') ]
+        ['naghelp_timeouts_total{plugin="myplugins.CheckDisk"} 2']
+    """
+    def __init__(self, directory, filename='naghelp.prom', lock_timeout=0):
+        self.prom_file = os.path.join(directory, filename)
+        self.state_file = os.path.join(directory, '.%s.json' % filename)
+        self.lock_timeout = lock_timeout
+
+    def load_state(self):
+        """Returns the accumulated metrics"""
+        try:
+            with open(self.state_file) as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {'counters':{}, 'histograms':{}}
+
+    def update_state(self, state, metrics):
+        """Accumulates the metrics of one plugin run into the state"""
+        plugin = metrics['plugin']
+        counters = state['counters']
+        runs = counters.setdefault('naghelp_runs_total', {}).setdefault(plugin, {})
+        runs[metrics['level']] = runs.get(metrics['level'], 0) + 1
+        timeouts = counters.setdefault('naghelp_timeouts_total', {})
+        timeouts[plugin] = timeouts.get(plugin, 0) + (metrics.get('timeouts') or 0)
+        for key, name, help, buckets in METRICS_HISTOGRAMS:
+            value = metrics.get(key)
+            if value is None:
+                continue
+            histo = state['histograms'].setdefault(name, {}).setdefault(plugin,
+                            {'buckets':[0] * len(buckets), 'sum':0, 'count':0})
+            for i,bound in enumerate(buckets):
+                if value <= bound:
+                    histo['buckets'][i] += 1
+            histo['sum'] += value
+            histo['count'] += 1
+
+    def format(self, state):
+        """Returns the Prometheus textfile content for the accumulated metrics"""
+        lines = [ '# HELP naghelp_runs_total Number of plugin runs',
+                  '# TYPE naghelp_runs_total counter' ]
+        for plugin,levels in sorted(state['counters'].get('naghelp_runs_total', {}).items()):
+            for level,count in sorted(levels.items()):
+                lines.append('naghelp_runs_total{plugin="%s",level="%s"} %s' % (plugin, level, count))
+        lines += [ '# HELP naghelp_timeouts_total Number of timeouts during collect',
+                   '# TYPE naghelp_timeouts_total counter' ]
+        for plugin,count in sorted(state['counters'].get('naghelp_timeouts_total', {}).items()):
+            lines.append('naghelp_timeouts_total{plugin="%s"} %s' % (plugin, count))
+        for key, name, help, buckets in METRICS_HISTOGRAMS:
+            lines += [ '# HELP %s %s' % (name, help), '# TYPE %s histogram' % name ]
+            for plugin,histo in sorted(state['histograms'].get(name, {}).items()):
+                for bound,count in zip(buckets, histo['buckets']):
+                    lines.append('%s_bucket{plugin="%s",le="%s"} %s' % (name, plugin, bound, count))
+                lines.append('%s_bucket{plugin="%s",le="+Inf"} %s' % (name, plugin, histo['count']))
+                lines.append('%s_sum{plugin="%s"} %s' % (name, plugin, histo['sum']))
+                lines.append('%s_count{plugin="%s"} %s' % (name, plugin, histo['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write_atomic(self, filename, content):
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.naghelp_')
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(content)
+        os.chmod(tmp_file, 0o644)
+        os.rename(tmp_file, filename)
+
+    def export(self, metrics):
+        try:
+            with Lockfile(self.state_file, timeout=self.lock_timeout, delay=0.02):
+                state = self.load_state()
+                self.update_state(state, metrics)
+                self.write_atomic(self.state_file, json.dumps(state, separators=(',',':')))
+                self.write_atomic(self.prom_file, self.format(state))
+        except TimeoutError:
+            naghelp.logger.debug('metrics -> %s is locked by another plugin : export skipped',
+                                 self.state_file)
+        except (IOError, OSError),e:
+            naghelp.logger.debug('metrics -> textfile export failed : %s',e)
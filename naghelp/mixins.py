@@ -6,7 +6,8 @@
 #
 """This module contains mixins to extended naghelp with some additional features"""
 
-from naghelp import *
+from .response import OK, WARNING, CRITICAL, UNKNOWN
+from .tools import Lockfile
 from textops import *
 import re
 import time,datetime
@@ -5,8 +5,10 @@
 # @author: Eric Lapouyade
 #
 import os
+import time
+from contextlib import contextmanager
 
-__all__ = ['PerfData']
+__all__ = ['PerfData', 'Timings']
 
 import re
 
@@ -130,3 +132,98 @@ class PerfData(object):
             return "'%s'" % value.replace("'", "''")
         else:
             return value
+
+
+class Timings(object):
+    """Timings class records wall-clock and CPU time of named phases
+
+    It is used by :class:`~naghelp.ActivePlugin` to know where the execution time is spent
+    (see :attr:`~naghelp.ActivePlugin.timings`). CPU time is the user + system time of the
+    current process, it does not include the time spent by child processes.
+    When a phase is recorded several times, durations are accumulated.
+
+    Examples:
+
+        >>> import time
+        >>> t = Timings()
+        >>> with t.phase('collect'):
+        ...     time.sleep(0.1)
+        >>> t.add('parse', 0.25, 0.2)
+        >>> t.names()
+        ['collect', 'parse']
+        >>> 0.1 <= t.wall('collect') < 0.5
+        True
+        >>> t.to_dict()['parse']
+        {'wall': 0.25, 'cpu': 0.2}
+        >>> print t.to_perf_data()[1]
+        naghelp_parse_s=0.250000s;;;;
+    """
+    def __init__(self):
+        self.phases = {}
+        self.order = []
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager to record the time spent in the ``with:`` block
+
+        The time is recorded even if an exception (including ``SystemExit``) is raised.
+
+        Args:
+
+            name (str): The phase name
+        """
+        wall_start = time.time()
+        cpu_start = os.times()
+        try:
+            yield self
+        finally:
+            cpu_end = os.times()
+            self.add(name, time.time() - wall_start,
+                     (cpu_end[0] - cpu_start[0]) + (cpu_end[1] - cpu_start[1]))
+
+    def add(self, name, wall, cpu=0.0):
+        """Add durations to a phase
+
+        Args:
+
+            name (str): The phase name
+            wall (float): wall-clock time in seconds
+            cpu (float): CPU time in seconds
+        """
+        if name not in self.phases:
+            self.order.append(name)
+            self.phases[name] = [0.0, 0.0]
+        self.phases[name][0] += wall
+        self.phases[name][1] += cpu
+
+    def names(self):
+        """Returns the phases names in the order they have been recorded"""
+        return list(self.order)
+
+    def wall(self, name):
+        """Returns the wall-clock time in seconds of a phase (0.0 if not recorded)"""
+        return self.phases.get(name, (0.0, 0.0))[0]
+
+    def cpu(self, name):
+        """Returns the CPU time in seconds of a phase (0.0 if not recorded)"""
+        return self.phases.get(name, (0.0, 0.0))[1]
+
+    def to_dict(self):
+        """Returns timings as a dictionary ``{ phase : {'wall': seconds, 'cpu': seconds} }``"""
+        return dict([ (name, {'wall': wall, 'cpu': cpu}) for name,(wall,cpu) in self.phases.items() ])
+
+    def to_perf_data(self, prefix='naghelp_'):
+        """Returns wall-clock timings as a list of :class:`PerfData` objects
+
+        Labels are ``<prefix><phase>_s``, values are in seconds.
+
+        Args:
+
+            prefix (str): labels prefix (Default : 'naghelp\_')
+        """
+        return [ PerfData('%s%s_s' % (prefix, name), '%.6f' % self.phases[name][0], 's')
+                 for name in self.order ]
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join([ '%s=%.3fs' % (name, self.phases[name][0]) for name in self.order ]))
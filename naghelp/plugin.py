@@ -19,7 +19,6 @@ from .response import PluginResponse, OK, WARNING, CRITICAL, UNKNOWN
 import tempfile
 from addicted import NoAttr, NoAttrDict
 import textops
-from collect import search_invalid_port
 import datetime
 import naghelp
 import socket
@@ -70,6 +69,16 @@ class Plugin(object):
     found_plugins = {}
     """Plugins discovered during find_plugins() method"""
 
+    plugins_manifest_filename_pattern = '/tmp/naghelp/%s_plugins_manifest.json'
+    """For plugin search, the on-disk cache of discovered plugins. ``%s`` will be replaced by
+    :attr:`plugin_type`. Set to None to disable the cache.
+
+    The manifest stores, for each python file, its modification time, its size and the plugins
+    it contains : :meth:`find_plugins` only imports new or modified files. As the manifest tells
+    which modules to import, it is ignored if it is not owned by the current user or if it is
+    writable by other users.
+    """
+
     @classmethod
     def get_instance(cls, plugin_name,**extra_options):
         """Generate a plugin instance from its name string
@@ -170,9 +179,20 @@ class Plugin(object):
         """
         module_and_class = plugin_name.rsplit('.',1)
         if len(module_and_class) == 1:
-            module_name,class_name = cls.get_plugin(module_and_class[0])
-        else:
-            module_name,class_name = module_and_class
+            plugin_class = cls._load_plugin_class(*cls.get_plugin(module_and_class[0]))
+            if plugin_class is None and cls.get_plugins_manifest_filename():
+                # the manifest may be outdated (a base class changed for instance) : full search
+                cls.found_plugins = {}
+                cls.find_plugins(use_manifest=False)
+                plugin_class = cls._load_plugin_class(*cls.get_plugin(module_and_class[0]))
+            return plugin_class
+        return cls._load_plugin_class(*module_and_class)
+
+    @classmethod
+    def _load_plugin_class(cls,module_name,class_name):
+        """Imports the module and returns the plugin class or None if not found"""
+        if module_name is None:
+            return None
         try:
             module = __import__(module_name, fromlist=[''])
             plugin_class = getattr(module,class_name,None)
@@ -183,7 +203,7 @@ class Plugin(object):
         return None
 
     @classmethod
-    def find_plugins(cls):
+    def find_plugins(cls, use_manifest=True):
         """Recursively find all plugin classes for all python files present in a directory.
 
         It finds all python files inside ``YourPluginsBaseClass.plugins_basedir`` then look for
@@ -200,12 +220,25 @@ class Plugin(object):
             module   the plugin module name with a full dotted path
             path     the module file path
             desc     the plugin description (first docstring line)
+            class    the class object or None if the module has not
+                     been imported (informations came from manifest)
             =======  ==============================================
+
+        Importing all python files may be long, so discovered plugins are stored into an
+        on-disk manifest (see :attr:`plugins_manifest_filename_pattern`) : a python file is imported
+        only if its modification time or its size has changed since the last search.
+
+        Args:
+
+            use_manifest(bool): if False, all python files are imported again and the manifest is
+                rebuilt from scratch (Default : True)
         """
         # Discovered plugins are cached into found_plugins class attribute
         if not cls.found_plugins:
             plugins = {}
             excluded_dirs = []
+            manifest_files = cls.load_plugins_manifest() if use_manifest else {}
+            new_manifest_files = {}
             basedir = os.path.normpath(cls.plugins_basedir)
             for root,dirs,files in os.walk(basedir):
                 if '/.' not in root and '__init__.py' in files:
@@ -218,29 +251,126 @@ class Plugin(object):
                     for f in files:
                         if f.endswith('.py') and not f.startswith('__'):
                             path = os.path.join(root,f)
+                            module_name = path[len(basedir)+1:-3].replace(os.sep,'.')
                             try:
-                                module_name = path[len(basedir)+1:-3].replace(os.sep,'.')
-                                module = __import__(cls.plugins_basemodule + module_name,fromlist=[''])
-                                for name,member in module.__dict__.items():
-                                    try:
-                                        if hasattr(member,'plugin_type') and getattr(member,'plugin_type') == cls.plugin_type and  not member.__dict__.get('abstract',False):
-                                            doc = member.get_plugin_desc()
-                                            plugins[member.__name__.lower()] = {
-                                                'class' : member,
-                                                'name'  : member.__name__,
-                                                'module': cls.plugins_basemodule + module_name,
-                                                'path'  : os.sep.join(module_name.split('.'))+'.py',
-                                                'desc'  : doc.splitlines()[0] if doc else 'No description'
-                                            }
-                                    except Exception,e:
-                                        #traceback.print_exc()
-                                        pass
-                            except Exception,e:
-                                #print e
-                                pass
+                                st = os.stat(path)
+                            except OSError:
+                                continue
+                            entry = manifest_files.get(module_name)
+                            if entry and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+                                module_plugins = [ dict([ (str(k),v.encode('utf-8')) for k,v in p.items() ],**{'class':None})
+                                                   for p in entry['plugins'] ]
+                            else:
+                                module_plugins = cls._import_module_plugins(module_name)
+                                if module_plugins is None:
+                                    # import error : do not store into the manifest to retry next time
+                                    continue
+                            new_manifest_files[module_name] = {
+                                'mtime'  : st.st_mtime,
+                                'size'   : st.st_size,
+                                'plugins': [ dict([ (k,v) for k,v in p.items() if k != 'class' ]) for p in module_plugins ]
+                            }
+                            for plugin in module_plugins:
+                                plugins[plugin['name'].lower()] = plugin
+            if new_manifest_files != manifest_files:
+                cls.save_plugins_manifest(new_manifest_files)
             cls.found_plugins = plugins
         return cls.found_plugins
 
+    @classmethod
+    def _import_module_plugins(cls, module_name):
+        """Imports a module and returns the plugins found inside or None on import error"""
+        plugins = []
+        try:
+            module = __import__(cls.plugins_basemodule + module_name,fromlist=[''])
+        except Exception,e:
+            return None
+        for name,member in module.__dict__.items():
+            try:
+                if hasattr(member,'plugin_type') and getattr(member,'plugin_type') == cls.plugin_type and  not member.__dict__.get('abstract',False):
+                    doc = member.get_plugin_desc()
+                    plugins.append({
+                        'class' : member,
+                        'name'  : member.__name__,
+                        'module': cls.plugins_basemodule + module_name,
+                        'path'  : os.sep.join(module_name.split('.'))+'.py',
+                        'desc'  : doc.splitlines()[0] if doc else 'No description'
+                    })
+            except Exception,e:
+                pass
+        return plugins
+
+    @classmethod
+    def get_plugins_manifest_filename(cls):
+        """Returns the plugins manifest file path or None if the manifest is disabled
+
+        It uses :attr:`plugins_manifest_filename_pattern` where ``%s`` is replaced by
+        :attr:`plugin_type`.
+        """
+        if not cls.plugins_manifest_filename_pattern:
+            return None
+        return cls.plugins_manifest_filename_pattern % cls.plugin_type
+
+    @classmethod
+    def load_plugins_manifest(cls):
+        """Load the plugins manifest
+
+        Returns:
+
+            dict: a dictionary where keys are module names (relative to :attr:`plugins_basedir`)
+            and values are dictionaries with ``mtime``, ``size`` and ``plugins`` keys. An empty dict
+            is returned if there is no manifest, if it has been built for other plugin settings or
+            if it may have been written by another user.
+        """
+        filename = cls.get_plugins_manifest_filename()
+        if not filename:
+            return {}
+        try:
+            with open(filename) as fh:
+                st = os.fstat(fh.fileno())
+                if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                    cls.debug('Ignore plugins manifest %s : not owned by the current user or writable '
+                              'by other users',filename)
+                    return {}
+                manifest = json.load(fh)
+        except (IOError, OSError, ValueError),e:
+            return {}
+        if manifest.get('plugin_type') != cls.plugin_type or \
+           manifest.get('plugins_basedir') != os.path.normpath(cls.plugins_basedir) or \
+           manifest.get('plugins_basemodule') != cls.plugins_basemodule:
+            return {}
+        return manifest.get('files',{})
+
+    @classmethod
+    def save_plugins_manifest(cls, manifest_files):
+        """Save the plugins manifest
+
+        The file is written into a temporary file then renamed, so concurrent plugin processes
+        never read a partial manifest. Errors are ignored : the manifest is only a cache.
+
+        Args:
+
+            manifest_files(dict): the files informations as returned by :meth:`load_plugins_manifest`
+        """
+        filename = cls.get_plugins_manifest_filename()
+        if not filename:
+            return
+        manifest = { 'plugin_type' : cls.plugin_type,
+                     'plugins_basedir' : os.path.normpath(cls.plugins_basedir),
+                     'plugins_basemodule' : cls.plugins_basemodule,
+                     'files' : manifest_files }
+        try:
+            filedir = os.path.dirname(filename)
+            if not os.path.exists(filedir):
+                os.makedirs(filedir)
+            fd, tmpname = tempfile.mkstemp(dir=filedir, prefix='.manifest')
+            with os.fdopen(fd,'w') as fh:
+                json.dump(manifest,fh,separators=(',',':'))
+            os.chmod(tmpname, 0o644)
+            os.rename(tmpname, filename)
+        except (IOError, OSError),e:
+            cls.debug('Cannot save plugins manifest %s : %s',filename,e)
+
     @classmethod
     def find_plugins_import_errors(cls):
         """Find all import errors all python files present in a directory.
@@ -703,6 +833,16 @@ class ActivePlugin(Plugin):
     """Attribute giving the pattern for the persistent data file path. ``%s`` will be replaced
     by the monitored host name (or IP if host name not specified)"""
 
+    corpus_dir = None
+    """Attribute giving the directory where collected data are archived as timestamped snapshots
+
+    If None (default), nothing is archived unless the ``--corpus=DIR`` option is given.
+    The snapshots can be replayed with :mod:`naghelp.replay` to benchmark parsing.
+    """
+
+    corpus_max_snapshots = 100
+    """Attribute giving the maximum number of snapshots to keep per host in the corpus"""
+
     data = textops.DictExt()
     """The place to put collected and parsed data
 
@@ -719,8 +859,30 @@ class ActivePlugin(Plugin):
     In some situation, one may prefer to send an ``UKNOWN`` state by default.
     """
 
+    timings_perf_data = False
+    """Attribute to add phases timings to the response performance data
+
+    The wall-clock and CPU time of the plugin phases (``load``, ``collect``, ``parse``, ``build``,
+    ``save`` and ``send``) are always recorded in the :class:`naghelp.Timings` object
+    ``self.timings``. If this attribute is True, the wall-clock time of the phases is added as
+    performance data named ``naghelp_<phase>_s`` (``naghelp_load_s``, ``naghelp_collect_s``,
+    ``naghelp_parse_s``, ``naghelp_build_s``). Set it in your plugins base class to graph where
+    the time is spent for all the plugins.
+    """
+
+    metrics_exporter = None
+    """Attribute for the metrics exporter object
+
+    If not None, the metrics of the plugin run (see :mod:`naghelp.metrics`) are given to this
+    exporter at the end of :meth:`run`. Use for example :class:`naghelp.metrics.StatsdExporter`
+    or :class:`naghelp.metrics.TextfileExporter`.
+    """
+
     def __init__(self,**extra_options):
         self.starttime = datetime.datetime.now()
+        self.timings = naghelp.Timings()
+        self.collect_timeouts = 0
+        self.collected_bytes = None
         self.response = self.response_class(default_level=self.default_level)
         self.extra_options = extra_options
         self.feature='monitoring'
@@ -802,6 +964,8 @@ class ActivePlugin(Plugin):
                                    default=False, help='Use saved collected data (option -s)')
         self._cmd_parser.add_option('-f', action='store', dest='collectfile', metavar="FILE",
                                    help='Collect file path for -s and -r options (Default : %s)' % collected_data_file)
+        self._cmd_parser.add_option('--corpus', action='store', dest='corpus_dir', metavar="DIR",
+                                   help='Archive collected data as a timestamped snapshot into DIR (see naghelp.replay)')
         self._cmd_parser.add_option('-a', action='store_true', dest='collect_and_print',
                                    default=False, help='Collect data only and print them')
         self._cmd_parser.add_option('-b', action='store_true', dest='parse_and_print',
@@ -908,6 +1072,27 @@ class ActivePlugin(Plugin):
         """
         self.save_data(self.options.collectfile or self.collected_data_filename_pattern % self.host.name, self.data|textops.multilinestring_to_list())
 
+    def save_collected_corpus(self, corpus_dir):
+        """Archive collected data into a corpus directory
+
+        The data are saved as a compressed timestamped snapshot, only the
+        :attr:`corpus_max_snapshots` most recent snapshots are kept per host.
+        See :mod:`naghelp.replay` to replay them through :meth:`parse_data` and :meth:`build_response`.
+
+        This method is called when using ``--corpus`` option on command line or when
+        :attr:`corpus_dir` is set.
+
+        Args:
+
+            corpus_dir (str): The corpus base directory
+        """
+        from .replay import record_snapshot
+        try:
+            filename = record_snapshot(self, corpus_dir, self.corpus_max_snapshots)
+            self.debug('Collected data archived into %s', filename)
+        except Exception,e:
+            self.debug('Cannot archive collected data into %s : %s', corpus_dir, e)
+
     def restore_collected_data(self):
         """Restore collected data
 
@@ -947,6 +1132,7 @@ class ActivePlugin(Plugin):
         This method is called when an error occurs while collecting data from host : It will check
         whether the tcp ports are reachable or not. If not, the plugin exits with a fast response.
         """
+        from .collect import search_invalid_port
         invalid_port = search_invalid_port(self.host.ip,self.get_tcp_ports())
         if invalid_port:
             self.fast_response(CRITICAL,
@@ -954,6 +1140,79 @@ class ActivePlugin(Plugin):
                                'This plugin uses ports tcp = %s, udp = %s\nplease check your firewall\n\n' % (self.get_tcp_ports() or 'none',self.get_udp_ports() or 'none'),
                                2)
 
+    collect_tasks_max_workers = 8
+    """Attribute for the maximum number of tasks running at the same time in :meth:`collect_tasks`"""
+
+    collect_tasks_timeout = 60
+    """Attribute for the default timeout in seconds of each task in :meth:`collect_tasks` when the
+    host parameter ``collect_cmd_timeout`` is not set, None for no timeout"""
+
+    def collect_tasks(self,data,tasks,max_workers=None,timeout=None,ignore_errors=False):
+        """Run independent collect tasks concurrently
+
+        This method is to be used inside :meth:`collect_data` when data come from several
+        independent sources (many commands, many protocols) : instead of waiting for each
+        of them in the row, they are run in a bounded pool of threads.
+        Each task is a callable without argument, its result is stored in ``data`` with the
+        task key. A task may have its own timeout by giving a tuple ``(callable, timeout)``.
+
+        Note:
+
+            As signals are only handled by the main thread, the timeouts based on
+            :class:`naghelp.Timeout` (used by :class:`naghelp.Expect`, :class:`naghelp.Telnet`,
+            :func:`naghelp.runsh`...) do not work inside tasks : use tasks timeouts instead.
+            The whole collect is still limited by ``collect_all_timeout``.
+            A timed out task thread cannot be killed : it keeps its place in the pool until it
+            ends, this way, no more than ``max_workers`` threads are alive.
+
+        Args:
+
+            data(:class:`textops.DictExt`): the data dictionary to write collected raw data to.
+            tasks (dict): dictionary of callables or tuples ``(callable, timeout)``
+            max_workers (int): The maximum number of tasks running at the same time
+                (Default : :attr:`collect_tasks_max_workers`)
+            timeout (int): Default timeout in seconds for each task. If None, the
+                ``collect_cmd_timeout`` host parameter is used, then :attr:`collect_tasks_timeout`
+                (Default : None)
+            ignore_errors (bool): If False (default), a :class:`naghelp.CollectTasksError` is
+                raised when at least one task failed (successful results are stored in ``data``
+                before). If True, no exception is raised.
+
+        Returns:
+
+            dict : task key -> exception for each failed task
+
+        Raises:
+
+            CollectTasksError: at least one task failed and ``ignore_errors`` is False.
+
+        Example:
+
+            Here, the 3 collects are done at the same time::
+
+                def collect_data(self,data):
+                    self.collect_tasks(data, {
+                        'df'     : lambda: Ssh(self.host.ip,self.host.user,self.host.passwd).run('df -h'),
+                        'ifaces' : (lambda: Snmp(self.host.ip).walk('1.3.6.1.2.1.2.2.1.2'), 60),
+                        'status' : (lambda: Http().get('http://%s/status' % self.host.ip), 10),
+                    })
+        """
+        max_workers = max_workers or self.collect_tasks_max_workers
+        if timeout is None:
+            timeout = self.host.collect_cmd_timeout or self.collect_tasks_timeout
+            if timeout is not None:
+                timeout = int(timeout)
+        self.debug('Running %s collect tasks (max_workers=%s)', len(tasks), max_workers)
+        results, errors = naghelp.run_concurrently(tasks, max_workers, timeout)
+        data.update(results)
+        for k,e in errors.items():
+            self.debug('Collect task %s failed : %s: %s', k, e.__class__.__name__, e)
+            if isinstance(e, naghelp.TimeoutError):
+                self.collect_timeouts += 1
+        if errors and not ignore_errors:
+            raise naghelp.CollectTasksError(errors,results)
+        return errors
+
     def collect_data(self,data):
         """Collect data from monitored host
 
@@ -1138,15 +1397,19 @@ class ActivePlugin(Plugin):
         self.check_host_required_fields()
 
         if self.options.restore_collected:
-            self.restore_collected_data()
+            with self.timings.phase('collect'):
+                self.restore_collected_data()
             self.info('Collected data are restored')
         else:
             try:
                 collect_timeout = int(self.host.collect_all_timeout or COLLECT_ALL_TIMEOUT)
-                with naghelp.Timeout(seconds=collect_timeout, error_message='Collect process timeout'):
-                    self.collect_data(self.data)
+                with self.timings.phase('collect'):
+                    with naghelp.Timeout(seconds=collect_timeout, error_message='Collect process timeout'):
+                        self.collect_data(self.data)
             except Exception,e:
                 self.debug('Collect exception : %s',e)
+                if isinstance(e, naghelp.TimeoutError):
+                    self.collect_timeouts += 1
                 if self.get_tcp_ports():
                     self.info('Checking TCP ports %s ...' % self.get_tcp_ports())
                     self.check_ports()
@@ -1158,8 +1421,14 @@ class ActivePlugin(Plugin):
 
             self.info('Data are collected')
         self.debug('Collected Data = \n%s' % pp.pformat(self.data).replace('\\n','\n'))
+        if self.metrics_exporter is not None:
+            self.collected_bytes = _data_size(self.data)
         collected_keys = self.data.keys()
 
+        corpus_dir = self.options.corpus_dir or self.corpus_dir
+        if corpus_dir and not self.options.restore_collected:
+            self.save_collected_corpus(corpus_dir)
+
         if self.options.save_collected:
             self.save_collected_data()
             self.info('Collected data are saved')
@@ -1170,7 +1439,8 @@ class ActivePlugin(Plugin):
             if not self.options.parse_and_print:
                 exit(0)
 
-        self.parse_data(self.data)
+        with self.timings.phase('parse'):
+            self.parse_data(self.data)
         self.info('Data are parsed')
         self.debug('Parsed Data = \n%s' % pp.pformat(self.data.exclude_keys(collected_keys)).replace('\\n','\n'))
 
@@ -1179,12 +1449,19 @@ class ActivePlugin(Plugin):
             print pp.pformat(self.data.exclude_keys(collected_keys)).replace('\\n','\n')
             exit(0)
 
-        self.build_response(self.data)
+        with self.timings.phase('build'):
+            self.build_response(self.data)
+        self.debug('Timings : %r', self.timings)
+        if self.timings_perf_data:
+            for perf in self.timings.to_perf_data():
+                self.response.add_perf_data(perf)
         self.response.add_end(self.get_plugin_informations())
         # need to save host data here in addition to run() method because
         # send_response() will exit the program before otherwise
-        self.save_host_data()
-        self.send_response()
+        with self.timings.phase('save'):
+            self.save_host_data()
+        with self.timings.phase('send'):
+            self.send_response()
 
         self.error('Should never reach this point')
 
@@ -1203,13 +1480,47 @@ class ActivePlugin(Plugin):
             #. Load persistent data into :attr:`host`
             #. call do_feature() method
             #. save host persistent data
+            #. export run metrics if :attr:`metrics_exporter` is set
         """
         try:
-            self.load_host_data()
+            with self.timings.phase('load'):
+                self.load_host_data()
             self.do_feature()
             self.save_host_data()
         except Exception, e:
             self.error('Plugin internal error : %s' % e, exception=e)
+        finally:
+            self.export_metrics()
+
+    def get_metrics(self):
+        """Returns the metrics of the plugin run as a dictionary (see :mod:`naghelp.metrics`)"""
+        level = self.response.level or self.response.get_current_level()
+        return { 'plugin' : '%s.%s' % (self.__class__.__module__,self.__class__.__name__),
+                 'level' : level.name,
+                 'run_duration' : (datetime.datetime.now() - self.starttime).total_seconds(),
+                 'collect_duration' : self.timings.wall('collect'),
+                 'timeouts' : self.collect_timeouts,
+                 'collected_bytes' : self.collected_bytes,
+                 'response_size' : self.response.output_size }
+
+    def export_metrics(self):
+        """Give the plugin run metrics to :attr:`metrics_exporter` if set"""
+        if self.metrics_exporter is not None:
+            try:
+                self.metrics_exporter.export(self.get_metrics())
+            except Exception, e:
+                self.debug('Metrics export failed : %s', e)
+
+
+def _data_size(data):
+    """Returns the total size of the strings in data (recursive)"""
+    if isinstance(data, basestring):
+        return len(data)
+    if isinstance(data, dict):
+        return sum([ _data_size(v) for v in data.values() ])
+    if isinstance(data, (list, tuple)):
+        return sum([ _data_size(v) for v in data ])
+    return 0
 
 
 def datetime_handler(obj):
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+#
+# Création : 16 Oct 2026
+#
+# @author: Eric Lapouyade
+"""This module records collected data into a corpus and replays them to benchmark parsing
+
+When a plugin is run with ``--corpus=DIR`` option (or when
+:attr:`~naghelp.ActivePlugin.corpus_dir` attribute is set), the collected raw data are archived
+as a timestamped snapshot : a gzip compressed compact json file stored in
+``DIR/<plugin module.class>/<host name>/<timestamp>.json.gz``. Only the
+:attr:`~naghelp.ActivePlugin.corpus_max_snapshots` most recent snapshots are kept per host.
+Passwords and SNMP communities of the host parameters are masked in the snapshots.
+
+The snapshots can then be replayed offline through :meth:`~naghelp.ActivePlugin.parse_data` and
+:meth:`~naghelp.ActivePlugin.build_response` in a pool of processes in order to benchmark parsing
+changes against real production data::
+
+    python -m naghelp.replay --path=/path/to/plugins/dir -j 4 -n 10 /tmp/naghelp/corpus
+
+The report gives, per plugin, the number of snapshots, replays and errors, the throughput
+(replays per second of one process) and the latency percentiles (in milliseconds)::
+
+    Plugin                          Snaps  Runs  Errs   Runs/s   p50 ms   p90 ms   p99 ms
+    myplugins.sun.CheckSunServer       42   420     0   1234.5    0.712    1.103    2.425
+"""
+
+import os
+import sys
+import time
+import gzip
+import json
+import glob
+import math
+import datetime
+import importlib
+import traceback
+from optparse import OptionParser
+import textops
+import naghelp
+
+__all__ = ['save_snapshot', 'load_snapshot', 'record_snapshot', 'find_snapshots',
+           'replay_snapshot', 'replay_corpus', 'format_report', 'mask_host_params']
+
+SNAPSHOT_EXT = '.json.gz'
+
+def _json_default(obj):
+    if isinstance(obj, (datetime.datetime,datetime.date)):
+        return obj.isoformat()
+    return None
+
+def _to_str(obj):
+    """Convert back unicode strings into byte strings (see :func:`save_snapshot`)"""
+    if isinstance(obj, unicode):
+        try:
+            return obj.encode('latin-1')
+        except UnicodeEncodeError:
+            return obj
+    if isinstance(obj, dict):
+        return dict([ (_to_str(k), _to_str(v)) for k,v in obj.items() ])
+    if isinstance(obj, list):
+        return [ _to_str(v) for v in obj ]
+    return obj
+
+def save_snapshot(filename, snapshot):
+    """Save a snapshot in a gzip compressed compact json file
+
+    Byte strings are stored as latin-1 : this way, any binary collected data are restored
+    byte for byte by :func:`load_snapshot`.
+
+    Args:
+
+        filename (str): The snapshot file path, directories are created if needed
+        snapshot (dict): The snapshot to save
+
+    Examples:
+
+        >>> import tempfile
+        >>> from naghelp.replay import save_snapshot, load_snapshot
+        >>> filename = os.path.join(tempfile.mkdtemp(), 'snap.json.gz')
+        >>> save_snapshot(filename, {'data': {'uname':'SunOS\\xe9\\n', 'nb': 3}})
+        >>> snapshot = load_snapshot(filename)
+        >>> snapshot['data']['uname'], snapshot['data']['nb']
+        ('SunOS\\xe9\\n', 3)
+    """
+    filedir = os.path.dirname(filename)
+    if filedir and not os.path.exists(filedir):
+        os.makedirs(filedir)
+    content = json.dumps(snapshot, separators=(',',':'), encoding='latin-1', default=_json_default)
+    tmp_file = '%s.tmp%s' % (filename, os.getpid())
+    with gzip.open(tmp_file, 'wb') as fh:
+        fh.write(content)
+    os.rename(tmp_file, filename)
+
+def load_snapshot(filename):
+    """Load a snapshot saved by :func:`save_snapshot`
+
+    Args:
+
+        filename (str): The snapshot file path
+
+    Returns:
+
+        dict: The snapshot
+    """
+    with gzip.open(filename, 'rb') as fh:
+        return _to_str(json.loads(fh.read()))
+
+#: Host parameters masked in snapshots : corpus files may be shared with other people
+SECRET_HOST_PARAMS = [ 'passwd', 'password', 'community', 'community_alt', 'authpp', 'privpp',
+                       'auth_passwd', 'priv_passwd' ]
+
+def mask_host_params(host):
+    """Returns a copy of host parameters where passwords and communities are masked
+
+    >>> from naghelp.replay import mask_host_params
+    >>> sorted(mask_host_params({'name':'srv1', 'user':'admin', 'passwd':'secret', 'community':''}).items())
+    [('community', ''), ('name', 'srv1'), ('passwd', '********'), ('user', 'admin')]
+    """
+    return dict([ (k, '********' if v and k in SECRET_HOST_PARAMS else v) for k,v in host.items() ])
+
+def record_snapshot(plugin, corpus_dir, max_snapshots=None):
+    """Archive the data collected by a plugin into a corpus directory
+
+    The host parameters listed in :data:`SECRET_HOST_PARAMS` are masked.
+
+    Args:
+
+        plugin (:class:`~naghelp.ActivePlugin`): The plugin that has just collected data
+        corpus_dir (str): The corpus base directory
+        max_snapshots (int): The maximum number of snapshots to keep for the plugin and the host,
+            older ones are deleted (Default : None, no limit)
+
+    Returns:
+
+        str: The snapshot file path
+    """
+    now = datetime.datetime.now()
+    plugin_name = '%s.%s' % (plugin.__class__.__module__, plugin.__class__.__name__)
+    host_name = str(plugin.host.name or 'unknown').replace(os.sep, '_')
+    snapshot_dir = os.path.join(corpus_dir, plugin_name, host_name)
+    filename = os.path.join(snapshot_dir, now.strftime('%Y%m%d-%H%M%S.%f') + SNAPSHOT_EXT)
+    save_snapshot(filename, { 'plugin' : plugin_name,
+                              'host_name' : host_name,
+                              'date' : now.isoformat(),
+                              'collect_duration' : plugin.timings.wall('collect'),
+                              'host' : mask_host_params(plugin.host),
+                              'data' : plugin.data })
+    if max_snapshots:
+        for old_file in sorted(glob.glob(os.path.join(snapshot_dir, '*' + SNAPSHOT_EXT)))[:-max_snapshots]:
+            try:
+                os.unlink(old_file)
+            except OSError:
+                pass
+    return filename
+
+def find_snapshots(corpus_dirs, plugin_filter=None):
+    """Returns the snapshots file paths found in corpus directories
+
+    Args:
+
+        corpus_dirs (str or list): corpus directories or snapshot files
+        plugin_filter (str): if not None, only snapshots of plugins whose name contains this
+            string are returned.
+
+    Returns:
+
+        list: The sorted snapshots file paths
+    """
+    if isinstance(corpus_dirs, basestring):
+        corpus_dirs = [corpus_dirs]
+    files = []
+    for corpus_dir in corpus_dirs:
+        if os.path.isfile(corpus_dir):
+            files.append(corpus_dir)
+            continue
+        for root, dirs, filenames in os.walk(corpus_dir):
+            files += [ os.path.join(root, f) for f in filenames if f.endswith(SNAPSHOT_EXT) ]
+    if plugin_filter:
+        files = [ f for f in files if plugin_filter in os.path.basename(os.path.dirname(os.path.dirname(f))) ]
+    return sorted(files)
+
+def _get_plugin_class(plugin_name):
+    module_name, class_name = plugin_name.rsplit('.',1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+def _new_plugin(plugin_class, host_params, data_json):
+    """Create a plugin instance ready for parse_data() without running load_host_data()"""
+    plugin = plugin_class()
+    plugin.options = textops.DictExt()
+    host = plugin.host_class.__new__(plugin.host_class)
+    host._plugin = plugin
+    host.update(host_params)
+    plugin.host = host
+    plugin.data = textops.DictExt(_to_str(json.loads(data_json)))
+    return plugin
+
+def replay_snapshot(filename, repeat=1):
+    """Replay one snapshot through parse_data() and build_response()
+
+    The plugin class is imported from the module/class name stored in the snapshot : the plugin
+    modules must be in python path. Each replay is done with a new plugin instance and a fresh
+    copy of the collected data. The measured time includes :meth:`~naghelp.ActivePlugin.parse_data`,
+    :meth:`~naghelp.ActivePlugin.build_response` and the response rendering.
+
+    Args:
+
+        filename (str): The snapshot file path
+        repeat (int): The number of replays (Default : 1)
+
+    Returns:
+
+        dict: ``{'plugin': name, 'file': filename, 'durations': [seconds,...], 'error': msg}``
+    """
+    result = { 'plugin' : None, 'file' : filename, 'durations' : [], 'error' : None }
+    try:
+        snapshot = load_snapshot(filename)
+        result['plugin'] = snapshot['plugin']
+        plugin_class = _get_plugin_class(snapshot['plugin'])
+        data_json = json.dumps(snapshot['data'], encoding='latin-1')
+        for i in range(repeat):
+            plugin = _new_plugin(plugin_class, snapshot.get('host') or {}, data_json)
+            start = time.time()
+            plugin.parse_data(plugin.data)
+            plugin.build_response(plugin.data)
+            plugin.response.get_output()
+            result['durations'].append(time.time() - start)
+    except Exception,e:
+        result['error'] = '%s: %s\n%s' % (e.__class__.__name__, e, traceback.format_exc())
+    return result
+
+def _replay_snapshot_args(args):
+    return replay_snapshot(*args)
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile of a list of values
+
+    >>> from naghelp.replay import percentile
+    >>> percentile(range(1,101), 50), percentile(range(1,101), 99), percentile([], 50)
+    (50, 99, None)
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+def replay_corpus(corpus_dirs, jobs=None, repeat=1, plugin_filter=None):
+    """Replay all snapshots of corpus directories in a pool of processes
+
+    Args:
+
+        corpus_dirs (str or list): corpus directories or snapshot files
+        jobs (int): The number of processes (Default : number of CPUs).
+            If 1, snapshots are replayed in the current process.
+        repeat (int): The number of replays per snapshot (Default : 1)
+        plugin_filter (str): if not None, only replay plugins whose name contains this string
+
+    Returns:
+
+        dict: per plugin statistics :
+        ``{ plugin : {'snapshots', 'runs', 'errors', 'error_samples', 'total', 'throughput', 'p50', 'p90', 'p99'} }``
+        durations are in seconds, throughput is in replays per second of one process.
+
+    Examples:
+
+        >>> import tempfile
+        >>> from naghelp.replay import save_snapshot, replay_corpus
+        >>> corpus_dir = tempfile.mkdtemp()
+        >>> for i in range(3):
+        ...     save_snapshot(os.path.join(corpus_dir,'snap%s.json.gz' % i),
+        ...                   {'plugin':'naghelp.plugin.ActivePlugin', 'host':{'name':'h%s' % i},
+        ...                    'data':{'uname':'SunOS'}})
+        >>> stats = replay_corpus(corpus_dir, jobs=1, repeat=2)
+        >>> s = stats['naghelp.plugin.ActivePlugin']
+        >>> s['snapshots'], s['runs'], s['errors'], s['p50'] <= s['p99']
+        (3, 6, 0, True)
+    """
+    files = find_snapshots(corpus_dirs, plugin_filter)
+    tasks = [ (f, repeat) for f in files ]
+    if jobs == 1:
+        results = map(_replay_snapshot_args, tasks)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_replay_snapshot_args, tasks, chunksize=max(1, len(tasks) // ((jobs or 1) * 8) or 1))
+        finally:
+            pool.close()
+            pool.join()
+    stats = {}
+    durations = {}
+    for result in results:
+        name = result['plugin'] or '<unreadable snapshot>'
+        stat = stats.setdefault(name, {'snapshots':0, 'runs':0, 'errors':0, 'error_samples':[]})
+        stat['snapshots'] += 1
+        stat['runs'] += len(result['durations'])
+        durations.setdefault(name, []).extend(result['durations'])
+        if result['error']:
+            stat['errors'] += 1
+            if len(stat['error_samples']) < 3:
+                stat['error_samples'].append('%s : %s' % (result['file'], result['error']))
+    for name, stat in stats.items():
+        values = durations[name]
+        stat['total'] = sum(values)
+        stat['throughput'] = len(values) / stat['total'] if stat['total'] else None
+        for pct in [50, 90, 99]:
+            stat['p%s' % pct] = percentile(values, pct)
+    return stats
+
+def format_report(stats):
+    """Returns a text report of :func:`replay_corpus` statistics"""
+    def ms(value):
+        return '%8.3f' % (value * 1000) if value is not None else '       -'
+    lines = [ '%-40s %6s %6s %5s %9s %8s %8s %8s' % ('Plugin', 'Snaps', 'Runs', 'Errs', 'Runs/s',
+                                                    'p50 ms', 'p90 ms', 'p99 ms') ]
+    for name, stat in sorted(stats.items()):
+        throughput = '%9.1f' % stat['throughput'] if stat['throughput'] else '        -'
+        lines.append('%-40s %6s %6s %5s %s %s %s %s' % (name, stat['snapshots'], stat['runs'],
+                     stat['errors'], throughput, ms(stat['p50']), ms(stat['p90']), ms(stat['p99'])))
+    for name, stat in sorted(stats.items()):
+        for sample in stat['error_samples']:
+            lines.append('\n*** %s error in %s' % (name, sample))
+    return '\n'.join(lines)
+
+def main():
+    parser = OptionParser(usage='%prog [options] CORPUS_DIR_OR_SNAPSHOT [...]')
+    parser.add_option('-j', '--jobs', type='int', dest='jobs', default=None,
+                      help='Number of processes (Default : number of CPUs)')
+    parser.add_option('-n', '--repeat', type='int', dest='repeat', default=1,
+                      help='Number of replays per snapshot (Default : 1)')
+    parser.add_option('-p', '--plugin', dest='plugin_filter', default=None,
+                      help='Only replay plugins whose name contains this string')
+    parser.add_option('--path', dest='paths', action='append', default=[],
+                      help='Directory to add to python path to import plugins (may be repeated)')
+    options, args = parser.parse_args()
+    if not args:
+        parser.error('No corpus directory given')
+    sys.path[0:0] = options.paths
+    start = time.time()
+    stats = replay_corpus(args, options.jobs, options.repeat, options.plugin_filter)
+    elapsed = time.time() - start
+    print format_report(stats)
+    runs = sum([ s['runs'] for s in stats.values() ])
+    print '\n%s replays in %.3fs (%.1f replays/s)' % (runs, elapsed, runs / elapsed if elapsed else 0)
+    sys.exit(1 if any([ s['errors'] for s in stats.values() ]) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -134,6 +134,7 @@ class PluginResponse(object):
         self.more_msgs = []
         self.end_msgs = []
         self.perf_items = []
+        self.output_size = None
 
     def set_level(self, level):
         """Manually set the response level
@@ -1162,6 +1163,7 @@ class PluginResponse(object):
         naghelp.logger.info('Plugin output summary : %s' % self.synopsis)
 
         out = self.get_output(MAX_PIPE_OUTPUT_LENGTH if nagios_cmd else None)
+        self.output_size = len(out)
 
         naghelp.logger.debug('Plugin output :\n' + '#' * 80 + '\n' + out + '\n'+ '#' * 80)
 
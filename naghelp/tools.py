@@ -7,13 +7,21 @@
 """This module provides many utility functions and classes"""
 
 import signal
+import socket
+import sys
 import naghelp
 import time
 import fcntl
 import errno
 import os
+import json
+import struct
+import threading
+import Queue
+import hashlib
+import tempfile
 
-__all__ = ['Timeout', 'TimeoutError', 'Lockfile']
+__all__ = ['Timeout', 'TimeoutError', 'Lockfile', 'run_concurrently', 'CommandCache']
 
 class TimeoutError(Exception):
     """Exception raised when a connection or a collect it too long to process
@@ -27,6 +35,9 @@ class Timeout:
     """Set an execution timeout for a block of code
 
     It uses process signals, it should not work on windows platforms.
+    As signals can only be handled by the main thread, there is no timeout when used in other
+    threads : use :func:`run_concurrently` timeouts instead. A warning is logged the first time
+    a Timeout cannot be armed this way.
 
     Args:
 
@@ -44,16 +55,29 @@ class Timeout:
         >>>     time.sleep(4)
 
     """
+    warned_unarmed = False
     def __init__(self, seconds=1, error_message='Timeout'):
         self.seconds = seconds
         self.error_message = error_message
     def handle_timeout(self, signum, frame):
         raise TimeoutError(self.error_message)
     def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
+        try:
+            signal.signal(signal.SIGALRM, self.handle_timeout)
+        except ValueError:
+            # not in the main thread
+            self.armed = False
+            if not Timeout.warned_unarmed:
+                Timeout.warned_unarmed = True
+                naghelp.logger.warning('Timeout (%ss) not armed : signals only work in the main '
+                                       'thread, use run_concurrently() timeouts instead',
+                                       self.seconds)
+            return
+        self.armed = True
         signal.alarm(self.seconds)
     def __exit__(self, type, value, traceback):
-        signal.alarm(0)
+        if self.armed:
+            signal.alarm(0)
 
 class Lockfile:
     """Acquire a lock on a file, release it at the end
@@ -121,3 +145,492 @@ class Lockfile:
 
     def __del__(self):
         self.release()
+
+def is_private(st):
+    """Returns True if a file is owned by the current user and not writable by other users
+
+    Args:
+
+        st: The result of ``os.stat()`` or ``os.fstat()``
+
+    >>> is_private(os.stat(tempfile.mkdtemp()))
+    True
+    >>> is_private(os.stat('/tmp'))
+    False
+    """
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+# not defined by python 2 socket module
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+def get_peer_uid(sock):
+    """Returns the user id of the process at the other end of a connected unix socket
+
+    It uses ``SO_PEERCRED`` : None is returned on systems other than Linux.
+
+    >>> a,b = socket.socketpair()
+    >>> get_peer_uid(a) == os.getuid()
+    True
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    pid, uid, gid = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED,
+                                                        struct.calcsize('3i')))
+    return uid
+
+def bind_unix_socket(socket_path, socket_mode=0o600):
+    """Returns a unix stream socket listening on ``socket_path``
+
+    A missing directory is created with mode 0700. The socket file is created with mode 0600
+    then changed to ``socket_mode`` : no other user can connect to it in between.
+    """
+    socket_dir = os.path.dirname(socket_path)
+    if socket_dir and not os.path.exists(socket_dir):
+        os.makedirs(socket_dir, 0o700)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, socket_mode)
+    server.listen(128)
+    return server
+
+def connect_unix_socket(socket_path, timeout=None):
+    """Connects to a unix socket served by a process of the current user
+
+    The server user is checked with ``SO_PEERCRED``, this way, credentials are never sent to a
+    process of another user that would have created the socket first. Where ``SO_PEERCRED`` is not
+    available, the socket directory must be owned by the current user and not writable by others.
+
+    Args:
+
+        socket_path (str): The unix socket path
+        timeout (int): The timeout in seconds of the connection and of the next socket operations
+            (Default : None, no timeout)
+
+    Returns:
+
+        socket: The connected socket
+
+    Raises:
+
+        socket.error: if the server is not reachable or runs with another user
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        uid = get_peer_uid(sock)
+        if uid is None:
+            if not is_private(os.stat(os.path.dirname(os.path.abspath(socket_path)))):
+                raise socket.error(errno.EPERM, 'The directory of %s is not private' % socket_path)
+        elif uid != os.getuid():
+            raise socket.error(errno.EPERM, '%s is served by another user (uid %s)' % (socket_path, uid))
+    except:
+        sock.close()
+        raise
+    return sock
+
+def send_msg(sock, obj):
+    """Send a json serializable object through a stream socket
+
+    The json string is prefixed by its length (4 bytes, network order) so that the peer knows
+    how many bytes to read (see :func:`recv_msg`).
+
+    Args:
+
+        sock (socket): A connected stream socket (usually an unix socket)
+        obj (dict): The object to send, it must be json serializable
+    """
+    data = json.dumps(obj)
+    sock.sendall(struct.pack('!I',len(data)) + data)
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size,65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+def recv_msg(sock):
+    """Receive an object sent by :func:`send_msg`
+
+    Args:
+
+        sock (socket): A connected stream socket (usually an unix socket)
+
+    Returns:
+
+        dict : The received object or None if the connection has been closed by the peer
+
+    Examples:
+
+        >>> import socket
+        >>> a,b = socket.socketpair()
+        >>> send_msg(a,{'argv':['launcher','myplugin','--name=host1'],'exit_code':2})
+        >>> msg = recv_msg(b)
+        >>> print msg['argv'], msg['exit_code']
+        [u'launcher', u'myplugin', u'--name=host1'] 2
+        >>> a.close()
+        >>> print recv_msg(b)
+        None
+    """
+    header = _recv_exactly(sock,4)
+    if header is None:
+        return None
+    size, = struct.unpack('!I',header)
+    data = _recv_exactly(sock,size)
+    if data is None:
+        return None
+    return json.loads(data)
+
+def run_concurrently(tasks, max_workers=8, timeout=None):
+    """Run tasks in a bounded pool of threads
+
+    Each task is a callable without argument. A task may have its own timeout : when reached,
+    a :class:`TimeoutError` is stored as the task result. Note that python threads cannot be
+    killed : the timed out thread still runs in background (as a daemon thread) but its result is
+    ignored. Such an abandoned thread still counts in ``max_workers`` : a new thread is only
+    started for the remaining tasks when it ends. If all threads are abandoned, the remaining tasks
+    wait for a free thread at most their own timeout, then they fail with a :class:`TimeoutError`.
+
+    Args:
+
+        tasks (dict or list of items): dictionary where values are callables or tuples
+            ``(callable, timeout)``
+        max_workers (int): The maximum number of threads alive at the same time, abandoned ones
+            included (Default : 8)
+        timeout (int): The default timeout in seconds for each task (Default : None, no timeout)
+
+    Returns:
+
+        dict, dict: A dictionary of results and a dictionary of exceptions for failed tasks,
+        both have the same keys as ``tasks``.
+
+    Examples:
+
+        >>> results, errors = run_concurrently({'a': lambda: 1, 'b': lambda: 1/0})
+        >>> print results
+        {'a': 1}
+        >>> print errors
+        {'b': ZeroDivisionError('integer division or modulo by zero',)}
+        >>> results, errors = run_concurrently({'slow': (lambda: time.sleep(3), 0.2)})
+        >>> print results, errors
+        {} {'slow': TimeoutError('Timeout (0.2s) for task slow',)}
+
+        The task ``b`` cannot start while the thread of the timed out task ``a`` is alive:
+
+        >>> tasks = [('a', (lambda: time.sleep(3), 0.2)), ('b', (lambda: 1, 0.3))]
+        >>> print run_concurrently(tasks, max_workers=1)
+        ({}, {'a': TimeoutError('Timeout (0.2s) for task a',), 'b': TimeoutError('Timeout (0.3s) for task b : no free thread',)})
+    """
+    if isinstance(tasks, dict):
+        tasks = tasks.items()
+    pending = Queue.Queue()
+    timeouts = {}
+    for key, task in tasks:
+        if isinstance(task, tuple):
+            func, task_timeout = task
+        else:
+            func, task_timeout = task, timeout
+        timeouts[key] = task_timeout
+        pending.put((key, func))
+    nb_tasks = len(timeouts)
+    queued = dict(timeouts)
+    events = Queue.Queue()
+    workers = set()
+    abandoned = set()
+
+    def worker():
+        me = threading.current_thread()
+        try:
+            while me not in abandoned:
+                try:
+                    key, func = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                events.put(('start', key, me))
+                try:
+                    events.put(('done', key, func()))
+                except Exception,e:
+                    events.put(('error', key, e))
+        finally:
+            events.put(('exit', None, me))
+
+    def start_workers():
+        while len(workers) < max_workers and len(workers - abandoned) < len(queued):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            workers.add(thread)
+            thread.start()
+
+    results = {}
+    errors = {}
+    running = {}
+    stalled_since = None
+    while len(results) + len(errors) < nb_tasks:
+        start_workers()
+        if not queued or workers - abandoned:
+            stalled_since = None
+        elif stalled_since is None:
+            # all threads are abandoned : queued tasks wait for one of them to end
+            stalled_since = time.time()
+        deadlines = [ deadline for deadline,thread in running.values() if deadline is not None ]
+        if stalled_since is not None:
+            deadlines += [ stalled_since + t for t in queued.values() if t is not None ]
+        # Always wait with a timeout : a blocking Queue.get() would delay signals like SIGALRM
+        wait = 1.0
+        if deadlines:
+            wait = min(wait, max(0, min(deadlines) - time.time()))
+        try:
+            event, key, value = events.get(True, wait)
+        except Queue.Empty:
+            now = time.time()
+            for key, (deadline, thread) in running.items():
+                if deadline is not None and deadline <= now:
+                    del running[key]
+                    abandoned.add(thread)
+                    errors[key] = TimeoutError('Timeout (%ss) for task %s' % (timeouts[key], key))
+                    naghelp.logger.debug('TASK : %s timed out after %ss', key, timeouts[key])
+            if stalled_since is not None:
+                kept = []
+                while True:
+                    try:
+                        key, func = pending.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if timeouts[key] is not None and stalled_since + timeouts[key] <= now:
+                        del queued[key]
+                        errors[key] = TimeoutError('Timeout (%ss) for task %s : no free thread'
+                                                   % (timeouts[key], key))
+                        naghelp.logger.debug('TASK : %s timed out waiting for a thread', key)
+                    else:
+                        kept.append((key, func))
+                for item in kept:
+                    pending.put(item)
+            continue
+        if event == 'exit':
+            workers.discard(value)
+            abandoned.discard(value)
+        elif event == 'start':
+            queued.pop(key, None)
+            deadline = time.time() + timeouts[key] if timeouts[key] is not None else None
+            running[key] = (deadline, value)
+        elif key in running:
+            del running[key]
+            if event == 'done':
+                results[key] = value
+            else:
+                errors[key] = value
+    return results, errors
+
+class CommandCache(object):
+    """File-backed cache for local commands results
+
+    Results are shared between all processes of the same user : each result is stored in
+    its own file, named after a sha1 of the command line. The directory is created with mode 0700,
+    the directory and the results not owned by the current user or writable by other users are
+    ignored : nobody else can give fake results to the plugins. While a command is being run for
+    the cache, other processes asking for the same command wait for its result instead of
+    running it too. Failed (non zero return code) or timed out runs are not stored. The least
+    recently used results are removed when there are more than ``max_entries`` results or when
+    they use more than ``max_size`` bytes.
+
+    The cache is used by :func:`naghelp.runsh`, :func:`naghelp.runshex`, :func:`naghelp.mrunsh`
+    and :func:`naghelp.mrunshex` when a ``cache_ttl`` is given. The default cache is
+    ``naghelp.tools.command_cache``.
+
+    Args:
+
+        directory (str): The directory where results are stored
+            (Default : '/tmp/naghelp/cmd_cache')
+        max_entries (int): The maximum number of results in the cache (Default : 1000)
+        max_size (int): The maximum size in bytes of the results in the cache (Default : 50MB)
+
+    Examples:
+
+        >>> import tempfile
+        >>> cache = CommandCache(tempfile.mkdtemp(), max_entries=2)
+        >>> calls = []
+        >>> def run():
+        ...     calls.append(1)
+        ...     return ('out\\n', '', 0)
+        >>> cache.cached(['uname','-a'], 60, run)
+        ('out\\n', '', 0)
+        >>> cache.cached(['uname','-a'], 60, run)
+        ('out\\n', '', 0)
+        >>> len(calls)
+        1
+        >>> print cache.get(['uname','-a'], 0)
+        None
+        >>> cache.set(['date'], ('now', '', 0))
+        >>> cache.set(['whoami'], ('me', '', 0))
+        >>> print cache.get(['uname','-a'], 60)
+        None
+    """
+    def __init__(self, directory='/tmp/naghelp/cmd_cache', max_entries=1000, max_size=50*1024*1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_size = max_size
+
+    def get_filename(self, argv):
+        """Returns the file path of the cached result for the command ``argv``"""
+        key = hashlib.sha1(json.dumps(argv, encoding='latin-1')).hexdigest()
+        return os.path.join(self.directory, '%s.json' % key)
+
+    def check_directory(self, create=False):
+        """Returns True if the cache directory exists and is private to the current user
+
+        Args:
+
+            create (bool): If True, the directory is created with mode 0700 if it does not exist
+        """
+        try:
+            if create and not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+            if is_private(os.stat(self.directory)):
+                return True
+            naghelp.logger.debug('CACHE : not used, %s is not owned by the current user or is '
+                                 'writable by other users', self.directory)
+        except OSError,e:
+            naghelp.logger.debug('CACHE : not used, %s : %s', self.directory, e)
+        return False
+
+    def get(self, argv, ttl):
+        """Returns the cached result of a command
+
+        Args:
+
+            argv (list): The command line
+            ttl (int): The maximum age in seconds of the result
+
+        Returns:
+
+            tuple: ``(stdout, stderr, return code)`` or None if there is no valid result in cache
+        """
+        filename = self.get_filename(argv)
+        if not self.check_directory():
+            return None
+        try:
+            with open(filename) as fh:
+                if not is_private(os.fstat(fh.fileno())):
+                    naghelp.logger.debug('CACHE : ignore %s : not owned by the current user or '
+                                         'writable by other users', filename)
+                    return None
+                entry = json.load(fh, encoding='latin-1')
+        except (IOError, OSError, ValueError):
+            return None
+        age = time.time() - entry['time']
+        if age > ttl:
+            return None
+        try:
+            # used for LRU eviction
+            os.utime(filename, None)
+        except OSError:
+            pass
+        naghelp.logger.debug('CACHE : hit for %s (age %.1fs, ttl %ss)', argv, age, ttl)
+        return (entry['stdout'].encode('latin-1'), entry['stderr'].encode('latin-1'), entry['rc'])
+
+    def set(self, argv, result):
+        """Stores the result ``(stdout, stderr, return code)`` of a command
+
+        A failed result (non zero return code) is not stored : the next call will run the command
+        again.
+        """
+        stdout, stderr, rc = result
+        if rc != 0:
+            naghelp.logger.debug('CACHE : not stored, return code %s for %s', rc, argv)
+            return
+        data = json.dumps({'argv':argv, 'time':time.time(), 'stdout':stdout, 'stderr':stderr,
+                           'rc':rc}, separators=(',',':'), encoding='latin-1')
+        filename = self.get_filename(argv)
+        if not self.check_directory(create=True):
+            return
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=self.directory, prefix='.tmp_')
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(data)
+            os.rename(tmp_file, filename)
+        except (IOError, OSError),e:
+            naghelp.logger.debug('CACHE : cannot write %s : %s', filename, e)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used results to respect ``max_entries`` and ``max_size``"""
+        entries = []
+        total_size = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError,e:
+            # removed by another process
+            naghelp.logger.debug('CACHE : cannot list %s : %s', self.directory, e)
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total_size += st.st_size
+        entries.sort()
+        while entries and (len(entries) > self.max_entries or total_size > self.max_size):
+            mtime, size, path = entries.pop(0)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total_size -= size
+            naghelp.logger.debug('CACHE : evicted %s', path)
+
+    def cached(self, argv, ttl, func, lock_timeout=30):
+        """Returns the cached result of a command or run it and store its result
+
+        Args:
+
+            argv (list): The command line
+            ttl (int): The maximum age in seconds of the cached result
+            func (callable): The function to call without argument to run the command,
+                it must return a tuple ``(stdout, stderr, return code)``
+            lock_timeout (int): The maximum time in seconds to wait for another process running
+                the same command. When reached, the command is run without using the cache.
+                (Default : 30)
+
+        Returns:
+
+            tuple: ``(stdout, stderr, return code)``
+        """
+        result = self.get(argv, ttl)
+        if result is not None:
+            return result
+        if not self.check_directory(create=True):
+            return func()
+        filename = self.get_filename(argv)
+        try:
+            lock = Lockfile(filename, timeout=lock_timeout, delay=0.05)
+            lock.acquire()
+        except (TimeoutError, IOError, OSError),e:
+            naghelp.logger.debug('CACHE : not used for %s : %s', argv, e)
+            return func()
+        try:
+            # the same command may have been run by another process while waiting for the lock
+            result = self.get(argv, ttl)
+            if result is None:
+                result = func()
+                self.set(argv, result)
+            return result
+        finally:
+            lock.release()
+
+command_cache = CommandCache()
+"""The default cache for local commands"""
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Création : 16 Oct 2026
+#
+# @author: Eric Lapouyade
+"""This module records collect spans into a trace file
+
+A span is a timed operation : a connection phase (DNS resolution, TCP connect, authentication,
+prompt wait) or a collect operation (a command, an OID, an URL). Each span is written as one
+JSON line into the trace file with its start/end timestamps, its duration, its outcome
+(``ok``, ``error`` or ``timeout``) and some attributes (host, command, byte counts...).
+This is useful to find out which devices or which commands are consuming the collect time.
+
+Tracing is disabled by default. To activate it, set the environment variable
+``NAGHELP_TRACE_FILE`` to the trace file path (for example in the Nagios command definition)
+or call :func:`set_trace_file`. Many plugins can write into the same trace file at the same time.
+When tracing is disabled, spans cost almost nothing.
+
+A trace line looks like this::
+
+    {"name":"ssh.command","host":"myhost","cmd":"df -h","bytes_out":1234,"outcome":"ok",
+     "start":1760630000.123456,"end":1760630000.234567,"duration":0.111111,
+     "pid":1234,"id":"1234-5","parent":"1234-2"}
+
+Passwords given in the command line options of the ``cmd`` and ``spawn`` attributes are masked
+(see :func:`mask_secrets`). The trace file is created readable by its owner only.
+"""
+
+import os
+import re
+import time
+import json
+import threading
+import itertools
+import naghelp
+
+__all__ = ['Tracer', 'tracer', 'set_trace_file', 'mask_secrets']
+
+SECRET_ATTRS = [ 'cmd', 'spawn' ]
+"""Span attributes where passwords are masked"""
+
+SECRET_WORDS = r'(?:passw|pwd|secret|community|authpp|privpp)'
+
+SECRET_REGEX = re.compile(r'''(?i)(
+        -{1,2}[\w-]*%(w)s[\w-]*(?:=|\s+)   # --password=xxx, -passwd xxx, --snmp-community xxx
+      | \b\w*%(w)s\w*=                    # PASSWORD=xxx, auth_passwd=xxx
+      | \bsshpass\s+-p\s*                  # sshpass -p xxx
+    )('[^']*'|"[^"]*"|\S+)''' % {'w' : SECRET_WORDS}, re.X)
+
+def mask_secrets(text):
+    """Returns a command line where passwords are masked
+
+    The values of options or variables with a name containing ``passw``, ``pwd``, ``secret``,
+    ``community``, ``authpp`` or ``privpp`` are masked, as well as the ``sshpass -p`` password.
+
+    >>> from naghelp.trace import mask_secrets
+    >>> print mask_secrets('mysql --user=root --password=secret -e "show status"')
+    mysql --user=root --password=******** -e "show status"
+    >>> print mask_secrets("sshpass -p 'my secret' ssh admin@srv1 cat /etc/passwd")
+    sshpass -p ******** ssh admin@srv1 cat /etc/passwd
+    >>> print mask_secrets('PGPASSWORD=secret psql -h srv1 ; snmpwalk --community public srv1')
+    PGPASSWORD=******** psql -h srv1 ; snmpwalk --community ******** srv1
+    """
+    return SECRET_REGEX.sub(r'\1********', text)
+
+class NullSpan(object):
+    """Span returned when tracing is disabled : does nothing"""
+    enabled = False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, name, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span(object):
+    """A timed operation, to be used as a context manager
+
+    The span is written into the trace file when the ``with:`` block ends. If an exception
+    occured, the outcome is ``error`` (or ``timeout`` for :class:`naghelp.TimeoutError`) and the
+    exception message is recorded in the ``error`` attribute.
+    """
+    enabled = True
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.id = '%s-%s' % (os.getpid(), tracer.next_id())
+        self.parent = None
+        self.start = None
+
+    def set(self, **attrs):
+        """Set span attributes"""
+        self.attrs.update(attrs)
+
+    def add(self, name, value):
+        """Add a value to a numerical span attribute (for byte counts for example)"""
+        self.attrs[name] = self.attrs.get(name, 0) + value
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1].id if stack else None
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        end = time.time()
+        stack = self.tracer.stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        record = { 'name' : self.name }
+        record.update(self.attrs)
+        if type is None:
+            record.setdefault('outcome', 'ok')
+        else:
+            record['outcome'] = 'timeout' if issubclass(type, naghelp.TimeoutError) else 'error'
+            record['error'] = '%s: %s' % (type.__name__, value)
+        record.update(start=round(self.start, 6), end=round(end, 6),
+                      duration=round(end - self.start, 6),
+                      pid=os.getpid(), id=self.id, parent=self.parent)
+        self.tracer.write(record)
+        return False
+
+class Tracer(object):
+    """Writes spans into a JSON lines file
+
+    Each span is written with a single ``write()`` system call on a file opened in append mode,
+    this way, many processes can write into the same trace file.
+
+    Args:
+
+        filename (str): The trace file path, None to disable tracing (Default : None)
+
+    Examples:
+
+        >>> import tempfile, json
+        >>> from naghelp.trace import Tracer
+        >>> filename = tempfile.mktemp()
+        >>> t = Tracer(filename)
+        >>> with t.span('ssh.connect', host='myhost'):
+        ...     with t.span('ssh.dns', host='myhost') as span:
+        ...         span.set(addr='127.0.0.1')
+        >>> try:
+        ...     with t.span('ssh.command', host='myhost', cmd='df') as span:
+        ...         span.add('bytes_out', 100)
+        ...         span.add('bytes_out', 23)
+        ...         raise IOError('Connection lost')
+        ... except IOError:
+        ...     pass
+        >>> spans = [ json.loads(line) for line in open(filename) ]
+        >>> for span in spans:
+        ...     print span['name'], span['outcome'], span.get('error'), span.get('bytes_out')
+        ssh.dns ok None None
+        ssh.connect ok None None
+        ssh.command error IOError: Connection lost 123
+        >>> spans[0]['parent'] == spans[1]['id'], spans[1]['parent'], spans[0]['addr']
+        (True, None, u'127.0.0.1')
+        >>> os.unlink(filename)
+        >>> Tracer().span('ssh.connect', host='myhost').enabled
+        False
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.fd = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counter = itertools.count(1)
+
+    @property
+    def enabled(self):
+        return bool(self.filename)
+
+    def next_id(self):
+        with self.lock:
+            return next(self.counter)
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def span(self, name, **attrs):
+        """Create a span
+
+        Args:
+
+            name (str): The span name, usually ``<protocol>.<operation>``
+            attrs (dict): The span attributes, passwords in ``cmd`` and ``spawn`` are masked
+
+        Returns:
+
+            :class:`Span`: A span to be used with ``with:``, it is a do-nothing object if tracing
+            is disabled.
+        """
+        if not self.filename:
+            return NULL_SPAN
+        for attr in SECRET_ATTRS:
+            if isinstance(attrs.get(attr), basestring):
+                attrs[attr] = mask_secrets(attrs[attr])
+        return Span(self, name, attrs)
+
+    def set_file(self, filename):
+        """Change the trace file (None to disable tracing)"""
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.filename = filename
+
+    def write(self, record):
+        try:
+            line = json.dumps(record, separators=(',',':'), default=str) + '\n'
+        except UnicodeDecodeError:
+            line = json.dumps(record, separators=(',',':'), default=str, encoding='latin-1') + '\n'
+        try:
+            with self.lock:
+                if self.fd is None:
+                    self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                os.write(self.fd, line)
+        except (IOError, OSError),e:
+            naghelp.logger.debug('trace -> cannot write into %s : %s',self.filename,e)
+
+tracer = Tracer(os.environ.get('NAGHELP_TRACE_FILE'))
+"""The default tracer used by collect classes and functions"""
+
+def set_trace_file(filename):
+    """Activate tracing into the given file (None to disable tracing)"""
+    tracer.set_file(filename)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Création : 16 Oct 2026
+#
+# @author: Eric Lapouyade
+"""Prompt mode benchmark : measures Ssh command output reading on multi-megabyte outputs
+
+A fake channel sends a big command output (like a network device configuration dump) in small
+chunks followed by the prompt. The time to read it up to the prompt and to remove the command
+echo and the prompt is measured for the current :class:`naghelp.Ssh` implementation and for the
+former one (whole buffer rescanned after each chunk). The script exits with code 1 if both
+implementations do not give the same output::
+
+    python tests/bench_prompt.py --sizes=1,4,8 --chunk-size=8192
+"""
+
+import os
+import re
+import sys
+import time
+from optparse import OptionParser
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from naghelp.collect import Ssh
+
+PROMPT = 'router01#'
+CMD = 'show running-config | include (interface|ip address)'
+
+class FakeChannel(object):
+    """Sends the command echo, the output then the prompt by chunks"""
+    def __init__(self, output, chunk_size):
+        self.output = output
+        self.chunk_size = chunk_size
+        self.pos = 0
+        self.data = ''
+
+    def send(self, data):
+        self.data = data.replace('\n', '\r\n') + self.output + '\r\n' + PROMPT
+        self.pos = 0
+
+    def recv(self, size):
+        size = min(size, self.chunk_size)
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+def make_output(size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = ' interface GigabitEthernet0/%d\r\n  description uplink-%d\r\n  ip address 10.%d.%d.1 255.255.255.0' % (
+            i % 48, i, (i // 256) % 256, i % 256)
+        lines.append(line)
+        total += len(line) + 2
+        i += 1
+    return '\r\n'.join(lines)
+
+def former_run_cmd(ssh, cmd):
+    """The former prompt mode implementation
+
+    The command is escaped here : the former implementation used it unescaped in a regex
+    """
+    ssh.chan.send('%s\n' % cmd)
+    buff = ''
+    while not ssh.prompt_pattern.search(buff):
+        buff += ssh.chan.recv(8192)
+    out = buff.replace('\r','')
+    rmcmd = re.compile(r'^.*?%s\n*' % re.escape(cmd), re.DOTALL)
+    out = rmcmd.sub('', out)
+    out = out.splitlines()[:-1]
+    return '\n'.join(out)
+
+def current_run_cmd(ssh, cmd):
+    return ssh._run_cmd(cmd, timeout=30)
+
+def measure(func, output, chunk_size):
+    ssh = Ssh.__new__(Ssh)
+    ssh.host = 'router01'
+    ssh.prompt_pattern = re.compile(r'[\r\n]%s' % re.escape(PROMPT))
+    ssh.chan = FakeChannel(output, chunk_size)
+    start = time.time()
+    result = func(ssh, CMD)
+    return time.time() - start, result
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--sizes', dest='sizes', default='1,4',
+                      help='Comma separated output sizes in MB (Default : 1,4)')
+    parser.add_option('-c', '--chunk-size', type='int', dest='chunk_size', default=8192,
+                      help='Size of the chunks sent by the fake channel (Default : 8192)')
+    parser.add_option('--skip-former', action='store_true', dest='skip_former', default=False,
+                      help='Do not measure the former implementation (it is slow on big outputs)')
+    options, args = parser.parse_args()
+
+    failed = False
+    print '%-10s %14s %14s %10s' % ('Size (MB)', 'Former (s)', 'Current (s)', 'Speedup')
+    print '-' * 51
+    for size in [ float(s) for s in options.sizes.split(',') ]:
+        output = make_output(int(size * 1024 * 1024))
+        current, current_result = measure(current_run_cmd, output, options.chunk_size)
+        if options.skip_former:
+            print '%-10s %14s %14.4f %10s' % (size, '-', current, '-')
+            continue
+        former, former_result = measure(former_run_cmd, output, options.chunk_size)
+        print '%-10s %14.4f %14.4f %9.1fx' % (size, former, current, former / current)
+        if current_result != former_result:
+            print '*** outputs differ for %sMB' % size
+            failed = True
+    print '-' * 51
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Création : 16 Oct 2026
+#
+# @author: Eric Lapouyade
+"""SNMP poller benchmark : measures SnmpPoller against one Snmp object per agent
+
+Local SNMP responders (see ``bench_snmp_walk.py``) are started, half of them are polled with
+SNMP v1, the other half with SNMP v2c. Each agent gets some scalars, an OID range and a missing
+OID, and walks two columns. The agents are first polled one after another with :meth:`Snmp.mget`
+and :meth:`Snmp.mwalk`, then all together with one :class:`naghelp.SnmpPoller`, both runs do the
+same work. Then, outside of the timings, an unreachable agent is added to another poller run to
+check it is reported in ``errors`` without disturbing the other agents. The script exits with
+code 1 if results differ or if errors are not reported as expected::
+
+    python tests/bench_snmp_poller.py --agents=10 --rows=100 --delay=10
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from bench_snmp_walk import start_responder, IF_TABLE, ARP_TABLE
+
+GETS = { 'name' : '1.3.6.1.2.1.1.5.0',
+         'descr' : '1.3.6.1.2.1.1.1.0',
+         'status' : '1.3.6.1.2.1.2.2.1.8.1-4',
+         'missing' : '1.3.6.1.2.1.1.9.0' }
+# the last column of the responder MIB is not walked : a synchronous SNMP v1 walk reaching the
+# end of the MIB gets the last row twice from pysnmp
+WALKS = { 'ifdescr' : '%s.1.2' % IF_TABLE,
+          'arpmac' : '%s.1.2' % ARP_TABLE }
+
+def agent_version(i):
+    return 1 if i % 2 else '2c'
+
+def poll_serial(ports):
+    from naghelp.collect import Snmp
+    results = {}
+    start = time.time()
+    for i, port in enumerate(ports):
+        snmp = Snmp('127.0.0.1', version=agent_version(i), port=port, timeout=30)
+        result = dict(snmp.mget(GETS))
+        result.update(snmp.mwalk(WALKS))
+        results['agent%d' % i] = result
+    return time.time() - start, results
+
+def poll_concurrent(ports, max_per_agent, dead_port=None):
+    from naghelp.collect import SnmpPoller
+    poller = SnmpPoller(max_per_agent=max_per_agent)
+    for i, port in enumerate(ports):
+        poller.add('127.0.0.1', key='agent%d' % i, version=agent_version(i), port=port,
+                   get=GETS, walk=WALKS)
+    if dead_port is not None:
+        poller.add('127.0.0.1', key='dead', port=dead_port, timeout=3, get=GETS, walk=WALKS)
+    start = time.time()
+    results = poller.run()
+    return time.time() - start, results, poller.errors
+
+def check_v3_conflict():
+    """Agents sharing a v3 user name with other credentials must be rejected"""
+    from naghelp.collect import SnmpPoller, CollectError
+    poller = SnmpPoller()
+    poller.add('127.0.0.1', user='monitor', auth_passwd='password1', auth_protocol='sha')
+    poller.add('127.0.0.1', user='monitor', auth_passwd='password1', auth_protocol='sha')
+    try:
+        poller.add('127.0.0.1', user='monitor', auth_passwd='password2', auth_protocol='sha')
+    except CollectError:
+        return True
+    return False
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-a', '--agents', type='int', dest='agents', default=10,
+                      help='Number of agents (Default : 10)')
+    parser.add_option('-r', '--rows', type='int', dest='rows', default=100,
+                      help='Tables size of each agent (Default : 100)')
+    parser.add_option('-d', '--delay', type='float', dest='delay', default=10,
+                      help='Delay in milliseconds added to each response (Default : 10)')
+    parser.add_option('-m', '--max-per-agent', type='int', dest='max_per_agent', default=2,
+                      help='Requests in flight per agent (Default : 2)')
+    parser.add_option('-p', '--port', type='int', dest='port', default=16200,
+                      help='UDP port of the first local responder (Default : 16200)')
+    options, args = parser.parse_args()
+
+    ports = range(options.port, options.port + options.agents)
+    dead_port = options.port + options.agents
+    failed = False
+    responders = [ start_responder(port, options.rows, options.delay / 1000.0) for port in ports ]
+    try:
+        serial, serial_results = poll_serial(ports)
+        concurrent, results, errors = poll_concurrent(ports, options.max_per_agent)
+        # not timed : the unreachable agent waits for its timeout
+        _, dead_results, dead_errors = poll_concurrent(ports, options.max_per_agent, dead_port)
+    finally:
+        for responder in responders:
+            responder.terminate()
+            responder.join()
+
+    values = sum([ len(v) if isinstance(v, list) else 1
+                   for result in serial_results.values() for v in result.values() ])
+    print '%-8s %8s %14s %14s %10s' % ('Agents', 'Values', 'Serial (s)', 'Poller (s)', 'Speedup')
+    print '-' * 58
+    print '%-8s %8s %14.4f %14.4f %9.1fx' % (options.agents, values, serial, concurrent,
+                                             serial / concurrent)
+    print '-' * 58
+    for key, result in sorted(serial_results.items()):
+        if dict(results.get(key, {})) != result or dict(dead_results.get(key, {})) != result:
+            print '*** poller results differ for %s' % key
+            failed = True
+    if errors:
+        print '*** no agent should have errors : %s' % errors
+        failed = True
+    if sorted(dead_errors) != ['dead'] or \
+       sorted(dead_errors['dead']) != sorted(GETS.keys() + WALKS.keys()):
+        print '*** only the unreachable agent should have errors : %s' % dead_errors
+        failed = True
+    if not check_v3_conflict():
+        print '*** conflicting snmp v3 credentials were accepted'
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
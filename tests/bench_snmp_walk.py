@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# Création : 16 Oct 2026
+#
+# @author: Eric Lapouyade
+"""SNMP walk benchmark : measures Snmp.walk() on big tables served by a local SNMP responder
+
+The responder is a small SNMPv1/v2c agent started in a child process : it serves an ifTable
+and an ARP table (ipNetToMediaTable) with the requested number of rows, it can delay each response
+to simulate the network latency (responses are not serialized : several requests may wait at the
+same time) and it answers ``tooBig`` when a response exceeds the given size. Each table is walked
+with SNMP v2c GETNEXT requests (``max_repetitions=0``) and with GETBULK requests. Then all the
+tables columns are walked with one :meth:`naghelp.Snmp.mwalk`, one walk after another
+(``max_in_flight=1``) and concurrently. The script exits with code 1 if results differ::
+
+    python tests/bench_snmp_walk.py --rows=1000,5000 --delay=2 --max-repetitions=25
+"""
+
+import os
+import sys
+import bisect
+import heapq
+import select
+import socket
+import time
+import multiprocessing
+from optparse import OptionParser
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+IF_TABLE = '1.3.6.1.2.1.2.2'
+ARP_TABLE = '1.3.6.1.2.1.4.22'
+COLUMNS = dict([ ('if%d' % col, '%s.1.%d' % (IF_TABLE, col)) for col in range(1, 11) ] +
+               [ ('arp%d' % col, '%s.1.%d' % (ARP_TABLE, col)) for col in (2, 3) ])
+V1_TYPES = { 'Gauge32': 'Gauge', 'Counter32': 'Counter' }
+
+def make_mib(rows):
+    """Returns a sorted list of (oid tuple, (type name, value))"""
+    mib = [ ((1,3,6,1,2,1,1,1,0), ('OctetString', 'naghelp benchmark responder')),
+            ((1,3,6,1,2,1,1,3,0), ('TimeTicks', 123456)),
+            ((1,3,6,1,2,1,1,5,0), ('OctetString', 'core-switch-01')) ]
+    for i in range(1, rows + 1):
+        columns = [ ('Integer', i),
+                    ('OctetString', 'GigabitEthernet%d/%d' % (i // 48, i % 48)),
+                    ('Integer', 6),
+                    ('Integer', 1500),
+                    ('Gauge32', 1000000000),
+                    ('OctetString', '\x00\x1b\x21' + chr(i // 65536) + chr(i // 256 % 256) + chr(i % 256)),
+                    ('Integer', 1),
+                    ('Integer', 1 + i % 2),
+                    ('TimeTicks', i * 100),
+                    ('Counter32', i * 1234567 % 4294967296) ]
+        for col, value in enumerate(columns):
+            mib.append(((1,3,6,1,2,1,2,2,1,col + 1,i), value))
+        ip = (10, i // 65536, i // 256 % 256, i % 256)
+        mib.append(((1,3,6,1,2,1,4,22,1,2,1) + ip, ('OctetString', '\x00\x50\x56' + ''.join(map(chr, ip[1:])))))
+        mib.append(((1,3,6,1,2,1,4,22,1,3,1) + ip, ('IpAddress', '.'.join(map(str, ip)))))
+    mib.sort()
+    return mib
+
+def serve(port, rows, delay, max_size, ready):
+    """The SNMP responder : GET, GETNEXT and GETBULK requests, v1 and v2c"""
+    from pyasn1.codec.ber import decoder, encoder
+    from pysnmp.proto import api
+    mib = make_mib(rows)
+    oids = [ oid for oid, value in mib ]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', port))
+    ready.set()
+
+    def make_value(pMod, type_name, value):
+        if pMod is api.v1:
+            type_name = V1_TYPES.get(type_name, type_name)
+        return getattr(pMod, type_name)(value)
+
+    def next_varbind(pMod, oid):
+        i = bisect.bisect_right(oids, tuple(oid))
+        if i >= len(oids):
+            return None
+        name, (type_name, value) = mib[i]
+        return pMod.ObjectIdentifier(name), make_value(pMod, type_name, value)
+
+    def respond(msg):
+        version = int(api.decodeMessageVersion(msg))
+        pMod = api.protoModules[version]
+        req_msg, rest = decoder.decode(msg, asn1Spec=pMod.Message())
+        req_pdu = pMod.apiMessage.getPDU(req_msg)
+        rsp_msg = pMod.apiMessage.getResponse(req_msg)
+        rsp_pdu = pMod.apiMessage.getPDU(rsp_msg)
+        req_varbinds = pMod.apiPDU.getVarBinds(req_pdu)
+        varbinds = []
+        error_index = None
+        if req_pdu.isSameTypeWith(pMod.GetRequestPDU()):
+            for i, (oid, val) in enumerate(req_varbinds):
+                pos = bisect.bisect_left(oids, tuple(oid))
+                if pos < len(oids) and oids[pos] == tuple(oid):
+                    name, (type_name, value) = mib[pos]
+                    varbinds.append((oid, make_value(pMod, type_name, value)))
+                elif version == 0:
+                    error_index = error_index or i + 1
+                    varbinds.append((oid, val))
+                else:
+                    varbinds.append((oid, api.v2c.NoSuchInstance('')))
+        elif req_pdu.isSameTypeWith(pMod.GetNextRequestPDU()):
+            for i, (oid, val) in enumerate(req_varbinds):
+                varbind = next_varbind(pMod, oid)
+                if varbind is None:
+                    if version == 0:
+                        error_index = error_index or i + 1
+                        varbind = (oid, val)
+                    else:
+                        varbind = (oid, api.v2c.EndOfMibView(''))
+                varbinds.append(varbind)
+        elif version and req_pdu.isSameTypeWith(pMod.GetBulkRequestPDU()):
+            non_repeaters = int(pMod.apiBulkPDU.getNonRepeaters(req_pdu))
+            max_repetitions = int(pMod.apiBulkPDU.getMaxRepetitions(req_pdu))
+            for oid, val in req_varbinds[:non_repeaters]:
+                varbinds.append(next_varbind(pMod, oid) or (oid, api.v2c.EndOfMibView('')))
+            repeaters = [ oid for oid, val in req_varbinds[non_repeaters:] ]
+            for rep in range(max_repetitions):
+                row = []
+                for i, oid in enumerate(repeaters):
+                    varbind = next_varbind(pMod, oid) or (oid, api.v2c.EndOfMibView(''))
+                    row.append(varbind)
+                    repeaters[i] = varbind[0]
+                varbinds.extend(row)
+                if all([ isinstance(val, api.v2c.EndOfMibView) for oid, val in row ]):
+                    break
+        if error_index:
+            pMod.apiPDU.setErrorStatus(rsp_pdu, 2)
+            pMod.apiPDU.setErrorIndex(rsp_pdu, error_index)
+            varbinds = req_varbinds
+        pMod.apiPDU.setVarBinds(rsp_pdu, varbinds)
+        data = encoder.encode(rsp_msg)
+        if len(data) > max_size:
+            pMod.apiPDU.setErrorStatus(rsp_pdu, 1)
+            pMod.apiPDU.setVarBinds(rsp_pdu, [])
+            data = encoder.encode(rsp_msg)
+        return data
+
+    waiting = []
+    while True:
+        timeout = max(0, waiting[0][0] - time.time()) if waiting else None
+        if select.select([sock], [], [], timeout)[0]:
+            msg, addr = sock.recvfrom(65535)
+            heapq.heappush(waiting, (time.time() + delay, respond(msg), addr))
+        while waiting and waiting[0][0] <= time.time():
+            due, data, addr = heapq.heappop(waiting)
+            sock.sendto(data, addr)
+
+def start_responder(port, rows, delay=0, max_size=65000):
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=serve, args=(port, rows, delay, max_size, ready))
+    process.daemon = True
+    process.start()
+    ready.wait(30)
+    return process
+
+def measure(port, oid, max_repetitions):
+    from naghelp.collect import Snmp
+    snmp = Snmp('127.0.0.1', version='2c', port=port, timeout=30, max_repetitions=max_repetitions)
+    start = time.time()
+    result = snmp.walk(oid)
+    return time.time() - start, result
+
+def measure_mwalk(port, max_repetitions, max_in_flight):
+    from naghelp.collect import Snmp
+    snmp = Snmp('127.0.0.1', version='2c', port=port, timeout=30, max_repetitions=max_repetitions,
+                max_in_flight=max_in_flight)
+    start = time.time()
+    result = snmp.mwalk(COLUMNS)
+    return time.time() - start, result
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-r', '--rows', dest='rows', default='200,1000',
+                      help='Comma separated tables sizes (Default : 200,1000)')
+    parser.add_option('-d', '--delay', type='float', dest='delay', default=1,
+                      help='Delay in milliseconds added to each response (Default : 1)')
+    parser.add_option('-m', '--max-repetitions', type='int', dest='max_repetitions', default=25,
+                      help='GETBULK max-repetitions (Default : 25)')
+    parser.add_option('-f', '--max-in-flight', type='int', dest='max_in_flight', default=8,
+                      help='Concurrent walks in mwalk (Default : 8)')
+    parser.add_option('-s', '--max-size', type='int', dest='max_size', default=65000,
+                      help='Responses bigger than this size get a tooBig error (Default : 65000)')
+    parser.add_option('-p', '--port', type='int', dest='port', default=16161,
+                      help='UDP port of the local responder (Default : 16161)')
+    options, args = parser.parse_args()
+
+    failed = False
+    print '%-8s %-10s %8s %14s %14s %10s' % ('Rows', 'Table', 'Values', 'GETNEXT (s)', 'GETBULK (s)', 'Speedup')
+    print '%-8s %-10s %8s %14s %14s %10s' % ('', '', '', 'serial mwalk', 'concurrent', '')
+    print '-' * 69
+    for rows in [ int(r) for r in options.rows.split(',') ]:
+        responder = start_responder(options.port, rows, options.delay / 1000.0, options.max_size)
+        try:
+            for name, oid in [ ('ifTable', IF_TABLE), ('arpTable', ARP_TABLE) ]:
+                getnext, getnext_result = measure(options.port, oid, 0)
+                getbulk, getbulk_result = measure(options.port, oid, options.max_repetitions)
+                print '%-8s %-10s %8s %14.4f %14.4f %9.1fx' % (rows, name, len(getbulk_result),
+                                                             getnext, getbulk, getnext / getbulk)
+                if getnext_result != getbulk_result:
+                    print '*** walk results differ for %s with %s rows' % (name, rows)
+                    failed = True
+            serial, serial_result = measure_mwalk(options.port, options.max_repetitions, 1)
+            concurrent, concurrent_result = measure_mwalk(options.port, options.max_repetitions,
+                                                          options.max_in_flight)
+            values = sum([ len(lst) for lst in concurrent_result.values() ])
+            print '%-8s %-10s %8s %14.4f %14.4f %9.1fx' % (rows, 'mwalk', values, serial,
+                                                         concurrent, serial / concurrent)
+            if serial_result != concurrent_result:
+                print '*** mwalk results differ with %s rows' % rows
+                failed = True
+        finally:
+            responder.terminate()
+            responder.join()
+    print '-' * 69
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Création : 16 Oct 2026
+#
+# @author: Eric Lapouyade
+"""Startup benchmark : measures naghelp import time and a minimal ActivePlugin run
+
+Each measure is done in a fresh python interpreter, the median of all runs is displayed.
+The bare interpreter startup time is subtracted from other measures.
+The script exits with code 1 if a measure exceeds its budget, this way it can be used to
+catch startup time regressions::
+
+    python tests/bench_startup.py --runs=20 --import-budget=0.05 --run-budget=0.3
+"""
+
+import os
+import sys
+import time
+import subprocess
+from optparse import OptionParser
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['textops', 'dateutil', 'addicted', 'naghelp.collect', 'naghelp.plugin']
+
+SCENARIOS = [
+    ('interpreter', 'pass', []),
+    ('import naghelp', 'import naghelp', []),
+    ('PluginResponse', 'from naghelp import PluginResponse, OK\n'
+                       'r = PluginResponse(OK)\n'
+                       'r.add(OK,"ok")\n'
+                       'r.get_output()', []),
+    ('ActivePlugin run', 'from naghelp import ActivePlugin\n'
+                         'ActivePlugin().run()', ['--ip=127.0.0.1']),
+]
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n//2]
+    return (values[n//2-1] + values[n//2]) / 2.0
+
+def measure(code, args, runs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = BASE_DIR + os.pathsep + env.get('PYTHONPATH','')
+    with open(os.devnull,'w') as devnull:
+        timings = []
+        for i in range(runs):
+            start = time.time()
+            subprocess.call([sys.executable, '-c', code] + args, env=env, stdout=devnull, stderr=devnull)
+            timings.append(time.time() - start)
+    return median(timings)
+
+def loaded_heavy_modules():
+    code = 'import sys, naghelp\nprint ",".join([ m for m in %r if m in sys.modules ])' % HEAVY_MODULES
+    env = dict(os.environ)
+    env['PYTHONPATH'] = BASE_DIR + os.pathsep + env.get('PYTHONPATH','')
+    p = subprocess.Popen([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE)
+    out, err = p.communicate()
+    return [ m for m in out.strip().split(',') if m ]
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--runs', type='int', dest='runs', default=10,
+                      help='Number of runs per measure (Default : 10)')
+    parser.add_option('--import-budget', type='float', dest='import_budget', default=None,
+                      help='Maximum time in seconds for "import naghelp"')
+    parser.add_option('--run-budget', type='float', dest='run_budget', default=None,
+                      help='Maximum time in seconds for a minimal ActivePlugin run')
+    options, args = parser.parse_args()
+
+    results = {}
+    base = None
+    print '%-20s %12s %12s' % ('Scenario', 'Median (s)', 'Overhead (s)')
+    print '-' * 46
+    for name, code, code_args in SCENARIOS:
+        duration = measure(code, code_args, options.runs)
+        if base is None:
+            base = duration
+        results[name] = duration - base
+        print '%-20s %12.4f %12.4f' % (name, duration, duration - base)
+    print '-' * 46
+
+    heavy = loaded_heavy_modules()
+    print 'Heavy modules loaded by "import naghelp" : %s' % (', '.join(heavy) or 'none')
+
+    failed = False
+    if heavy:
+        print '*** "import naghelp" must not load heavy modules'
+        failed = True
+    for name, budget in [('import naghelp', options.import_budget),
+                         ('ActivePlugin run', options.run_budget)]:
+        if budget is not None and results[name] > budget:
+            print '*** %s : %.4fs exceeds the budget of %.4fs' % (name, results[name], budget)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
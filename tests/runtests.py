@@ -8,6 +8,9 @@ modules = [ 'naghelp.host',
             'naghelp.response',
             'naghelp.launcher',
             'naghelp.mixins',
+            'naghelp.metrics',
+            'naghelp.trace',
+            'naghelp.replay',
             ]
 files = [ 'docs/intro.rst' ]
 